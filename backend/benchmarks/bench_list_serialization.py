@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Serialization cost of the list endpoints, per 1k projects.
+
+"response_model" is the old path: one ProjetoResponse per row, then FastAPI's
+serialize_response (model_dump, validation against List[ProjetoResponse],
+jsonable_encoder) and json.dumps, as JSONResponse does.
+"trusted" is trusted_list_response(): per-model field plan plus orjson.
+Both run on the same synthetic rows; the outputs are checked to be equal.
+No database is needed.
+
+Usage (from backend/):
+    python benchmarks/bench_list_serialization.py --rows 1000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+# server.py needs these at import time; nothing here talks to Mongo
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "agrolink_bench")
+
+
+def make_rows(count, rng):
+    def etapa(k):
+        return {
+            "etapa_id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "etapa_nome": f"Etapa {k}",
+            "data_inicio": "2025-03-01T12:00:00+00:00",
+            "data_fim": "2025-03-09T12:00:00+00:00",
+            "dias_duracao": 8,
+            "pendencias": [{"descricao": "CAR desatualizado", "resolvida": True,
+                            "data_criacao": "2025-03-02T12:00:00+00:00",
+                            "data_resolucao": "2025-03-04T12:00:00+00:00"}] * rng.randint(0, 2),
+            "observacoes": [{"texto": "Cliente enviou a matrícula", "usuario_nome": "Analista",
+                             "data": "2025-03-03T12:00:00+00:00"}] * rng.randint(0, 2),
+        }
+
+    return [{
+        "id": str(uuid.UUID(int=rng.getrandbits(128))),
+        "cliente_id": str(uuid.UUID(int=rng.getrandbits(128))),
+        "etapa_atual_id": "etapa",
+        "etapa_atual_nome": "Desenvolvimento do Projeto",
+        "status": "em_andamento",
+        "documentos_check": {"rg_cnh": True, "conta_banco_brasil": True, "car": rng.random() < 0.5},
+        "historico_etapas": [etapa(k) for k in range(rng.randint(1, 8))],
+        "data_inicio": "2025-03-01T12:00:00+00:00",
+        "valor_credito": float(rng.randint(10, 500) * 1000),
+        "tipo_projeto": "PRONAF A",
+        "created_at": "2025-03-01T12:00:00+00:00",
+        "cliente_nome": f"Produtor {i}",
+        "cliente_cpf": f"{rng.randrange(10**11):011d}",
+        "cliente_telefone": "67999990000",
+        "tem_pendencia": False,
+    } for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    import server
+    from fastapi.routing import serialize_response
+
+    rows = make_rows(args.rows, random.Random(args.seed))
+    route = next(r for r in server.app.routes if getattr(r, "path", "") == "/api/projects" and "GET" in r.methods)
+
+    def response_model_path():
+        models = [server.ProjetoResponse(**row) for row in rows]
+        content = asyncio.run(serialize_response(field=route.response_field, response_content=models))
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode()
+
+    def trusted_path():
+        return server.trusted_list_response(server.ProjetoResponse, rows).body
+
+    assert json.loads(response_model_path()) == json.loads(trusted_path())
+
+    print(f"rows: {args.rows}, iterations: {args.iterations}, orjson: {server.orjson is not None}")
+    for name, fn in [("response_model", response_model_path), ("trusted", trusted_path)]:
+        fn()
+        samples = []
+        for _ in range(args.iterations):
+            start = time.perf_counter()
+            body = fn()
+            samples.append((time.perf_counter() - start) * 1000)
+        median = statistics.median(samples)
+        print(f"{name:16s} median {median:8.2f} ms  {median * 1000 / args.rows:8.2f} ms per 1k rows  {len(body)} bytes")
+
+
+if __name__ == "__main__":
+    main()
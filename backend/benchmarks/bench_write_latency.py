@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Latency benchmark for the create_proposta / create_project write paths.
+
+Starts a local TCP proxy in front of MongoDB that delays every packet by a
+fixed one-way latency, points the backend at the proxy and calls the handlers
+directly. Each result is reported both in milliseconds and in "round trips"
+(elapsed / RTT), so the effect of running independent lookups concurrently
+is visible regardless of the injected latency.
+
+Usage (from backend/):
+    MONGO_URL=mongodb://localhost:27017 python benchmarks/bench_write_latency.py --rtt-ms 40
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+from pathlib import Path
+from urllib.parse import urlparse
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+async def _pump(reader, writer, delay):
+    try:
+        while True:
+            chunk = await reader.read(65536)
+            if not chunk:
+                break
+            await asyncio.sleep(delay)
+            writer.write(chunk)
+            await writer.drain()
+    except (ConnectionError, asyncio.CancelledError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_latency_proxy(upstream_host, upstream_port, one_way_delay):
+    async def handle(client_reader, client_writer):
+        upstream_reader, upstream_writer = await asyncio.open_connection(upstream_host, upstream_port)
+        await asyncio.gather(
+            _pump(client_reader, upstream_writer, one_way_delay),
+            _pump(upstream_reader, client_writer, one_way_delay),
+        )
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    return server, server.sockets[0].getsockname()[1]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rtt-ms", type=float, default=40.0, help="injected round-trip latency")
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    upstream = urlparse(os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    proxy, port = await start_latency_proxy(upstream.hostname or "localhost", upstream.port or 27017, args.rtt_ms / 2000)
+
+    # The backend reads MONGO_URL at import time, so import it only after the proxy is up
+    os.environ["MONGO_URL"] = f"mongodb://127.0.0.1:{port}/?directConnection=true"
+    os.environ["DB_NAME"] = f"agrolink_bench_{uuid.uuid4().hex[:8]}"
+    import server
+
+    await server.init_default_data()
+    user = await server.db.users.find_one({"role": server.UserRole.MASTER}, {"_id": 0})
+    tipo = await server.db.tipos_projeto.find_one({}, {"_id": 0})
+    instituicao = await server.db.instituicoes_financeiras.find_one({}, {"_id": 0})
+
+    def random_cpf():
+        # create_client rejects CPFs without valid check digits
+        return server.completar_cpf(f"{random.randrange(10 ** 9):09d}")
+
+    # Warm up the connection pool so handshakes are not billed to the first sample
+    await asyncio.gather(*[server.db.command("ping") for _ in range(5)])
+
+    async def proposta_existing_client():
+        cpf = random_cpf()
+        client = await server.create_client(
+            server.ClientCreate(nome_completo="Bench", cpf=cpf, telefone="000"), current_user=user
+        )
+        start = time.perf_counter()
+        await server.create_proposta(server.PropostaCreate(
+            client_id=client.id,
+            tipo_projeto_id=tipo["id"],
+            instituicao_financeira_id=instituicao["id"],
+            valor_credito=1000.0,
+        ), current_user=user)
+        return time.perf_counter() - start
+
+    async def project():
+        cpf = random_cpf()
+        client = await server.create_client(
+            server.ClientCreate(nome_completo="Bench", cpf=cpf, telefone="000"), current_user=user
+        )
+        start = time.perf_counter()
+        await server.create_project(server.ProjetoCreate(
+            cliente_id=client.id,
+            valor_credito=1000.0,
+            tipo_projeto_id=tipo["id"],
+            instituicao_financeira_id=instituicao["id"],
+        ), current_user=user)
+        return time.perf_counter() - start
+
+    def reads(client_id):
+        # The lookups create_project used to await one after another
+        return [
+            lambda: server.db.clients.find_one({"id": client_id}, {"_id": 0}),
+            lambda: server.db.projects.find_one({"cliente_id": client_id, "status": "em_andamento"}),
+            lambda: server.db.etapas.find_one({"ativo": True}, {"_id": 0}, sort=[("ordem", 1)]),
+            lambda: server.db.instituicoes_financeiras.find_one({"id": instituicao["id"]}, {"_id": 0}),
+            lambda: server.db.tipos_projeto.find_one({"id": tipo["id"]}, {"_id": 0}),
+        ]
+
+    async def reads_sequential():
+        start = time.perf_counter()
+        for read in reads(user["id"]):
+            await read()
+        return time.perf_counter() - start
+
+    async def reads_gathered():
+        start = time.perf_counter()
+        await asyncio.gather(*[read() for read in reads(user["id"])])
+        return time.perf_counter() - start
+
+    async def measure(fn):
+        return [(await fn()) * 1000 for _ in range(args.iterations)]
+
+    print(f"injected RTT: {args.rtt_ms:.1f} ms, iterations: {args.iterations}")
+    for name, fn in [
+        ("5 lookups, sequential", reads_sequential),
+        ("5 lookups, asyncio.gather", reads_gathered),
+        ("create_proposta (client_id)", proposta_existing_client),
+        ("create_project", project),
+    ]:
+        samples = await measure(fn)
+        median = statistics.median(samples)
+        print(f"{name:32s} median {median:8.2f} ms  ~{median / args.rtt_ms:4.1f} round trips")
+
+    await server.client.drop_database(os.environ["DB_NAME"])
+    server.client.close()
+    proxy.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
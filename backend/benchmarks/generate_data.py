@@ -0,0 +1,523 @@
+#!/usr/bin/env python3
+"""
+Seeded synthetic dataset for load testing.
+
+Generates partners, clients with valid unique CPFs, propostas in every status
+(aberta / convertida / desistida) and projects spread across the eight default
+etapas, with a consistent historico_etapas (dates, durations, pendências,
+observações), documentos_check matching the stage and the files index of the
+documents uploaded along the way. The same --seed and --hoje always produce the
+same documents, ids included.
+
+Data is written with insert_many in batches; the next batch is generated while
+the previous one is being inserted. Storage usage counters are filled in from
+the generated files, so no recalculation is needed afterwards.
+
+Files:
+  --arquivos indice    only the `files` index (default; downloads return 404)
+  --arquivos conteudo  also store bytes through the configured storage driver,
+                       drawn from a pool of --pool-blobs distinct random blobs
+                       (deduplicated by the blob store like real re-uploads)
+
+Usage (from backend/, reads MONGO_URL / DB_NAME like the server):
+    python benchmarks/generate_data.py --clientes 1000 --seed 42
+    python benchmarks/generate_data.py --clientes 1000000 --lote 10000 --drop
+"""
+import argparse
+import asyncio
+import hashlib
+import math
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import date, datetime, time as dt_time, timedelta, timezone
+from pathlib import Path
+
+from pymongo import UpdateOne
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+PRENOMES = [
+    "JOÃO", "JOSÉ", "ANTÔNIO", "FRANCISCO", "CARLOS", "PAULO", "PEDRO", "LUCAS", "LUIZ", "MARCOS",
+    "LUÍS", "GABRIEL", "RAFAEL", "DANIEL", "MARCELO", "BRUNO", "EDUARDO", "FELIPE", "RAIMUNDO", "RODRIGO",
+    "MARIA", "ANA", "FRANCISCA", "ANTÔNIA", "ADRIANA", "JULIANA", "MÁRCIA", "FERNANDA", "PATRÍCIA", "ALINE",
+    "SANDRA", "CAMILA", "AMANDA", "BRUNA", "JÉSSICA", "LETÍCIA", "JÚLIA", "LUCIANA", "VANESSA", "MARIANA",
+]
+SOBRENOMES = [
+    "SILVA", "SANTOS", "OLIVEIRA", "SOUZA", "RODRIGUES", "FERREIRA", "ALVES", "PEREIRA", "LIMA", "GOMES",
+    "COSTA", "RIBEIRO", "MARTINS", "CARVALHO", "ALMEIDA", "LOPES", "SOARES", "FERNANDES", "VIEIRA", "BARBOSA",
+    "ROCHA", "DIAS", "NASCIMENTO", "ANDRADE", "MOREIRA", "NUNES", "MARQUES", "MACHADO", "MENDES", "FREITAS",
+    "CARDOSO", "RAMOS", "GONÇALVES", "SANTANA", "TEIXEIRA", "ARAÚJO", "PINTO", "CORREIA", "MOURA", "CAVALCANTI",
+]
+# Used when data/municipios.json.gz has not been generated
+MUNICIPIOS_FALLBACK = [
+    ("MS", "Campo Grande"), ("MS", "Dourados"), ("MS", "Três Lagoas"), ("MS", "Corumbá"), ("MS", "Ponta Porã"),
+    ("MS", "Naviraí"), ("MS", "Nova Andradina"), ("MS", "Aquidauana"), ("MS", "Sidrolândia"), ("MS", "Maracaju"),
+    ("MT", "Cuiabá"), ("MT", "Rondonópolis"), ("MT", "Sinop"), ("MT", "Sorriso"), ("MT", "Lucas do Rio Verde"),
+    ("GO", "Rio Verde"), ("GO", "Jataí"), ("GO", "Goiânia"), ("PR", "Cascavel"), ("PR", "Toledo"),
+    ("SP", "Presidente Prudente"), ("MG", "Uberaba"), ("BA", "Barreiras"), ("RS", "Passo Fundo"), ("TO", "Gurupi"),
+]
+INSTITUICAO_PESOS = {"Banco do Brasil": 40, "Sicredi": 15, "Sicoob": 12, "Cresol": 6, "Banco do Nordeste (BNB)": 6}
+# valor_credito range per tipo de projeto, in reais
+VALOR_CREDITO = {"PRONAF A": (15000, 40000), "PRONAF B": (3000, 12000), "CUSTEIO": (50000, 600000)}
+# documentos_check fields that must be true to leave each stage (see advance_project_stage)
+CHECKS_ETAPA = {
+    "Cadastro": [],
+    "Coleta de Documentos": ["rg_cnh", "conta_banco_brasil", "ccu_titulo", "saldo_iagro", "car"],
+    "Desenvolvimento do Projeto": ["projeto_implementado"],
+    "Coletar Assinaturas": ["projeto_assinado"],
+    "Protocolo CENOP": ["projeto_protocolado"],
+    "Instrumento de Crédito": ["assinatura_agencia", "upload_contrato"],
+    "GTA e Nota Fiscal": ["gta_emitido", "nota_fiscal_emitida"],
+    "Projeto Creditado": ["comprovante_servico_pago"],
+}
+# Checklist items that come with an uploaded document
+CATEGORIAS_COM_ARQUIVO = {
+    "rg_cnh", "ccu_titulo", "saldo_iagro", "car", "projeto_assinado", "upload_contrato",
+    "gta_emitido", "nota_fiscal_emitida", "comprovante_servico_pago",
+}
+# Weight of each current stage for projects em andamento: most are early in the process
+PESOS_ETAPA_ATUAL = [18, 22, 16, 12, 10, 9, 8, 5]
+DURACAO_MEDIA_ETAPA = [2, 12, 15, 7, 20, 18, 10, 6]  # days
+PENDENCIAS = [
+    "CAR com sobreposição de área", "CCU vencido", "Saldo IAGRO divergente", "Falta comprovante de residência",
+    "Assinatura do cônjuge pendente", "Matrícula do imóvel ilegível", "Conta bancária bloqueada",
+    "Orçamento do fornecedor desatualizado", "GTA com dados incorretos", "Nota fiscal sem CPF do produtor",
+]
+OBSERVACOES = [
+    "Cliente informado por telefone", "Documentos recebidos pelo WhatsApp", "Aguardando retorno da agência",
+    "Visita técnica realizada na propriedade", "Cliente pediu para retornar na próxima semana",
+    "Projeto revisado e enviado ao banco", "Fornecedor confirmou entrega dos animais",
+    "Reunião com o gerente agendada", "Parceiro trouxe a documentação pessoalmente",
+]
+MOTIVOS_DESISTENCIA = [
+    "Cliente desistiu do financiamento", "Crédito negado pelo banco", "Restrição no CPF",
+    "Área sem regularização ambiental", "Cliente optou por outra instituição", "Sem retorno do cliente",
+]
+
+
+class DatasetGenerator:
+    """
+    Every client index i has its own Random(seed, i), so a batch can be generated
+    without replaying the ones before it and the output does not depend on --lote
+    """
+
+    def __init__(self, args, refs):
+        self.seed = args.seed
+        self.hoje = datetime.combine(args.hoje, dt_time(18, 0), tzinfo=timezone.utc)
+        self.arquivos_por_cliente = args.arquivos_por_cliente
+        self.etapas = refs["etapas"]
+        self.tipos = refs["tipos"]
+        self.instituicoes = refs["instituicoes"]
+        self.instituicao_pesos = [INSTITUICAO_PESOS.get(i["nome"], 2) for i in self.instituicoes]
+        self.usuarios = refs["usuarios"]
+        self.parceiros = refs["parceiros"]
+        self.municipios = refs["municipios"]
+        self.pool = refs["pool"]
+        # CPF bases: i -> (i * step + offset) mod 10^9 is a bijection, so CPFs never repeat
+        seeded = random.Random(f"{self.seed}:cpf")
+        self.cpf_step = seeded.choice([p for p in range(700001, 800001, 2) if p % 5])
+        self.cpf_offset = seeded.randrange(10 ** 9)
+        from server import completar_cpf  # main() has imported the backend by now
+        self.completar_cpf = completar_cpf
+
+    def cpf(self, base9):
+        return self.completar_cpf(f"{base9:09d}")
+
+    def uuid(self, rng):
+        return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+    def data(self, dt):
+        return dt.isoformat()
+
+    def dias(self, rng, media):
+        # Long-tailed durations: most stages are quick, some drag on for months
+        return max(0.2, rng.lognormvariate(math.log(media), 0.8))
+
+    def batch(self, start, count):
+        out = {"clients": [], "propostas": [], "projects": [], "files": []}
+        for i in range(start, start + count):
+            self.cliente(i, out)
+        return out
+
+    def cliente(self, i, out):
+        rng = random.Random(f"{self.seed}:{i}")
+        cliente_id = self.uuid(rng)
+        cpf = self.cpf((i * self.cpf_step + self.cpf_offset) % 10 ** 9)
+        if len(set(cpf)) == 1:
+            cpf = self.cpf((i * self.cpf_step + self.cpf_offset + 1) % 10 ** 9)
+        estado, cidade = rng.choice(self.municipios)
+        parceiro = rng.choice(self.parceiros) if rng.random() < 0.6 else None
+        nascimento = date(1950, 1, 1) + timedelta(days=rng.randrange(365 * 55))
+        cliente = {
+            "id": cliente_id,
+            "nome_completo": f"{rng.choice(PRENOMES)} {rng.choice(SOBRENOMES)} {rng.choice(SOBRENOMES)}",
+            "cpf": cpf,
+            "endereco": f"Sítio {rng.choice(SOBRENOMES).title()}, zona rural" if rng.random() < 0.7 else "",
+            "telefone": f"{rng.choice(['67', '65', '66', '64', '44', '18'])}9{rng.randrange(10 ** 8):08d}",
+            "data_nascimento": nascimento.isoformat(),
+            "parceiro_id": parceiro["id"] if parceiro else None,
+            "parceiro_nome": parceiro["nome"] if parceiro else None,
+            "estado": estado,
+            "cidade": cidade,
+            "created_at": None,
+            "ultimo_alerta": None,
+            "qtd_alertas": 0,
+            "armazenamento_bytes": 0,
+            "armazenamento_arquivos": 0,
+        }
+
+        tipo = rng.choice(self.tipos)
+        instituicao = rng.choices(self.instituicoes, weights=self.instituicao_pesos)[0]
+        low, high = VALOR_CREDITO.get(tipo["nome"], (10000, 100000))
+        valor_credito = float(round(rng.uniform(low, high), -2))
+
+        destino = rng.random()
+        if destino < 0.55:
+            # Proposta convertida (or registered straight as a project) -> project
+            projeto = self.projeto(rng, cliente, tipo, instituicao, valor_credito, out)
+            criado = datetime.fromisoformat(projeto["data_inicio"])
+            if rng.random() < 0.85:
+                proposta_criada = criado - timedelta(days=rng.uniform(1, 25))
+                proposta = self.proposta(rng, cliente, tipo, instituicao, valor_credito, proposta_criada, "convertida")
+                proposta["updated_at"] = projeto["data_inicio"]
+                projeto["proposta_id"] = proposta["id"]
+                out["propostas"].append(proposta)
+                criado = proposta_criada
+            cliente["created_at"] = self.data(criado - timedelta(days=rng.uniform(0, 45)))
+        elif destino < 0.8:
+            status = "aberta" if rng.random() < 0.6 else "desistida"
+            # Open propostas are recent; abandoned ones can be old
+            idade = rng.uniform(0, 120) if status == "aberta" else rng.uniform(10, 1000)
+            proposta_criada = self.hoje - timedelta(days=idade)
+            proposta = self.proposta(rng, cliente, tipo, instituicao, valor_credito, proposta_criada, status)
+            out["propostas"].append(proposta)
+            cliente["created_at"] = self.data(proposta_criada - timedelta(days=rng.uniform(0, 30)))
+        else:
+            cliente["created_at"] = self.data(self.hoje - timedelta(days=rng.uniform(0, 1100)))
+
+        if destino >= 0.55 or out["projects"][-1]["status"] != "em_andamento":
+            # Clients without an active project get follow-up alerts (see GET /alerts)
+            cliente["qtd_alertas"] = rng.randint(0, 3)
+            if cliente["qtd_alertas"]:
+                cliente["ultimo_alerta"] = self.data(self.hoje - timedelta(days=rng.uniform(0, 30)))
+
+        if destino < 0.55:
+            self.arquivos(rng, cliente, out["projects"][-1], out)
+        out["clients"].append(cliente)
+
+    def proposta(self, rng, cliente, tipo, instituicao, valor_credito, criada, status):
+        qtd_alertas = rng.randint(0, 3) if status == "aberta" else 0
+        return {
+            "id": self.uuid(rng),
+            "cliente_id": cliente["id"],
+            "tipo_projeto_id": tipo["id"],
+            "tipo_projeto_nome": tipo["nome"],
+            "instituicao_financeira_id": instituicao["id"],
+            "instituicao_financeira_nome": instituicao["nome"],
+            "valor_credito": valor_credito,
+            "status": status,
+            "motivo_desistencia": rng.choice(MOTIVOS_DESISTENCIA) if status == "desistida" else None,
+            "created_at": self.data(criada),
+            "updated_at": self.data(criada + timedelta(days=rng.uniform(0, 10)) if status == "desistida" else criada),
+            "qtd_alertas": qtd_alertas,
+            "ultimo_alerta": self.data(criada + timedelta(days=3 * qtd_alertas)) if qtd_alertas else None,
+        }
+
+    def projeto(self, rng, cliente, tipo, instituicao, valor_credito, out):
+        sorteio = rng.random()
+        status = "em_andamento" if sorteio < 0.55 else "arquivado" if sorteio < 0.9 else "desistido"
+        if status == "em_andamento":
+            atual = rng.choices(range(len(self.etapas)), weights=PESOS_ETAPA_ATUAL[:len(self.etapas)])[0]
+            fim = self.hoje
+        elif status == "arquivado":
+            atual = len(self.etapas) - 1
+            fim = self.hoje - timedelta(days=rng.uniform(0, 900))
+        else:
+            atual = rng.randrange(len(self.etapas))
+            fim = self.hoje - timedelta(days=rng.uniform(0, 900))
+
+        # Walk back from the end: the current stage is open (or just closed) at `fim`
+        duracoes = [timedelta(days=self.dias(rng, DURACAO_MEDIA_ETAPA[k % 8])) for k in range(atual + 1)]
+        inicio = fim - sum(duracoes, timedelta())
+        historico = []
+        documentos = {campo: False for campos in CHECKS_ETAPA.values() for campo in campos}
+        documentos["projeto_implementado"] = False
+        cursor = inicio
+        for k in range(atual + 1):
+            etapa = self.etapas[k]
+            etapa_inicio, etapa_fim = cursor, cursor + duracoes[k]
+            cursor = etapa_fim
+            fechada = k < atual or status == "arquivado"
+            checks = CHECKS_ETAPA.get(etapa["nome"], [])
+            pendencias = []
+            if rng.random() < 0.3:
+                for _ in range(rng.randint(1, 2)):
+                    criada = etapa_inicio + (etapa_fim - etapa_inicio) * rng.random()
+                    resolvida = fechada or rng.random() < 0.4
+                    pendencias.append({
+                        "descricao": rng.choice(PENDENCIAS),
+                        "resolvida": resolvida,
+                        "data_criacao": self.data(criada),
+                        "data_resolucao": self.data(criada + (etapa_fim - criada) * rng.random()) if resolvida else None,
+                    })
+            observacoes = [{
+                "texto": rng.choice(OBSERVACOES),
+                "usuario_nome": rng.choice(self.usuarios)["nome"],
+                "data": self.data(etapa_inicio + (etapa_fim - etapa_inicio) * rng.random()),
+            } for _ in range(rng.choices([0, 1, 2, 3], weights=[40, 35, 15, 10])[0])]
+            for campo in checks:
+                documentos[campo] = fechada or rng.random() < 0.5
+            historico.append({
+                "etapa_id": etapa["id"],
+                "etapa_nome": etapa["nome"],
+                "data_inicio": self.data(etapa_inicio),
+                "data_fim": self.data(etapa_fim) if fechada else None,
+                "dias_duracao": (etapa_fim - etapa_inicio).days if fechada else 0,
+                "pendencias": pendencias,
+                "observacoes": observacoes,
+            })
+
+        projeto = {
+            "id": self.uuid(rng),
+            "cliente_id": cliente["id"],
+            "etapa_atual_id": self.etapas[atual]["id"],
+            "etapa_atual_nome": self.etapas[atual]["nome"],
+            "status": status,
+            "motivo_desistencia": rng.choice(MOTIVOS_DESISTENCIA) if status == "desistido" else None,
+            "documentos_check": documentos,
+            "historico_etapas": historico,
+            "data_inicio": self.data(inicio),
+            "data_arquivamento": self.data(fim) if status == "arquivado" else None,
+            "valor_credito": valor_credito,
+            "tipo_projeto": tipo["nome"],
+            "tipo_projeto_id": tipo["id"],
+            "instituicao_financeira_id": instituicao["id"],
+            "instituicao_financeira_nome": instituicao["nome"],
+            "proposta_id": None,
+            "numero_contrato": None,
+            "valor_servico": None,
+        }
+        if atual >= 5 or status == "arquivado":
+            projeto["numero_contrato"] = f"{rng.randint(10, 99)}/{rng.randrange(10 ** 5):05d}-{rng.randint(0, 9)}"
+            projeto["valor_servico"] = float(round(valor_credito * rng.uniform(0.02, 0.05), 2))
+        out["projects"].append(projeto)
+        return projeto
+
+    def arquivos(self, rng, cliente, projeto, out):
+        # Cancelled projects lose their documents (see cancel_project)
+        if projeto["status"] == "desistido":
+            return
+        docs = projeto["documentos_check"]
+        categorias = [c for c in sorted(CATEGORIAS_COM_ARQUIVO) if docs.get(c) and rng.random() < 0.85]
+        # Average around --arquivos-por-cliente: photos and extra scans without a categoria
+        extras = max(0, round(rng.gauss(self.arquivos_por_cliente - len(categorias) / 2, 1)))
+        nomes = [(f"{c}.pdf", c) for c in categorias]
+        nomes += [(f"foto_propriedade_{n + 1}.jpg", None) for n in range(extras)]
+        for nome, categoria in nomes:
+            if self.pool:
+                sha256, size = rng.choice(self.pool)
+            else:
+                sha256 = hashlib.sha256(f"{self.seed}:{cliente['id']}:{nome}".encode()).hexdigest()
+                size = int(min(10 * 1024 * 1024 - 1, max(20 * 1024, rng.lognormvariate(math.log(400 * 1024), 0.9))))
+            quando = self.data(datetime.fromisoformat(projeto["data_inicio"]) + timedelta(days=rng.uniform(0, 5)))
+            usuario = rng.choice(self.usuarios)
+            out["files"].append({
+                "id": self.uuid(rng),
+                "client_id": cliente["id"],
+                "name": nome,
+                "hash": sha256,
+                "size": size,
+                "mime_type": "application/pdf" if nome.endswith(".pdf") else "image/jpeg",
+                "uploaded_by_id": usuario["id"],
+                "uploaded_by_nome": usuario["nome"],
+                "categoria": categoria,
+                "created_at": quando,
+                "updated_at": quando,
+            })
+            cliente["armazenamento_bytes"] += size
+            cliente["armazenamento_arquivos"] += 1
+
+
+async def referencias(server, args):
+    """Default etapas / tipos / instituições, analyst users, partners, municipalities and the blob pool"""
+    db = server.db
+    rng = random.Random(f"{args.seed}:referencias")
+    criado = datetime.combine(args.hoje - timedelta(days=1100), dt_time(9, 0), tzinfo=timezone.utc).isoformat()
+    etapas, tipos, instituicoes, master = await asyncio.gather(
+        db.etapas.find({"ativo": True}, {"_id": 0}).sort("ordem", 1).to_list(100),
+        db.tipos_projeto.find({"ativo": True}, {"_id": 0}).to_list(100),
+        db.instituicoes_financeiras.find({"ativo": True}, {"_id": 0}).to_list(100),
+        db.users.find_one({"role": server.UserRole.MASTER}, {"_id": 0}),
+    )
+
+    # One bcrypt hash for every analyst; they exist to sign observações and uploads
+    senha = server.hash_password("analista")
+    usuarios = [{
+        "id": str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+        "nome": f"Analista {n + 1:02d}",
+        "email": f"analista{n + 1:02d}@sintetico.agrolink.com",
+        "senha": senha,
+        "role": server.UserRole.ANALISTA,
+        "ativo": True,
+        "created_at": criado,
+    } for n in range(args.analistas)]
+    if usuarios:
+        # users.email is unique: a rerun without --drop reuses the analysts already there
+        await db.users.bulk_write([
+            UpdateOne(
+                {"email": u["email"]},
+                {"$setOnInsert": {k: v for k, v in u.items() if k != "email"}},
+                upsert=True,
+            ) for u in usuarios
+        ], ordered=False)
+        por_email = {
+            u["email"]: u async for u in db.users.find(
+                {"email": {"$in": [u["email"] for u in usuarios]}}, {"_id": 0, "senha": 0}
+            )
+        }
+        usuarios = [por_email[u["email"]] for u in usuarios]
+
+    parceiros = [{
+        "id": str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+        "nome": f"{rng.choice(PRENOMES).title()} {rng.choice(SOBRENOMES).title()} Consultoria",
+        "comissao": float(rng.choice([2, 2.5, 3, 4, 5])),
+        "telefone": f"67{rng.randrange(10 ** 9):09d}",
+        "ativo": rng.random() < 0.9,
+        "created_at": criado,
+    } for _ in range(max(5, args.clientes // 200))]
+    await db.partners.insert_many([dict(p) for p in parceiros])
+
+    dataset = server._read_municipios_file(server.MUNICIPIOS_DATASET)
+    municipios = [(m["uf"], m["nome"]) for m in dataset["municipios"]] if dataset else MUNICIPIOS_FALLBACK
+
+    pool = []
+    if args.arquivos == "conteudo":
+        for n in range(args.pool_blobs):
+            size = int(min(10 * 1024 * 1024 - 1, max(20 * 1024, rng.lognormvariate(math.log(400 * 1024), 0.9))))
+            content = rng.randbytes(size)
+            pool.append((hashlib.sha256(content).hexdigest(), size, content))
+
+    return {
+        "etapas": etapas,
+        "tipos": tipos,
+        "instituicoes": instituicoes,
+        "usuarios": [master, *usuarios] if master else usuarios,
+        "parceiros": parceiros,
+        "municipios": municipios,
+        "pool": pool,
+    }
+
+
+async def store_contents(server, files, pool, stored, concurrency=16):
+    """Put generated documents in the storage driver; each pool blob is uploaded once"""
+    contents = {sha256: content for sha256, _, content in pool}
+    semaphore = asyncio.Semaphore(concurrency)
+    await server.storage.prepare_clients(sorted({f["client_id"] for f in files}))
+
+    async def store(doc, content=None):
+        async with semaphore:
+            temp_path = None
+            if content is not None:
+                temp_path = server.BLOB_TMP_DIR / f"gerado-{doc['hash']}"
+                temp_path.write_bytes(content)
+            await server.storage.store_document(doc["client_id"], doc["name"], temp_path, doc["hash"], doc["size"])
+            await server.storage.unpin_blob(doc["hash"])  # Its files row is already inserted
+
+    # The first use of a blob uploads it; only then can other documents link to it
+    primeiros, links = [], []
+    for doc in files:
+        if doc["hash"] in stored:
+            links.append(doc)
+        else:
+            stored.add(doc["hash"])
+            primeiros.append(doc)
+    await asyncio.gather(*[store(doc, contents[doc["hash"]]) for doc in primeiros])
+    await asyncio.gather(*[store(doc) for doc in links])
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clientes", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--hoje", type=date.fromisoformat, default=date(2026, 1, 1),
+                        help="reference date for every generated date (default 2026-01-01)")
+    parser.add_argument("--lote", type=int, default=5000, help="clients per insert_many batch")
+    parser.add_argument("--analistas", type=int, default=8)
+    parser.add_argument("--arquivos", choices=["indice", "conteudo"], default="indice")
+    parser.add_argument("--arquivos-por-cliente", type=float, default=3.0)
+    parser.add_argument("--pool-blobs", type=int, default=32)
+    parser.add_argument("--drop", action="store_true",
+                        help="delete existing clients, partners, propostas, projects, files and synthetic users first")
+    args = parser.parse_args()
+
+    import server
+    db = server.db
+
+    if args.drop:
+        await asyncio.gather(
+            db.clients.delete_many({}), db.partners.delete_many({}), db.propostas.delete_many({}),
+            db.projects.delete_many({}), db.files.delete_many({}), db.upload_sessions.delete_many({}),
+            db.counters.delete_one({"_id": "armazenamento"}),
+            db.users.delete_many({"email": {"$regex": r"@sintetico\.agrolink\.com$"}}),
+        )
+        await server.storage.reset_all()
+    elif await db.clients.estimated_document_count():
+        sys.exit("The database already has clients; use --drop to replace them")
+
+    await server.ensure_indexes()
+    await server.init_default_data()
+    refs = await referencias(server, args)
+    generator = DatasetGenerator(args, {**refs, "pool": [(h, s) for h, s, _ in refs["pool"]]})
+
+    totals = {"clients": 0, "propostas": 0, "projects": 0, "files": 0}
+    storage_total = {"bytes": 0, "arquivos": 0}
+    stored_blobs = set()
+
+    inserted = 0
+
+    async def insert(batch):
+        nonlocal inserted
+        await asyncio.gather(*[
+            getattr(db, collection).insert_many(docs, ordered=False)
+            for collection, docs in batch.items() if docs
+        ])
+        if args.arquivos == "conteudo" and batch["files"]:
+            await store_contents(server, batch["files"], refs["pool"], stored_blobs)
+        inserted += len(batch["clients"])
+        elapsed = time.perf_counter() - started
+        print(f"{inserted:>9} clients  {inserted / elapsed:8.0f} clients/s", flush=True)
+
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    pending = None
+    for start in range(0, args.clientes, args.lote):
+        # Generated in a worker thread, so the event loop keeps driving the
+        # previous batch's insert in the meantime
+        batch = await loop.run_in_executor(None, generator.batch, start, min(args.lote, args.clientes - start))
+        for collection, docs in batch.items():
+            totals[collection] += len(docs)
+        storage_total["bytes"] += sum(f["size"] for f in batch["files"])
+        storage_total["arquivos"] += len(batch["files"])
+        # At most one batch in flight: generation runs ahead by one batch only
+        if pending:
+            await pending
+        pending = asyncio.ensure_future(insert(batch))
+    if pending:
+        await pending
+
+    await db.counters.update_one({"_id": "armazenamento"}, {"$set": storage_total}, upsert=True)
+    elapsed = time.perf_counter() - started
+    print(
+        f"done in {elapsed:.1f}s: {totals['clients']} clients, {len(refs['parceiros'])} partners, "
+        f"{totals['propostas']} propostas, {totals['projects']} projects, {totals['files']} files "
+        f"({storage_total['bytes'] / 1024 ** 3:.1f} GiB indexed), {args.analistas} analysts (password: analista)"
+    )
+    server.client.close()
+    await server.storage.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Regenerate the municipality dataset shipped with the backend (data/municipios.json.gz)
+from the IBGE localidades API. Run it when IBGE publishes changes and commit the result.
+
+Usage (from backend/):
+    python data/update_municipios.py
+"""
+import gzip
+import json
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+
+IBGE_MUNICIPIOS_URL = "https://servicodados.ibge.gov.br/api/v1/localidades/municipios?view=nivelado"
+OUTPUT = Path(__file__).resolve().parent / "municipios.json.gz"
+
+
+def main():
+    response = httpx.get(IBGE_MUNICIPIOS_URL, timeout=60)
+    response.raise_for_status()
+    municipios = [
+        {"id": m["municipio-id"], "nome": m["municipio-nome"], "uf": m["UF-sigla"]}
+        for m in response.json()
+    ]
+    if len(municipios) < 5000:
+        sys.exit(f"IBGE returned only {len(municipios)} municipalities, not writing")
+
+    now = datetime.now(timezone.utc)
+    dataset = {
+        "versao": now.strftime("%Y-%m-%d"),
+        "atualizado_em": now.isoformat(),
+        "fonte": IBGE_MUNICIPIOS_URL,
+        "municipios": sorted(municipios, key=lambda m: (m["uf"], m["id"])),
+    }
+    # mtime=0 keeps the file byte-identical when the data did not change
+    with open(OUTPUT, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as f:
+        f.write(json.dumps(dataset, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+    print(f"{len(municipios)} municipalities written to {OUTPUT}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,662 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, UploadFile, File, Form, Query, Header
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, UploadFile, File, Form, Query, Header, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse, Response
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import DuplicateKeyError, OperationFailure, BulkWriteError, CollectionInvalid
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional, Any
+from typing import List, Optional, Any, Union, get_args, get_origin
+import types
 import uuid
 from datetime import datetime, timezone, timedelta
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import quote, parse_qs
 import bcrypt
 import jwt
 from bson import ObjectId
+import aiofiles
+import httpx
+import aiofiles.os
+from python_multipart.multipart import MultipartParser, parse_options_header
 import shutil
+import stat
+import sys
+import threading
 import re
+import hashlib
+import hmac
+import mimetypes
+import asyncio
+import bisect
+import contextlib
+import contextvars
+import collections
+import functools
+import csv
+import gzip
+import io
+import itertools
+import json
+import random
+import time
+import unicodedata
+import zipfile
+import zlib
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import brotli
+except ImportError:  # optional: responses fall back to gzip
+    brotli = None
+try:
+    import orjson
+except ImportError:  # optional: trusted list responses fall back to json.dumps
+    orjson = None
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# ==================== METRICS ====================
+# Prometheus text format without a client library: counters and histograms kept in
+# plain dicts and updated inline by MetricsMiddleware, rendered on GET /metrics.
+# /metrics is served outside /api, so nginx does not expose it; METRICS_TOKEN adds
+# a bearer check for scrapers that reach the backend port over the network.
+
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+COMPRESSION_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+LOOP_LAG_INTERVAL = 0.5
+MONGO_COMMAND_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+# Requests above either threshold are logged with their per-command breakdown (N+1 suspects)
+MONGO_LOG_COMMANDS = int(os.environ.get("MONGO_LOG_COMMANDS", "50"))
+MONGO_LOG_MS = float(os.environ.get("MONGO_LOG_MS", "500"))
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum")
+    
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+    
+    def observe(self, value: float):
+        # bisect_left: a value equal to a bound belongs to that bucket (le = "less or equal")
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+    
+    def render(self, name: str, labels: str) -> List[str]:
+        prefix = f"{labels}," if labels else ""
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+        cumulative += self.counts[-1]
+        lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {cumulative}")
+        return lines
+
+class RouteMetrics:
+    __slots__ = ("status", "latency", "size", "mongo_commands")
+    
+    def __init__(self):
+        self.status: dict = {}
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.size = Histogram(SIZE_BUCKETS)
+        self.mongo_commands = Histogram(MONGO_COMMAND_BUCKETS)
+
+class QueryStats:
+    """Mongo commands issued on behalf of one request"""
+    __slots__ = ("count", "micros", "by_command", "lock")
+    
+    def __init__(self):
+        self.count = 0
+        self.micros = 0
+        self.by_command: dict = {}
+        self.lock = threading.Lock()
+    
+    def add(self, command_name: str, micros: int):
+        with self.lock:
+            self.count += 1
+            self.micros += micros
+            self.by_command[command_name] = self.by_command.get(command_name, 0) + 1
+    
+    def server_timing(self) -> str:
+        return f'db;dur={self.micros / 1000:.1f};desc="{self.count} mongo commands"'
+
+# Set by MetricsMiddleware for each request. Motor runs pymongo in a thread pool with a
+# copy of the caller's context, so the listener below sees the QueryStats of the request
+# that issued the command (asyncio.gather children share the same object).
+request_query_stats: contextvars.ContextVar[Optional[QueryStats]] = contextvars.ContextVar(
+    "request_query_stats", default=None
+)
+
+class MongoCommandListener(monitoring.CommandListener):
+    def started(self, event):
+        pass
+    
+    def succeeded(self, event):
+        stats = request_query_stats.get()
+        if stats is not None:
+            stats.add(event.command_name, event.duration_micros)
+    
+    def failed(self, event):
+        self.succeeded(event)
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    """Connection pool events from pymongo; called from driver threads, hence the lock"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = dict.fromkeys(
+            ("created", "closed", "checked_out", "checked_in", "checkout_failed", "pool_cleared"), 0
+        )
+    
+    def _inc(self, key):
+        with self.lock:
+            self.counts[key] += 1
+    
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_check_out_started(self, event): pass
+    def pool_cleared(self, event): self._inc("pool_cleared")
+    def connection_created(self, event): self._inc("created")
+    def connection_closed(self, event): self._inc("closed")
+    def connection_checked_out(self, event): self._inc("checked_out")
+    def connection_checked_in(self, event): self._inc("checked_in")
+    def connection_check_out_failed(self, event): self._inc("checkout_failed")
+
+class Metrics:
+    def __init__(self):
+        self.routes: dict = {}
+        self.in_flight = 0
+        self.loop_lag = Histogram(LOOP_LAG_BUCKETS)
+        self.loop_lag_last = 0.0
+        self.mongo_pool = MongoPoolMetrics()
+        self.mongo_commands = MongoCommandListener()
+        self.compression: dict = {}
+        self.started_at = time.time()
+        self._route_paths: Optional[dict] = None
+    
+    def route_template(self, scope) -> str:
+        """Path template of the matched route ("/api/clients/{client_id}"), so labels stay bounded"""
+        if self._route_paths is None:
+            self._route_paths = {
+                getattr(route, "endpoint", None) or route.app: route.path for route in app.routes
+            }
+        return self._route_paths.get(scope.get("endpoint"), "unmatched")
+    
+    def observe_request(self, scope, status: int, size: int, elapsed: float, queries: QueryStats):
+        key = (scope["method"], self.route_template(scope))
+        route = self.routes.get(key)
+        if route is None:
+            route = self.routes[key] = RouteMetrics()
+        route.status[status] = route.status.get(status, 0) + 1
+        route.latency.observe(elapsed)
+        route.size.observe(size)
+        route.mongo_commands.observe(queries.count)
+        if queries.count >= MONGO_LOG_COMMANDS or queries.micros >= MONGO_LOG_MS * 1000:
+            logger.warning(
+                f"{key[0]} {key[1]}: {queries.count} Mongo commands, {queries.micros / 1000:.1f} ms in Mongo, "
+                f"{elapsed * 1000:.1f} ms total {queries.by_command}"
+            )
+    
+    def observe_compression(self, encoding: str, elapsed: float, bytes_in: int, bytes_out: int):
+        stats = self.compression.get(encoding)
+        if stats is None:
+            stats = self.compression[encoding] = [Histogram(COMPRESSION_BUCKETS), 0, 0]
+        stats[0].observe(elapsed)
+        stats[1] += bytes_in
+        stats[2] += bytes_out
+    
+    def render(self) -> str:
+        lines = [
+            "# HELP agrolink_http_requests_total HTTP requests by route and status code",
+            "# TYPE agrolink_http_requests_total counter",
+        ]
+        routes = sorted(self.routes.items())
+        for (method, path), route in routes:
+            for status, count in sorted(route.status.items()):
+                lines.append(f'agrolink_http_requests_total{{method="{method}",route="{path}",status="{status}"}} {count}')
+        lines += [
+            "# HELP agrolink_http_request_duration_seconds Time until the last body chunk was sent",
+            "# TYPE agrolink_http_request_duration_seconds histogram",
+        ]
+        for (method, path), route in routes:
+            lines += route.latency.render("agrolink_http_request_duration_seconds", f'method="{method}",route="{path}"')
+        lines += [
+            "# HELP agrolink_http_response_size_bytes Response body size",
+            "# TYPE agrolink_http_response_size_bytes histogram",
+        ]
+        for (method, path), route in routes:
+            lines += route.size.render("agrolink_http_response_size_bytes", f'method="{method}",route="{path}"')
+        lines += [
+            "# HELP agrolink_http_request_mongo_commands Mongo commands issued per request",
+            "# TYPE agrolink_http_request_mongo_commands histogram",
+        ]
+        for (method, path), route in routes:
+            lines += route.mongo_commands.render("agrolink_http_request_mongo_commands", f'method="{method}",route="{path}"')
+        lines += [
+            "# HELP agrolink_http_requests_in_flight Requests currently being handled",
+            "# TYPE agrolink_http_requests_in_flight gauge",
+            f"agrolink_http_requests_in_flight {self.in_flight}",
+            "# HELP agrolink_event_loop_lag_seconds Delay of a periodic timer beyond its schedule",
+            "# TYPE agrolink_event_loop_lag_seconds histogram",
+            *self.loop_lag.render("agrolink_event_loop_lag_seconds", ""),
+            "# HELP agrolink_event_loop_lag_last_seconds Most recent event loop lag sample",
+            "# TYPE agrolink_event_loop_lag_last_seconds gauge",
+            f"agrolink_event_loop_lag_last_seconds {self.loop_lag_last}",
+        ]
+        lines += [
+            "# HELP agrolink_compression_seconds CPU time spent compressing each response body chunk",
+            "# TYPE agrolink_compression_seconds histogram",
+        ]
+        for encoding, (histogram, _, _) in sorted(self.compression.items()):
+            lines += histogram.render("agrolink_compression_seconds", f'encoding="{encoding}"')
+        lines += [
+            "# HELP agrolink_compression_bytes_total Response bytes before (in) and after (out) compression",
+            "# TYPE agrolink_compression_bytes_total counter",
+        ]
+        for encoding, (_, bytes_in, bytes_out) in sorted(self.compression.items()):
+            lines.append(f'agrolink_compression_bytes_total{{encoding="{encoding}",direction="in"}} {bytes_in}')
+            lines.append(f'agrolink_compression_bytes_total{{encoding="{encoding}",direction="out"}} {bytes_out}')
+        with self.mongo_pool.lock:
+            pool = dict(self.mongo_pool.counts)
+        lines += [
+            "# HELP agrolink_mongo_pool_connections Open connections to MongoDB",
+            "# TYPE agrolink_mongo_pool_connections gauge",
+            f"agrolink_mongo_pool_connections {pool['created'] - pool['closed']}",
+            "# HELP agrolink_mongo_pool_connections_in_use Connections checked out of the pool",
+            "# TYPE agrolink_mongo_pool_connections_in_use gauge",
+            f"agrolink_mongo_pool_connections_in_use {pool['checked_out'] - pool['checked_in']}",
+            "# HELP agrolink_mongo_pool_max_size maxPoolSize of the client",
+            "# TYPE agrolink_mongo_pool_max_size gauge",
+            f"agrolink_mongo_pool_max_size {client.options.pool_options.max_pool_size}",
+            "# HELP agrolink_mongo_pool_checkouts_total Connections checked out of the pool",
+            "# TYPE agrolink_mongo_pool_checkouts_total counter",
+            f"agrolink_mongo_pool_checkouts_total {pool['checked_out']}",
+            "# HELP agrolink_mongo_pool_checkout_failures_total Checkouts that failed (timeout, pool closed, connection error)",
+            "# TYPE agrolink_mongo_pool_checkout_failures_total counter",
+            f"agrolink_mongo_pool_checkout_failures_total {pool['checkout_failed']}",
+            "# HELP agrolink_mongo_pool_cleared_total Times the pool was cleared after a network error",
+            "# TYPE agrolink_mongo_pool_cleared_total counter",
+            f"agrolink_mongo_pool_cleared_total {pool['pool_cleared']}",
+            "# HELP agrolink_process_start_time_seconds Start time of the process since unix epoch",
+            "# TYPE agrolink_process_start_time_seconds gauge",
+            f"agrolink_process_start_time_seconds {self.started_at}",
+        ]
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+class MetricsMiddleware:
+    """
+    Plain ASGI middleware (no BaseHTTPMiddleware task/stream overhead); a few µs per request.
+    Also adds a Server-Timing header with the Mongo commands issued before the response
+    started (shown in the browser devtools and checked by tests/query_budget.py).
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+        size = 0
+        queries = QueryStats()
+        token = request_query_stats.set(queries)
+        
+        async def send_wrapper(message):
+            nonlocal status, size
+            if message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            elif message["type"] == "http.response.start":
+                status = message["status"]
+                timing = f"{queries.server_timing()}, app;dur={(time.perf_counter() - start) * 1000:.1f}"
+                message["headers"] = [*message.get("headers", []), (b"server-timing", timing.encode())]
+            await send(message)
+        
+        metrics.in_flight += 1
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            metrics.in_flight -= 1
+            request_query_stats.reset(token)
+            # The router stored the matched endpoint in the shared scope dict
+            metrics.observe_request(scope, status, size, time.perf_counter() - start, queries)
+
+async def record_slow_queries():
+    """Started only when SLOW_QUERY_MS > 0"""
+    try:
+        await db.create_collection("slow_queries", capped=True, size=SLOW_QUERY_LOG_BYTES)
+    except CollectionInvalid:
+        pass  # already exists
+    slow_query_log.queue = asyncio.Queue(maxsize=1000)
+    slow_query_log.loop = asyncio.get_running_loop()
+    while True:
+        item = await slow_query_log.queue.get()
+        command = {k: v for k, v in item["command"].items() if k not in COMMAND_META_FIELDS}
+        filtro = command_filter(item["command_name"], command)
+        shape = json.dumps(query_shape(filtro), sort_keys=True)
+        record = {
+            "collection": item["collection"],
+            "operacao": item["command_name"],
+            "shape": shape,
+            "sort": json.dumps(query_shape(command["sort"]), sort_keys=True) if command.get("sort") else None,
+            "duration_ms": item["duration_ms"],
+            "at": datetime.now(timezone.utc).isoformat(),
+            "explain": None,
+        }
+        key = (record["collection"], record["operacao"], shape)
+        now = time.monotonic()
+        if now - slow_query_log.explained_at.get(key, -SLOW_QUERY_EXPLAIN_INTERVAL) >= SLOW_QUERY_EXPLAIN_INTERVAL:
+            slow_query_log.explained_at[key] = now
+            try:
+                explain = await client[item["database"]].command(
+                    {"explain": command, "verbosity": "executionStats"}
+                )
+                record["explain"] = summarize_explain(explain)
+            except Exception as e:
+                logger.warning(f"explain failed for {record['collection']}.{record['operacao']}: {e}")
+        try:
+            await db.slow_queries.insert_one(record)
+        except Exception as e:
+            logger.warning(f"Could not record slow query: {e}")
+
+async def monitor_event_loop_lag():
+    """A timer that fires late means something blocked the loop (sync I/O, CPU-bound work)"""
+    loop = asyncio.get_running_loop()
+    while True:
+        scheduled = loop.time() + LOOP_LAG_INTERVAL
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = max(0.0, loop.time() - scheduled)
+        metrics.loop_lag.observe(lag)
+        metrics.loop_lag_last = lag
+
+# ==================== SLOW QUERY LOG ====================
+# Opt-in (SLOW_QUERY_MS > 0): commands slower than the threshold are stored in the capped
+# collection slow_queries with their collection, duration and filter *shape* (values
+# replaced by "?", so no client data is kept). The first occurrence of a shape in each
+# SLOW_QUERY_EXPLAIN_INTERVAL also gets explain("executionStats"), summarized to the plan
+# stages, index names and docs/keys examined. GET /master/slow-queries groups by shape.
+
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "0"))
+SLOW_QUERY_EXPLAIN_INTERVAL = int(os.environ.get("SLOW_QUERY_EXPLAIN_INTERVAL", "600"))
+SLOW_QUERY_LOG_BYTES = int(os.environ.get("SLOW_QUERY_LOG_MB", "16")) * 1024 * 1024
+SLOW_QUERY_COMMANDS = {"find", "aggregate", "count", "distinct", "update", "delete", "findAndModify"}
+# Driver bookkeeping that is not part of the query and cannot be sent back in explain
+COMMAND_META_FIELDS = {"lsid", "$clusterTime", "$db", "txnNumber", "$readPreference", "signature", "autocommit", "startTransaction"}
+
+LOOKUP_NAME_FIELDS = {"from", "localField", "foreignField", "as"}
+
+def query_shape(value):
+    """Filter/pipeline with every literal replaced by "?" (operators, field names and $lookup targets kept)"""
+    if isinstance(value, dict):
+        return {k: v if k in LOOKUP_NAME_FIELDS else query_shape(v) for k, v in value.items()}
+    if isinstance(value, str) and value.startswith("$"):
+        return value  # field path in a pipeline expression
+    if isinstance(value, list):
+        # $in: [1, 2, 3] and $in: [1] have the same shape
+        shapes = [query_shape(v) for v in value]
+        return shapes if any(isinstance(v, (dict, list)) for v in value) else "?"
+    return "?"
+
+def command_filter(command_name: str, command: dict):
+    if command_name == "find":
+        return command.get("filter", {})
+    if command_name == "aggregate":
+        return command.get("pipeline", [])
+    if command_name in ("count", "distinct", "findAndModify"):
+        return command.get("query", {})
+    if command_name == "update":
+        return (command.get("updates") or [{}])[0].get("q", {})
+    if command_name == "delete":
+        return (command.get("deletes") or [{}])[0].get("q", {})
+    return {}
+
+def summarize_explain(explain: dict) -> dict:
+    """Plan stages, index names and execution counters from any explain layout (find, aggregate, writes)"""
+    stages, indexes = [], []
+    summary = {"docs_examined": 0, "keys_examined": 0, "n_returned": 0}
+    
+    def walk(node):
+        if isinstance(node, dict):
+            if isinstance(node.get("stage"), str):
+                stages.append(node["stage"])
+                if node.get("indexName"):
+                    indexes.append(node["indexName"])
+            stats = node.get("executionStats")
+            if isinstance(stats, dict) and "totalDocsExamined" in stats:
+                summary["docs_examined"] += stats["totalDocsExamined"]
+                summary["keys_examined"] += stats.get("totalKeysExamined", 0)
+                summary["n_returned"] += stats.get("nReturned", 0)
+            for key, child in node.items():
+                if key not in ("rejectedPlans", "allPlansExecution"):
+                    walk(child)
+        elif isinstance(node, list):
+            for child in node:
+                walk(child)
+    
+    walk(explain)
+    summary["stages"] = list(dict.fromkeys(stages))
+    summary["indexes"] = list(dict.fromkeys(indexes))
+    summary["collscan"] = "COLLSCAN" in stages
+    return summary
+
+class SlowQueryLog(monitoring.CommandListener):
+    """
+    Driver threads only hand finished commands to the event loop; the explain and the
+    insert into slow_queries happen in record_slow_queries()
+    """
+    
+    def __init__(self):
+        self.pending: dict = {}
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.queue: Optional[asyncio.Queue] = None
+        self.explained_at: dict = {}
+    
+    def started(self, event):
+        if SLOW_QUERY_MS > 0 and event.command_name in SLOW_QUERY_COMMANDS:
+            self.pending[(event.connection_id, event.request_id)] = (event.database_name, event.command)
+    
+    def succeeded(self, event):
+        started = self.pending.pop((event.connection_id, event.request_id), None)
+        if started is None or self.loop is None or event.duration_micros < SLOW_QUERY_MS * 1000:
+            return
+        database_name, command = started
+        collection = command.get(event.command_name)
+        if collection == "slow_queries":
+            return
+        self.loop.call_soon_threadsafe(self._enqueue, {
+            "database": database_name,
+            "command_name": event.command_name,
+            "collection": collection,
+            "command": command,
+            "duration_ms": event.duration_micros / 1000,
+        })
+    
+    def failed(self, event):
+        self.pending.pop((event.connection_id, event.request_id), None)
+    
+    def _enqueue(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            pass  # a burst of slow queries: the ones already queued tell the story
+
+slow_query_log = SlowQueryLog()
+
+# ==================== TRACING ====================
+# Spans without an external collector: TracingMiddleware opens a root span per sampled
+# request and trace_span() / TracingCommandListener add children for Mongo commands,
+# bcrypt, filesystem operations and outbound HTTP (IBGE, S3). Finished traces stay in an
+# in-memory ring (GET /api/master/traces) and, with TRACE_FILE set, are appended as JSONL.
+
+# Every traced request pays for its spans; trace a small share unless asked for more
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_KEEP = int(os.environ.get("TRACE_KEEP", "100"))
+TRACE_MAX_SPANS = int(os.environ.get("TRACE_MAX_SPANS", "500"))
+TRACE_FILE = os.environ.get("TRACE_FILE", "")
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "start", "end", "attrs")
+    
+    def __init__(self, trace: "Trace", parent_id: Optional[str], name: str, attrs: dict):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.attrs = attrs
+    
+    def finish(self):
+        self.end = time.perf_counter()
+        self.trace.add(self)
+
+class Trace:
+    __slots__ = ("trace_id", "started_at", "spans", "dropped", "root")
+    
+    def __init__(self):
+        self.trace_id = os.urandom(16).hex()
+        self.started_at = datetime.now(timezone.utc).isoformat()
+        self.spans: List[Span] = []
+        self.dropped = 0
+        self.root: Optional[Span] = None
+    
+    def add(self, span: Span):
+        # list.append is atomic, so driver threads can finish Mongo spans concurrently
+        if len(self.spans) < TRACE_MAX_SPANS:
+            self.spans.append(span)
+        else:
+            self.dropped += 1
+    
+    def to_dict(self) -> dict:
+        origin = self.root.start
+        depth = {self.root.span_id: 0}
+        spans = []
+        for span in sorted(self.spans, key=lambda s: s.start):
+            depth[span.span_id] = depth.get(span.parent_id, 0) + 1 if span.parent_id else 0
+            spans.append({
+                "span_id": span.span_id,
+                "parent_id": span.parent_id,
+                "nome": span.name,
+                "inicio_ms": round((span.start - origin) * 1000, 3),
+                "duracao_ms": round((span.end - span.start) * 1000, 3),
+                "profundidade": depth[span.span_id],
+                "atributos": span.attrs,
+            })
+        return {
+            "trace_id": self.trace_id,
+            "nome": self.root.name,
+            "inicio": self.started_at,
+            "duracao_ms": round((self.root.end - self.root.start) * 1000, 3),
+            "descartados": self.dropped,
+            "spans": spans,
+        }
+
+current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+finished_traces: collections.deque = collections.deque(maxlen=TRACE_KEEP)
+
+@contextlib.contextmanager
+def trace_span(name: str, **attrs):
+    """Child of the current span; does nothing outside a sampled request"""
+    parent = current_span.get()
+    if parent is None:
+        yield None
+        return
+    span = Span(parent.trace, parent.span_id, name, attrs)
+    token = current_span.set(span)
+    try:
+        yield span
+    finally:
+        current_span.reset(token)
+        span.finish()
+
+class TracingCommandListener(monitoring.CommandListener):
+    def __init__(self):
+        self.pending: dict = {}
+    
+    def started(self, event):
+        parent = current_span.get()
+        if parent is not None:
+            collection = event.command.get(event.command_name)
+            self.pending[(event.connection_id, event.request_id)] = Span(
+                parent.trace, parent.span_id, f"mongo {event.command_name}",
+                {"collection": collection if isinstance(collection, str) else None}
+            )
+    
+    def succeeded(self, event):
+        span = self.pending.pop((event.connection_id, event.request_id), None)
+        if span is not None:
+            span.finish()
+    
+    def failed(self, event):
+        span = self.pending.pop((event.connection_id, event.request_id), None)
+        if span is not None:
+            span.attrs["erro"] = str(event.failure)[:200]
+            span.finish()
+
+tracing_listener = TracingCommandListener()
+
+# Traces finish on many requests at once and are written from executor threads;
+# one writer at a time keeps each JSONL line whole
+_trace_file_lock = threading.Lock()
+
+def _append_jsonl(path: str, line: str):
+    with _trace_file_lock, open(path, "a", encoding="utf-8") as f:
+        f.write(line)
+
+class TracingMiddleware:
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or random.random() >= TRACE_SAMPLE_RATE:
+            await self.app(scope, receive, send)
+            return
+        trace = Trace()
+        root = trace.root = Span(trace, None, scope["path"], {"method": scope["method"], "path": scope["path"]})
+        token = current_span.set(root)
+        
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                root.attrs["status"] = message["status"]
+                message["headers"] = [*message.get("headers", []), (b"x-trace-id", trace.trace_id.encode())]
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_span.reset(token)
+            root.name = f"{scope['method']} {metrics.route_template(scope)}"
+            root.finish()
+            finished_traces.append(trace)
+            if TRACE_FILE:
+                line = json.dumps(trace.to_dict(), default=str) + "\n"
+                asyncio.get_running_loop().run_in_executor(None, _append_jsonl, TRACE_FILE, line)
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(
+    mongo_url, event_listeners=[metrics.mongo_pool, metrics.mongo_commands, slow_query_log, tracing_listener]
+)
 db = client[os.environ['DB_NAME']]
 
 # JWT Settings
@@ -33,7 +667,21 @@ JWT_EXPIRATION_HOURS = 24
 # File upload settings
 UPLOAD_DIR = ROOT_DIR / "uploads"
 UPLOAD_DIR.mkdir(exist_ok=True)
+# Content-addressed store: one file per distinct SHA-256, hardlinked into client folders
+BLOB_DIR = UPLOAD_DIR / ".blobs"
+BLOB_TMP_DIR = BLOB_DIR / "tmp"
+BLOB_TMP_DIR.mkdir(parents=True, exist_ok=True)
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+MULTIPART_OVERHEAD = 64 * 1024  # room for boundaries and part headers around the file
+
+# Document delivery: "app" sends the bytes from this process; "accel" only authorizes
+# the download and lets nginx send the file (X-Accel-Redirect to an internal location,
+# see nginx/agrolink-*.conf)
+FILE_DELIVERY = os.environ.get("FILE_DELIVERY", "app")
+ACCEL_REDIRECT_PREFIX = os.environ.get("ACCEL_REDIRECT_PREFIX", "/uploads/")
+# Short-lived links that open a document without the Authorization header
+SIGNED_URL_SECRET = os.environ.get("SIGNED_URL_SECRET", JWT_SECRET).encode()
+SIGNED_URL_TTL = int(os.environ.get("SIGNED_URL_TTL", "300"))
 
 # Create the main app
 app = FastAPI(title="AgroLink API", version="1.0.0")
@@ -131,6 +779,9 @@ class ClientResponse(ClientBase):
     tem_proposta_aberta: Optional[bool] = False
     ultimo_alerta: Optional[str] = None
     qtd_alertas: Optional[int] = 0
+    armazenamento_bytes: int = 0
+    armazenamento_arquivos: int = 0
+    cota_armazenamento_bytes: Optional[int] = None
 
 # ==================== INSTITUICAO FINANCEIRA MODELS ====================
 
@@ -303,13 +954,78 @@ class ConfigBase(BaseModel):
     logo_path: Optional[str] = None
     campos_extras_cliente: List[dict] = []
 
+# ==================== UPLOAD SESSION MODELS ====================
+
+class UploadSessionCreate(BaseModel):
+    filename: str
+    size: int
+    sha256: Optional[str] = None  # Verificado ao finalizar
+    mime_type: Optional[str] = None
+    categoria: Optional[str] = None  # Campo do documentos_check
+    chunk_size: int = 1024 * 1024
+
+# ==================== FAST LIST RESPONSES ====================
+# List endpoints used to build one response model per row and then let FastAPI validate
+# and serialize the whole list again through response_model (~200 ms per 1k projects).
+# Rows read from our own collections are trusted instead: a per-model plan keeps the
+# model's fields with their defaults (nested models included), drops everything else,
+# and the result goes straight to orjson. response_model stays on the route, so the
+# OpenAPI schema does not change; FastAPI skips it because a Response is returned.
+# Values are not coerced (an int stored in a float field is sent as an int).
+# benchmarks/bench_list_serialization.py compares both paths.
+
+def _nested_model(annotation):
+    """("model", M) for M / Optional[M], ("list", M) for List[M], else (None, None)"""
+    origin = get_origin(annotation)
+    if origin in (Union, types.UnionType):
+        args = [a for a in get_args(annotation) if a is not type(None)]
+        return _nested_model(args[0]) if len(args) == 1 else (None, None)
+    if origin is list:
+        args = get_args(annotation)
+        kind, model = _nested_model(args[0]) if args else (None, None)
+        return ("list", model) if kind == "model" else (None, None)
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return ("model", annotation)
+    return (None, None)
+
+@functools.lru_cache(maxsize=None)
+def response_plan(model) -> tuple:
+    plan = []
+    for name, field in model.model_fields.items():
+        kind, nested = _nested_model(field.annotation)
+        default = None if field.is_required() else field.get_default(call_default_factory=True)
+        if isinstance(default, BaseModel):
+            default = default.model_dump()
+        plan.append((name, default, kind, response_plan(nested) if nested else None))
+    return tuple(plan)
+
+def dump_trusted(plan: tuple, doc: dict) -> dict:
+    out = {}
+    for name, default, kind, nested in plan:
+        value = doc.get(name, default)
+        if kind is not None and value is not None:
+            value = dump_trusted(nested, value) if kind == "model" else [dump_trusted(nested, v) for v in value]
+        out[name] = value
+    return out
+
+def trusted_list_response(model, rows: List[dict]) -> Response:
+    plan = response_plan(model)
+    content = [dump_trusted(plan, row) for row in rows]
+    if orjson is not None:
+        body = orjson.dumps(content, default=str)
+    else:
+        body = json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=str).encode()
+    return Response(content=body, media_type="application/json")
+
 # ==================== AUTH HELPERS ====================
 
 def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+    with trace_span("bcrypt.hashpw"):
+        return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
 
 def verify_password(password: str, hashed: str) -> bool:
-    return bcrypt.checkpw(password.encode(), hashed.encode())
+    with trace_span("bcrypt.checkpw"):
+        return bcrypt.checkpw(password.encode(), hashed.encode())
 
 def create_token(user_id: str, role: str) -> str:
     payload = {
@@ -350,6 +1066,866 @@ def require_role(allowed_roles: List[str]):
         return user
     return check_role
 
+# ==================== DB HELPERS ====================
+
+async def find_one_by_id(collection, doc_id: Optional[str]):
+    """find_one by "id" that resolves to None when no id is given, so it can sit in asyncio.gather"""
+    if not doc_id:
+        return None
+    return await collection.find_one({"id": doc_id}, {"_id": 0})
+
+def new_client_defaults(client_id: str, now: str) -> dict:
+    """Fields a client gets when it is created implicitly (by proposta intake)"""
+    return {
+        "id": client_id,
+        "endereco": "",
+        "data_nascimento": "",
+        "parceiro_id": None,
+        "parceiro_nome": None,
+        "estado": None,
+        "cidade": None,
+        "created_at": now,
+        "ultimo_alerta": None,
+        "qtd_alertas": 0
+    }
+
+async def upsert_client_by_cpf(cpf: str, nome_completo: str, telefone: str, now: str):
+    """
+    Create the client for a CPF, or refresh nome/telefone if it already exists.
+    Returns (client, created). One round trip; the unique index on clients.cpf
+    keeps concurrent upserts from creating duplicates.
+    """
+    new_id = str(uuid.uuid4())
+    update = {
+        "$set": {"nome_completo": nome_completo.upper(), "telefone": telefone},
+        "$setOnInsert": {"cpf": cpf, **new_client_defaults(new_id, now)},
+    }
+    try:
+        client_doc = await db.clients.find_one_and_update(
+            {"cpf": cpf}, update, projection={"_id": 0}, upsert=True, return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # Lost an insert race with another request: the document exists now, so this is a plain update
+        client_doc = await db.clients.find_one_and_update(
+            {"cpf": cpf}, {"$set": update["$set"]}, projection={"_id": 0}, return_document=ReturnDocument.AFTER
+        )
+    return client_doc, client_doc["id"] == new_id
+
+def build_clients_query(search: Optional[str] = None) -> dict:
+    """Filters shared by GET /clients and the clients export"""
+    query = {}
+    if search:
+        query["$or"] = [
+            {"nome_completo": {"$regex": search, "$options": "i"}},
+            {"cpf": {"$regex": search}}
+        ]
+    return query
+
+def build_projects_query(status: Optional[str] = None, mes: Optional[int] = None, ano: Optional[int] = None) -> dict:
+    """Filters shared by GET /projects and the projects export"""
+    query = {}
+    if status:
+        query["status"] = status
+    
+    if mes and ano:
+        start_date = datetime(ano, mes, 1, tzinfo=timezone.utc).isoformat()
+        if mes == 12:
+            end_date = datetime(ano + 1, 1, 1, tzinfo=timezone.utc).isoformat()
+        else:
+            end_date = datetime(ano, mes + 1, 1, tzinfo=timezone.utc).isoformat()
+        query["data_inicio"] = {"$gte": start_date, "$lt": end_date}
+    return query
+
+def projeto_tem_pendencia(proj: dict) -> bool:
+    """Unresolved pendências or missing checklist items for the project's current stage"""
+    for etapa in proj.get("historico_etapas", []):
+        for pend in etapa.get("pendencias", []):
+            if not pend.get("resolvida", False):
+                return True
+    
+    docs = proj.get("documentos_check", {})
+    etapa_nome = proj.get("etapa_atual_nome", "")
+    
+    # Check stage-specific requirements
+    if "Coleta de Documentos" in etapa_nome:
+        return not all([docs.get("rg_cnh"), docs.get("conta_banco_brasil"), docs.get("ccu_titulo"), docs.get("saldo_iagro"), docs.get("car")])
+    elif "Desenvolvimento do Projeto" in etapa_nome:
+        return not docs.get("projeto_implementado")
+    elif "Coletar Assinaturas" in etapa_nome:
+        return not docs.get("projeto_assinado")
+    elif "Protocolo CENOP" in etapa_nome:
+        return not docs.get("projeto_protocolado")
+    elif "Instrumento de Crédito" in etapa_nome:
+        return not all([docs.get("assinatura_agencia"), docs.get("upload_contrato")])
+    elif "GTA e Nota Fiscal" in etapa_nome:
+        return not all([docs.get("gta_emitido"), docs.get("nota_fiscal_emitida")])
+    elif "Projeto Creditado" in etapa_nome:
+        return not docs.get("comprovante_servico_pago")
+    return False
+
+# ==================== VALIDATION HELPERS ====================
+
+def completar_cpf(base: str) -> str:
+    """The 11-digit CPF for nine base digits: appends the two verification digits (mod 11)"""
+    digits = [int(c) for c in base]
+    for size in (9, 10):
+        total = sum(d * w for d, w in zip(digits, range(size + 1, 1, -1)))
+        digits.append((total * 10 % 11) % 10)
+    return "".join(str(d) for d in digits)
+
+def cpf_digitos_validos(cpf: str) -> bool:
+    """Check the two CPF verification digits (mod 11)"""
+    if len(cpf) != 11 or len(set(cpf)) == 1:
+        return False
+    return completar_cpf(cpf[:9]) == cpf
+
+def clean_cpf(cpf: Optional[str]) -> Optional[str]:
+    """Digits-only CPF, or None if it is not a valid CPF"""
+    cpf_clean = re.sub(r'\D', '', cpf or "")
+    if len(cpf_clean) != 11 or not cpf_digitos_validos(cpf_clean):
+        return None
+    return cpf_clean
+
+def normalize_nome(nome: str) -> str:
+    """Case- and accent-insensitive key used to match names typed by users"""
+    decomposed = unicodedata.normalize("NFKD", nome or "")
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).strip().lower()
+
+# ==================== LOOKUP CACHE ====================
+
+LOOKUP_CACHE_TTL = 60  # seconds
+_lookup_cache = {}
+
+async def get_lookup_table(collection_name: str) -> dict:
+    """
+    Small reference collections (tipos_projeto, instituicoes_financeiras) indexed
+    by id and by normalized name. Cached per worker for LOOKUP_CACHE_TTL seconds
+    and dropped on every local write through invalidate_lookup_table.
+    """
+    cached = _lookup_cache.get(collection_name)
+    if cached and time.monotonic() - cached[0] < LOOKUP_CACHE_TTL:
+        return cached[1]
+    
+    docs = await db[collection_name].find({}, {"_id": 0}).to_list(1000)
+    table = {}
+    # Inactive entries first so an active one with the same name wins
+    for doc in sorted(docs, key=lambda d: d.get("ativo", True)):
+        table[doc["id"]] = doc
+        table[normalize_nome(doc["nome"])] = doc
+    _lookup_cache[collection_name] = (time.monotonic(), table)
+    return table
+
+def invalidate_lookup_table(collection_name: str):
+    _lookup_cache.pop(collection_name, None)
+
+# ==================== FILESYSTEM SERVICE ====================
+
+FS_MAX_WORKERS = int(os.environ.get("FS_MAX_WORKERS", "8"))
+FS_MAX_TREE_OPS = int(os.environ.get("FS_MAX_TREE_OPS", "2"))
+FS_SLOW_OP_MS = float(os.environ.get("FS_SLOW_OP_MS", "200"))
+
+def _remove_tree(path: Path):
+    shutil.rmtree(path, ignore_errors=True)
+
+def _reset_dir(path: Path):
+    shutil.rmtree(path, ignore_errors=True)
+    path.mkdir(exist_ok=True)
+
+def _remove_subdirs(root: Path):
+    if root.exists():
+        for folder in root.iterdir():
+            if folder.is_dir():
+                shutil.rmtree(folder, ignore_errors=True)
+
+def _make_dirs(paths: List[Path]):
+    for path in paths:
+        path.mkdir(parents=True, exist_ok=True)
+
+def _is_file(path: Path) -> bool:
+    return path.is_file()
+
+def _stat_file(path: Path) -> Optional[os.stat_result]:
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return st if stat.S_ISREG(st.st_mode) else None
+
+def _unlink(path: Path):
+    path.unlink(missing_ok=True)
+
+def _find_first(paths: List[Path]) -> Optional[Path]:
+    for path in paths:
+        if path.exists():
+            return path
+    return None
+
+def _allocate_file(path: Path, size: int):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb") as f:
+        f.truncate(size)
+
+def _write_at(path: Path, offset: int, data: bytes):
+    # pwrite on a shared preallocated file: chunks of one upload can arrive in parallel
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        os.pwrite(fd, data, offset)
+    finally:
+        os.close(fd)
+
+def _hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def blob_path(sha256: str) -> Path:
+    return BLOB_DIR / sha256[:2] / sha256
+
+# A blob's link count is read and changed only under this lock, so a release
+# cannot unlink a blob between another upload's existence check and its link
+# (the service runs as a single uvicorn process)
+_blob_lock = threading.Lock()
+
+def _link_blob(temp_path: Optional[Path], sha256: str, dest: Path) -> bool:
+    """
+    Make `dest` a hardlink to the blob for `sha256`, moving `temp_path` into the
+    store first if the blob does not exist yet. Returns True if a new blob was
+    written. The blob's link count is its reference count: every client file
+    pointing at it is one extra link. On a filesystem without hardlinks the
+    document is stored as an independent file and no blob is kept for it.
+    """
+    blob = blob_path(sha256)
+    link_tmp = dest.with_name(f".link-{uuid.uuid4().hex}")
+    written = False
+    with _blob_lock:
+        try:
+            try:
+                os.link(blob, link_tmp)
+            except FileNotFoundError:
+                if temp_path is None:
+                    raise
+                blob.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(temp_path, blob)
+                written = True
+                os.link(blob, link_tmp)
+        except OSError as e:
+            if isinstance(e, FileNotFoundError) or not blob.exists():
+                raise
+            # Filesystem without hardlinks: no deduplication. A blob that was just
+            # written becomes the document itself, so every stored blob keeps an
+            # exact link count and release_blobs never drops one still in use
+            if written:
+                os.replace(blob, link_tmp)
+                written = False
+            else:
+                shutil.copyfile(blob, link_tmp)
+        finally:
+            if temp_path is not None and not written:
+                temp_path.unlink(missing_ok=True)
+        # Atomic: replaces a same-named document, which drops that one's link
+        os.replace(link_tmp, dest)
+    return written
+
+def _release_blobs(hashes: List[str]):
+    """Delete blobs that no client file links to anymore"""
+    with _blob_lock:
+        for sha256 in set(hashes):
+            blob = blob_path(sha256)
+            try:
+                if blob.stat().st_nlink <= 1:
+                    blob.unlink()
+            except FileNotFoundError:
+                pass
+
+def _replace_files(pattern_folder: Path, pattern: str, target: Path, contents: bytes):
+    """Remove every file matching `pattern` and write `contents` to `target`"""
+    pattern_folder.mkdir(exist_ok=True)
+    for old_file in pattern_folder.glob(pattern):
+        old_file.unlink()
+    target.write_bytes(contents)
+
+class FileSystemService:
+    """
+    Runs blocking filesystem work in its own thread pool so that a client folder
+    full of scans never stalls the event loop. The pool size bounds concurrent
+    operations, and whole-tree removals get a smaller limit of their own so a
+    few deletes cannot occupy every worker. Operations slower than FS_SLOW_OP_MS
+    are logged.
+    """
+    
+    def __init__(self, max_workers: int, max_tree_ops: int):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fs")
+        self._tree_ops = asyncio.Semaphore(max_tree_ops)
+    
+    async def _run(self, op_name: str, func, *args):
+        start = time.perf_counter()
+        try:
+            with trace_span(f"fs.{op_name}", path=str(args[0]) if args else None):
+                return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(func, *args))
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if elapsed_ms >= FS_SLOW_OP_MS:
+                target = args[0] if args else ""
+                logger.warning(f"Slow filesystem operation {op_name}({target}): {elapsed_ms:.0f} ms")
+    
+    async def remove_tree(self, path: Path):
+        async with self._tree_ops:
+            await self._run("remove_tree", _remove_tree, path)
+    
+    async def reset_dir(self, path: Path):
+        """Empty a folder, keeping the folder itself"""
+        async with self._tree_ops:
+            await self._run("reset_dir", _reset_dir, path)
+    
+    async def remove_subdirs(self, root: Path):
+        async with self._tree_ops:
+            await self._run("remove_subdirs", _remove_subdirs, root)
+    
+    async def allocate_file(self, path: Path, size: int):
+        await self._run("allocate_file", _allocate_file, path, size)
+    
+    async def write_at(self, path: Path, offset: int, data: bytes):
+        await self._run("write_at", _write_at, path, offset, data)
+    
+    async def hash_file(self, path: Path) -> str:
+        return await self._run("hash_file", _hash_file, path)
+    
+    async def make_dirs(self, *paths: Path):
+        await self._run("make_dirs", _make_dirs, list(paths))
+    
+    async def is_file(self, path: Path) -> bool:
+        return await self._run("is_file", _is_file, path)
+    
+    async def stat_file(self, path: Path) -> Optional[os.stat_result]:
+        return await self._run("stat_file", _stat_file, path)
+    
+    async def unlink(self, path: Path):
+        await self._run("unlink", _unlink, path)
+    
+    async def find_first(self, paths: List[Path]) -> Optional[Path]:
+        return await self._run("find_first", _find_first, paths)
+    
+    async def replace_files(self, folder: Path, pattern: str, target: Path, contents: bytes):
+        await self._run("replace_files", _replace_files, folder, pattern, target, contents)
+    
+    async def scan_legacy_files(self, root: Path) -> List[dict]:
+        async with self._tree_ops:
+            return await self._run("scan_legacy_files", _scan_legacy_files, root)
+    
+    async def link_blob(self, temp_path: Optional[Path], sha256: str, dest: Path) -> bool:
+        return await self._run("link_blob", _link_blob, temp_path, sha256, dest)
+    
+    async def release_blobs(self, hashes: List[str]):
+        if hashes:
+            await self._run("release_blobs", _release_blobs, hashes)
+
+fs = FileSystemService(FS_MAX_WORKERS, FS_MAX_TREE_OPS)
+
+# ==================== DOCUMENT STORAGE ====================
+#
+# Where document bytes live. The files index, SHA-256 deduplication, upload
+# sessions and permissions are shared; a storage driver only stores, serves and
+# deletes content. STORAGE_BACKEND=local keeps documents on this host (blob store
+# hardlinked into UPLOAD_DIR/<client_id>/). STORAGE_BACKEND=s3 keeps one object
+# per distinct SHA-256 in an S3-compatible bucket (AWS S3, MinIO, ...) so that
+# several backend hosts can share the same documents; the local disk is then
+# only used for staging uploads.
+
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "local")
+# How long a release may hold a blob before another host may pin it again
+BLOB_GUARD_LEASE = timedelta(minutes=1)
+BLOB_GUARD_RETRIES = 200
+LOGO_EXTENSIONS = ["png", "jpg", "jpeg", "svg", "webp"]
+
+class LocalStorage:
+    name = "local"
+    
+    def __init__(self):
+        # Resolved logo path, validated with a single stat per request so a logo
+        # replaced by another worker is picked up at once
+        self._logo_path: Optional[Path] = None
+    
+    async def close(self):
+        pass
+    
+    async def prepare_clients(self, client_ids: List[str]):
+        await fs.make_dirs(*[UPLOAD_DIR / client_id for client_id in client_ids])
+    
+    async def has_blob(self, sha256: str) -> bool:
+        return await fs.is_file(blob_path(sha256))
+    
+    async def store_document(self, client_id: str, name: str, temp_path: Optional[Path], sha256: str, size: int):
+        await fs.make_dirs(UPLOAD_DIR / client_id)
+        await fs.link_blob(temp_path, sha256, UPLOAD_DIR / client_id / name)
+    
+    async def delete_document(self, client_id: str, name: str):
+        await fs.unlink(UPLOAD_DIR / client_id / name)
+    
+    async def release_blobs(self, hashes: List[str]):
+        # The blob's hardlink count is its reference count
+        await fs.release_blobs(hashes)
+    
+    async def unpin_blob(self, sha256: str):
+        pass  # The hardlink made by store_document already holds the blob
+    
+    # Resumable uploads: chunks are written into one preallocated file, which
+    # store_document then moves into the blob store
+    async def open_upload(self, session: dict):
+        await fs.allocate_file(upload_session_path(session), session["size"])
+    
+    async def write_upload_chunk(self, session: dict, index: int, data: bytes):
+        await fs.write_at(upload_session_path(session), index * session["chunk_size"], data)
+    
+    async def assemble_upload(self, session: dict) -> Path:
+        return upload_session_path(session)
+    
+    async def drop_assembled_upload(self, path: Path):
+        pass  # The partial file is the session's data; chunks can still be resent into it
+    
+    async def discard_upload(self, session: dict):
+        await fs.unlink(upload_session_path(session))
+    
+    async def remove_client(self, client_id: str):
+        await fs.remove_tree(UPLOAD_DIR / client_id)
+    
+    async def reset_client(self, client_id: str):
+        await fs.reset_dir(UPLOAD_DIR / client_id)
+    
+    async def reset_all(self):
+        await fs.remove_subdirs(UPLOAD_DIR)
+        await fs.make_dirs(BLOB_TMP_DIR)
+    
+    async def scan_legacy_documents(self) -> List[dict]:
+        return await fs.scan_legacy_files(UPLOAD_DIR)
+    
+    async def document_response(self, request: Request, client_id: str, filename: str) -> Response:
+        file_path = UPLOAD_DIR / client_id / filename
+        
+        if FILE_DELIVERY == "accel":
+            # One indexed lookup and no disk access here; nginx handles Range and caching
+            ref = await db.files.find_one({"client_id": client_id, "name": filename}, {"_id": 0, "mime_type": 1})
+            if not ref:
+                raise HTTPException(status_code=404, detail="Arquivo não encontrado")
+            return Response(
+                media_type=ref.get("mime_type") or "application/octet-stream",
+                headers={
+                    "X-Accel-Redirect": quote(f"{ACCEL_REDIRECT_PREFIX}{client_id}/{filename}"),
+                    "Content-Disposition": content_disposition(filename),
+                },
+            )
+        
+        # Only indexed documents are served, as in accel mode: the client folders also
+        # hold in-progress uploads, and UPLOAD_DIR holds .profiles, .cache and the blobs
+        st, ref = await asyncio.gather(
+            fs.stat_file(file_path),
+            db.files.find_one({"client_id": client_id, "name": filename}, {"_id": 0, "hash": 1, "mime_type": 1}),
+        )
+        if st is None or ref is None:
+            raise HTTPException(status_code=404, detail="Arquivo não encontrado")
+        
+        # The content hash is a strong validator; fall back to mtime/size for rows without one
+        etag = f'"{ref["hash"]}"' if ref.get("hash") else None
+        return file_response(
+            request, file_path, st, etag=etag, filename=filename, media_type=ref.get("mime_type")
+        )
+    
+    async def open_document(self, client_id: str, doc: dict):
+        """Async iterator over the document's bytes, or None if it is gone"""
+        try:
+            f = await aiofiles.open(UPLOAD_DIR / client_id / doc["name"], "rb")
+        except FileNotFoundError:
+            return None
+        
+        async def chunks():
+            try:
+                while chunk := await f.read(DOWNLOAD_CHUNK_SIZE):
+                    yield chunk
+            finally:
+                await f.close()
+        return chunks()
+    
+    async def save_logo(self, ext: str, contents: bytes):
+        # Removes the old logo whatever its extension
+        logo_folder = UPLOAD_DIR / "config"
+        logo_path = logo_folder / f"logo.{ext}"
+        await fs.replace_files(logo_folder, "logo.*", logo_path, contents)
+        self._logo_path = logo_path
+    
+    async def logo_response(self, request: Request, cache_control: str) -> Response:
+        logo_path = self._logo_path
+        st = await fs.stat_file(logo_path) if logo_path else None
+        if st is None:
+            logo_folder = UPLOAD_DIR / "config"
+            logo_path = await fs.find_first([logo_folder / f"logo.{ext}" for ext in LOGO_EXTENSIONS])
+            st = await fs.stat_file(logo_path) if logo_path else None
+            self._logo_path = logo_path if st else None
+        if st is None:
+            raise HTTPException(status_code=404, detail="Logo não encontrado")
+        return file_response(request, logo_path, st, cache_control=cache_control)
+
+# S3-compatible object storage, spoken directly over the shared httpx client
+# (SigV4-signed requests, path-style URLs) instead of pulling in boto
+S3_ENDPOINT = os.environ.get("S3_ENDPOINT", "").rstrip("/")  # ex.: http://127.0.0.1:9000
+S3_BUCKET = os.environ.get("S3_BUCKET", "agrolink")
+S3_REGION = os.environ.get("S3_REGION", "us-east-1")
+S3_ACCESS_KEY = os.environ.get("S3_ACCESS_KEY", "")
+S3_SECRET_KEY = os.environ.get("S3_SECRET_KEY", "")
+S3_PREFIX = os.environ.get("S3_PREFIX", "")
+S3_MAX_CONNECTIONS = int(os.environ.get("S3_MAX_CONNECTIONS", "20"))
+S3_PART_SIZE = 8 * 1024 * 1024  # S3 needs at least 5MB for every part but the last
+
+class S3Error(Exception):
+    def __init__(self, status_code: int, message: str):
+        super().__init__(f"S3 {status_code}: {message}")
+        self.status_code = status_code
+
+def s3_quote(value: str, safe: str = "-_.~") -> str:
+    return quote(value, safe=safe)
+
+def sigv4_headers(
+    method: str, url: httpx.URL, region: str, access_key: str, secret_key: str,
+    payload_hash: str, now: Optional[datetime] = None, service: str = "s3"
+) -> dict:
+    """AWS Signature Version 4 headers for a request whose payload hash is `payload_hash`"""
+    amz_date = (now or datetime.now(timezone.utc)).strftime("%Y%m%dT%H%M%SZ")
+    day = amz_date[:8]
+    signed = {"host": url.netloc.decode(), "x-amz-content-sha256": payload_hash, "x-amz-date": amz_date}
+    signed_headers = ";".join(signed)
+    canonical_query = "&".join(
+        f"{s3_quote(k)}={s3_quote(v)}" for k, v in sorted(url.params.multi_items())
+    )
+    canonical_request = "\n".join([
+        method,
+        url.raw_path.split(b"?")[0].decode(),
+        canonical_query,
+        "".join(f"{k}:{v}\n" for k, v in signed.items()),
+        signed_headers,
+        payload_hash,
+    ])
+    scope = f"{day}/{region}/{service}/aws4_request"
+    string_to_sign = "\n".join([
+        "AWS4-HMAC-SHA256", amz_date, scope, hashlib.sha256(canonical_request.encode()).hexdigest()
+    ])
+    key = f"AWS4{secret_key}".encode()
+    for part in (day, region, service, "aws4_request"):
+        key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+    signature = hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+    return {
+        "x-amz-content-sha256": payload_hash,
+        "x-amz-date": amz_date,
+        "Authorization": (
+            f"AWS4-HMAC-SHA256 Credential={access_key}/{scope}, "
+            f"SignedHeaders={signed_headers}, Signature={signature}"
+        ),
+    }
+
+class S3Storage:
+    """
+    Documents as S3 objects named blobs/<sha256[:2]>/<sha256>, one per distinct
+    content. The files index is the reference count: a blob is deleted when no
+    files row points at its hash anymore. All requests share one pooled httpx
+    client; uploads are streamed from the staging file, in S3_PART_SIZE parts
+    (multipart upload) when larger than one part.
+    """
+    name = "s3"
+    
+    def __init__(self, endpoint: str, bucket: str, access_key: str, secret_key: str,
+                 region: str = "us-east-1", prefix: str = "", max_connections: int = 20):
+        if not endpoint:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires S3_ENDPOINT")
+        self.endpoint = endpoint
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.prefix = prefix
+        self.max_connections = max_connections
+        self._client: Optional[httpx.AsyncClient] = None
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+                timeout=httpx.Timeout(30.0, connect=5.0),
+            )
+        return self._client
+    
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    def _url(self, key: str, params: Optional[dict] = None) -> httpx.URL:
+        path = f"/{self.bucket}/{s3_quote(self.prefix + key, safe='/-_.~')}" if key else f"/{self.bucket}/"
+        return httpx.URL(self.endpoint + path, params=params)
+    
+    async def _request(
+        self, method: str, key: str, params: Optional[dict] = None, headers: Optional[dict] = None,
+        content=None, payload_hash: str = "UNSIGNED-PAYLOAD", stream: bool = False, ok=(200,)
+    ) -> httpx.Response:
+        url = self._url(key, params)
+        auth = sigv4_headers(method, url, self.region, self.access_key, self.secret_key, payload_hash)
+        request = self.client.build_request(method, url, headers={**(headers or {}), **auth}, content=content)
+        with trace_span(f"s3 {method}", key=key) as span:
+            response = await self.client.send(request, stream=stream)
+            if span:
+                span.attrs["status"] = response.status_code
+        if response.status_code not in ok:
+            body = await response.aread()
+            await response.aclose()
+            raise S3Error(response.status_code, body[:300].decode(errors="replace"))
+        return response
+    
+    @staticmethod
+    def blob_key(sha256: str) -> str:
+        return f"blobs/{sha256[:2]}/{sha256}"
+    
+    async def put_blob(self, path: Path, sha256: str, size: int):
+        key = self.blob_key(sha256)
+        if size <= S3_PART_SIZE:
+            # The content hash doubles as the signed payload hash: S3 rejects a corrupted body
+            await self._request(
+                "PUT", key, headers={"Content-Length": str(size)},
+                content=iter_file_range(path, 0, size), payload_hash=sha256
+            )
+            return
+        
+        response = await self._request("POST", key, params={"uploads": ""})
+        upload_id = ET.fromstring(response.content).findtext("{*}UploadId")
+        try:
+            parts = []
+            for number, offset in enumerate(range(0, size, S3_PART_SIZE), start=1):
+                length = min(S3_PART_SIZE, size - offset)
+                response = await self._request(
+                    "PUT", key, params={"partNumber": str(number), "uploadId": upload_id},
+                    headers={"Content-Length": str(length)}, content=iter_file_range(path, offset, length)
+                )
+                parts.append(f"<Part><PartNumber>{number}</PartNumber><ETag>{response.headers['etag']}</ETag></Part>")
+            body = f"<CompleteMultipartUpload>{''.join(parts)}</CompleteMultipartUpload>".encode()
+            response = await self._request(
+                "POST", key, params={"uploadId": upload_id}, content=body,
+                payload_hash=hashlib.sha256(body).hexdigest()
+            )
+            # CompleteMultipartUpload can fail with a 200 and an <Error> body
+            if ET.fromstring(response.content).tag.endswith("Error"):
+                raise S3Error(response.status_code, response.text[:300])
+        except BaseException:
+            with contextlib.suppress(Exception):
+                await self._request("DELETE", key, params={"uploadId": upload_id}, ok=(200, 204, 404))
+            raise
+    
+    async def delete_object(self, key: str):
+        await self._request("DELETE", key, ok=(200, 204, 404))
+    
+    async def list_keys(self, prefix: str):
+        token = None
+        while True:
+            params = {"list-type": "2", "prefix": self.prefix + prefix}
+            if token:
+                params["continuation-token"] = token
+            root = ET.fromstring((await self._request("GET", "", params=params)).content)
+            for key in root.findall("{*}Contents/{*}Key"):
+                yield key.text[len(self.prefix):]
+            token = root.findtext("{*}NextContinuationToken")
+            if not token:
+                return
+    
+    async def prepare_clients(self, client_ids: List[str]):
+        pass  # No folders in a bucket
+    
+    async def has_blob(self, sha256: str) -> bool:
+        response = await self._request("HEAD", self.blob_key(sha256), ok=(200, 404))
+        return response.status_code == 200
+    
+    # A blob found by store_document must not be deleted before the new files row
+    # points at it. Hosts coordinate through one blob_guards document per hash:
+    # store_document pins the blob ("enviando") until unpin_blob, after the row is
+    # written; release_blobs marks it "removendo_ate" only while nothing is pinned,
+    # and a pin waits until that mark is gone (or has expired with its host)
+    async def pin_blob(self, sha256: str):
+        for _ in range(BLOB_GUARD_RETRIES):
+            try:
+                await db.blob_guards.update_one(
+                    {"_id": sha256, "$or": [
+                        {"removendo_ate": None},
+                        {"removendo_ate": {"$lt": datetime.now(timezone.utc).isoformat()}},
+                    ]},
+                    {"$inc": {"enviando": 1}, "$unset": {"removendo_ate": ""}},
+                    upsert=True,
+                )
+                return
+            except DuplicateKeyError:
+                await asyncio.sleep(0.05)  # Being released right now
+        raise HTTPException(status_code=409, detail="Arquivo em uso, tente novamente")
+    
+    async def unpin_blob(self, sha256: str):
+        await db.blob_guards.update_one({"_id": sha256}, {"$inc": {"enviando": -1}})
+        await db.blob_guards.delete_one({"_id": sha256, "enviando": {"$lte": 0}, "removendo_ate": None})
+    
+    async def store_document(self, client_id: str, name: str, temp_path: Optional[Path], sha256: str, size: int):
+        """Make sure the blob exists; it stays pinned until unpin_blob"""
+        try:
+            await self.pin_blob(sha256)
+            try:
+                if not await self.has_blob(sha256):
+                    if temp_path is None:
+                        raise FileNotFoundError(sha256)
+                    await self.put_blob(temp_path, sha256, size)
+            except BaseException:
+                await self.unpin_blob(sha256)
+                raise
+        finally:
+            if temp_path is not None:
+                await fs.unlink(temp_path)
+    
+    async def delete_document(self, client_id: str, name: str):
+        pass  # Removing the files row drops the reference
+    
+    # Resumable uploads: each chunk is its own object under uploads/<session_id>/,
+    # so the chunks of one session may reach any backend host
+    @staticmethod
+    def upload_chunk_key(session: dict, index: int) -> str:
+        return f"uploads/{session['id']}/{index:06d}"
+    
+    async def open_upload(self, session: dict):
+        pass
+    
+    async def write_upload_chunk(self, session: dict, index: int, data: bytes):
+        await self._request(
+            "PUT", self.upload_chunk_key(session, index), headers={"Content-Length": str(len(data))},
+            content=data, payload_hash=hashlib.sha256(data).hexdigest()
+        )
+    
+    async def assemble_upload(self, session: dict) -> Path:
+        """Concatenate the chunks into a local staging file (at most MAX_FILE_SIZE)"""
+        path = BLOB_TMP_DIR / f".upload-{session['id']}-{uuid.uuid4().hex[:8]}.part"
+        try:
+            async with aiofiles.open(path, "wb") as out:
+                for index in range(session["total_chunks"]):
+                    response = await self._request("GET", self.upload_chunk_key(session, index))
+                    await out.write(response.content)
+        except BaseException:
+            await fs.unlink(path)
+            raise
+        return path
+    
+    async def drop_assembled_upload(self, path: Path):
+        await fs.unlink(path)
+    
+    async def discard_upload(self, session: dict):
+        await asyncio.gather(*[
+            self.delete_object(self.upload_chunk_key(session, index)) for index in range(session["total_chunks"])
+        ])
+    
+    async def release_blobs(self, hashes: List[str]):
+        for sha256 in set(hashes):
+            try:
+                await db.blob_guards.update_one(
+                    {"_id": sha256, "enviando": {"$not": {"$gt": 0}}},
+                    {"$set": {"removendo_ate": (datetime.now(timezone.utc) + BLOB_GUARD_LEASE).isoformat()}},
+                    upsert=True,
+                )
+            except DuplicateKeyError:
+                continue  # Pinned: a files row is about to reference it
+            try:
+                if not await db.files.find_one({"hash": sha256}, {"_id": 1}):
+                    await self.delete_object(self.blob_key(sha256))
+            finally:
+                await db.blob_guards.delete_one({"_id": sha256, "enviando": {"$not": {"$gt": 0}}})
+    
+    async def remove_client(self, client_id: str):
+        # Only staged uploads are on this host
+        await fs.remove_tree(UPLOAD_DIR / client_id)
+    
+    async def reset_client(self, client_id: str):
+        await fs.reset_dir(UPLOAD_DIR / client_id)
+    
+    async def reset_all(self):
+        async for key in self.list_keys(""):
+            await self.delete_object(key)
+        await fs.remove_subdirs(UPLOAD_DIR)
+        await fs.make_dirs(BLOB_TMP_DIR)
+    
+    async def scan_legacy_documents(self) -> List[dict]:
+        return []
+    
+    async def _proxy(self, request: Request, key: str, headers: dict) -> Response:
+        """Stream an object to the client, passing Range and conditional headers through"""
+        upstream_headers = {
+            name: request.headers[name] for name in ("range", "if-range", "if-none-match") if name in request.headers
+        }
+        response = await self._request("GET", key, headers=upstream_headers, stream=True, ok=(200, 206, 304, 404, 416))
+        if response.status_code in (304, 404, 416):
+            await response.aclose()
+            if response.status_code == 404:
+                raise HTTPException(status_code=404, detail="Arquivo não encontrado")
+            passthrough = {k: response.headers[k] for k in ("etag", "content-range") if k in response.headers}
+            return Response(status_code=response.status_code, headers={**passthrough, **headers})
+        for name in ("content-length", "content-range", "accept-ranges", "last-modified", "etag"):
+            if name in response.headers:
+                headers.setdefault(name, response.headers[name])
+        headers.setdefault("accept-ranges", "bytes")
+        return StreamingResponse(
+            response.aiter_raw(), status_code=response.status_code, headers=headers,
+            media_type=headers.pop("content-type", None) or response.headers.get("content-type"),
+            background=BackgroundTask(response.aclose),
+        )
+    
+    async def document_response(self, request: Request, client_id: str, filename: str) -> Response:
+        ref = await db.files.find_one({"client_id": client_id, "name": filename}, {"_id": 0, "hash": 1, "mime_type": 1})
+        if not ref:
+            raise HTTPException(status_code=404, detail="Arquivo não encontrado")
+        
+        etag = f'"{ref["hash"]}"'
+        headers = {"etag": etag, "cache-control": "private, no-cache"}
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+        
+        headers["content-disposition"] = content_disposition(filename)
+        headers["content-type"] = ref.get("mime_type") or "application/octet-stream"
+        return await self._proxy(request, self.blob_key(ref["hash"]), headers)
+    
+    async def open_document(self, client_id: str, doc: dict):
+        response = await self._request("GET", self.blob_key(doc["hash"]), stream=True, ok=(200, 404))
+        if response.status_code == 404:
+            await response.aclose()
+            return None
+        
+        async def chunks():
+            try:
+                async for chunk in response.aiter_raw(DOWNLOAD_CHUNK_SIZE):
+                    yield chunk
+            finally:
+                await response.aclose()
+        return chunks()
+    
+    async def save_logo(self, ext: str, contents: bytes):
+        await self._request(
+            "PUT", "config/logo",
+            headers={"Content-Type": mimetypes.guess_type(f"logo.{ext}")[0] or "application/octet-stream"},
+            content=contents, payload_hash=hashlib.sha256(contents).hexdigest()
+        )
+    
+    async def logo_response(self, request: Request, cache_control: str) -> Response:
+        try:
+            return await self._proxy(request, "config/logo", {"cache-control": cache_control})
+        except HTTPException:
+            raise HTTPException(status_code=404, detail="Logo não encontrado")
+
+def create_storage():
+    if STORAGE_BACKEND == "s3":
+        return S3Storage(
+            S3_ENDPOINT, S3_BUCKET, S3_ACCESS_KEY, S3_SECRET_KEY,
+            region=S3_REGION, prefix=S3_PREFIX, max_connections=S3_MAX_CONNECTIONS
+        )
+    return LocalStorage()
+
+storage = create_storage()
+
 # ==================== INIT DEFAULT DATA ====================
 
 async def init_default_data():
@@ -415,9 +1991,39 @@ async def init_default_data():
         ]
         await db.tipos_projeto.insert_many(default_tipos)
 
+async def ensure_indexes():
+    """Unique indexes that make single-round-trip creates safe, plus the join keys used by exports"""
+    index_specs = [
+        (db.clients, "cpf", {"unique": True}),
+        # Legacy users may have only "login"; ignore them in the uniqueness check
+        (db.users, "email", {"unique": True, "partialFilterExpression": {"email": {"$type": "string"}}}),
+        (db.clients, "id", {}),
+        (db.projects, "cliente_id", {}),
+        (db.propostas, "cliente_id", {}),
+        (db.files, [("client_id", 1), ("name", 1)], {"unique": True}),
+        (db.files, "hash", {}),
+        (db.files, [("name", 1), ("client_id", 1)], {}),
+        (db.upload_sessions, "id", {"unique": True}),
+        (db.clients, [("armazenamento_bytes", -1)], {}),
+        (db.upload_sessions, "updated_at", {}),
+    ]
+    for collection, field, options in index_specs:
+        try:
+            await collection.create_index(field, **options)
+        except OperationFailure as e:
+            # Existing duplicates prevent the unique index; creates still work, just without the guarantee
+            logger.warning(f"Could not create index on {collection.name}.{field}: {e}")
+
 @app.on_event("startup")
 async def startup_event():
+    await ensure_indexes()
     await init_default_data()
+    asyncio.create_task(backfill_files_index())
+    asyncio.create_task(purge_upload_sessions())
+    asyncio.create_task(refresh_municipios_periodically())
+    asyncio.create_task(monitor_event_loop_lag())
+    if SLOW_QUERY_MS > 0:
+        asyncio.create_task(record_slow_queries())
 
 # ==================== AUTH ROUTES ====================
 
@@ -480,11 +2086,6 @@ async def create_user(user_data: UserCreate, current_user = Depends(get_auth_use
     if current_user["role"] == UserRole.ADMIN and user_data.role in [UserRole.MASTER, UserRole.ADMIN]:
         raise HTTPException(status_code=403, detail="Admins não podem criar usuários Master ou Admin")
     
-    # Check if email exists
-    existing = await db.users.find_one({"email": user_data.email})
-    if existing:
-        raise HTTPException(status_code=400, detail="Email já cadastrado")
-    
     new_user = {
         "id": str(uuid.uuid4()),
         "nome": user_data.nome,
@@ -495,7 +2096,11 @@ async def create_user(user_data: UserCreate, current_user = Depends(get_auth_use
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     
-    await db.users.insert_one(new_user)
+    # Email uniqueness is enforced by the unique index on users.email
+    try:
+        await db.users.insert_one(new_user)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Email já cadastrado")
     
     return UserResponse(
         id=new_user["id"],
@@ -554,7 +2159,11 @@ async def update_user(user_id: str, user_data: dict, current_user = Depends(get_
         update_data["senha"] = hash_password(user_data["senha"])
     
     if update_data:
-        await db.users.update_one({"id": user_id}, {"$set": update_data})
+        # Email uniqueness is enforced by the unique index on users.email
+        try:
+            await db.users.update_one({"id": user_id}, {"$set": update_data})
+        except DuplicateKeyError:
+            raise HTTPException(status_code=400, detail="Email já cadastrado")
     
     return {"message": "Usuário atualizado com sucesso"}
 
@@ -598,6 +2207,8 @@ async def create_partner(partner_data: PartnerCreate, current_user = Depends(get
     
     await db.partners.insert_one(new_partner)
     
+    invalidate_lookup_table("partners")
+    
     return PartnerResponse(**new_partner)
 
 @api_router.get("/partners", response_model=List[PartnerResponse])
@@ -622,6 +2233,8 @@ async def update_partner(partner_id: str, partner_data: dict, current_user = Dep
     if update_data:
         await db.partners.update_one({"id": partner_id}, {"$set": update_data})
     
+    invalidate_lookup_table("partners")
+    
     return {"message": "Parceiro atualizado com sucesso"}
 
 @api_router.delete("/partners/{partner_id}")
@@ -632,6 +2245,8 @@ async def delete_partner(partner_id: str, current_user = Depends(get_auth_user))
         raise HTTPException(status_code=403, detail="Permissão negada")
     
     await db.partners.delete_one({"id": partner_id})
+    invalidate_lookup_table("partners")
+    
     return {"message": "Parceiro excluído com sucesso"}
 
 # ==================== CLIENT ROUTES ====================
@@ -640,16 +2255,11 @@ async def delete_partner(partner_id: str, current_user = Depends(get_auth_user))
 async def create_client(client_data: ClientCreate, current_user = Depends(get_auth_user)):
     pass  # user auth verified
     
-    # Validate CPF format (basic)
-    cpf_clean = re.sub(r'\D', '', client_data.cpf)
-    if len(cpf_clean) != 11:
+    # Validate CPF (length and check digits)
+    cpf_clean = clean_cpf(client_data.cpf)
+    if not cpf_clean:
         raise HTTPException(status_code=400, detail="CPF inválido")
     
-    # Check if CPF exists
-    existing = await db.clients.find_one({"cpf": cpf_clean})
-    if existing:
-        raise HTTPException(status_code=400, detail="CPF já cadastrado")
-    
     parceiro_nome = None
     if client_data.parceiro_id:
         parceiro = await db.partners.find_one({"id": client_data.parceiro_id}, {"_id": 0})
@@ -672,14 +2282,162 @@ async def create_client(client_data: ClientCreate, current_user = Depends(get_au
         "qtd_alertas": 0
     }
     
-    await db.clients.insert_one(new_client)
+    # CPF uniqueness is enforced by the unique index on clients.cpf
+    try:
+        await db.clients.insert_one(new_client)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="CPF já cadastrado")
     
     # Create client folder for documents
-    client_folder = UPLOAD_DIR / new_client["id"]
-    client_folder.mkdir(exist_ok=True)
+    await storage.prepare_clients([new_client["id"]])
     
     return ClientResponse(**new_client)
 
+CLIENT_IMPORT_BATCH_SIZE = 500
+CLIENT_IMPORT_MAX_MB = float(os.environ.get("CLIENT_IMPORT_MAX_MB", "100"))
+
+def open_csv_reader(binary_file) -> csv.DictReader:
+    """DictReader over a binary file object, reading it line by line instead of all at once"""
+    sample = binary_file.read(4096)
+    binary_file.seek(0)
+    try:
+        sample.decode("utf-8-sig")
+        encoding = "utf-8-sig"
+    except UnicodeDecodeError as e:
+        # A multi-byte char cut at the end of the sample is still UTF-8
+        encoding = "utf-8-sig" if e.start >= len(sample) - 3 else "latin-1"
+    text = io.TextIOWrapper(binary_file, encoding=encoding, errors="replace", newline="")
+    try:
+        dialect = csv.Sniffer().sniff(sample.decode(encoding, errors="ignore"), delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.DictReader(text, dialect=dialect)
+    reader.fieldnames = [(f or "").strip().lower() for f in (reader.fieldnames or [])]
+    return reader
+
+def read_csv_batch(reader: csv.DictReader, size: int) -> List[tuple]:
+    """Next `size` rows as (line number, row); blocking, run it in the thread pool"""
+    batch = []
+    for row in itertools.islice(reader, size):
+        batch.append((reader.line_num, {k: (v or "").strip() for k, v in row.items() if k}))
+    return batch
+
+@api_router.post("/clients/import")
+async def import_clients(request: Request, current_user = Depends(get_auth_user)):
+    """
+    Importação em massa de clientes a partir de um CSV (campo "file").
+    Colunas: nome_completo, cpf, telefone e opcionalmente endereco, data_nascimento,
+    estado, cidade, parceiro (id ou nome). O arquivo é lido em lotes de
+    CLIENT_IMPORT_BATCH_SIZE linhas e o progresso é devolvido como NDJSON, uma linha por lote.
+    """
+    if not request.headers.get("content-type", "").startswith("multipart/form-data"):
+        raise HTTPException(status_code=400, detail="Envie o arquivo CSV no campo 'file'")
+    
+    # Streamed to a temp file with the size checked as it arrives (not File(...)), so
+    # a huge upload cannot fill the disk and the file stays open while the response streams
+    try:
+        _, temp_path, _, _, _ = await stream_upload_to_temp(
+            request, BLOB_TMP_DIR, int(CLIENT_IMPORT_MAX_MB * 1024 * 1024)
+        )
+    except UploadTooLarge:
+        raise HTTPException(status_code=400, detail=f"Arquivo excede o limite de {CLIENT_IMPORT_MAX_MB:g}MB")
+    csv_file = await run_in_threadpool(open, temp_path, "rb")
+    
+    async def descartar_arquivo():
+        await run_in_threadpool(csv_file.close)
+        await fs.unlink(temp_path)
+    
+    try:
+        reader = await run_in_threadpool(open_csv_reader, csv_file)
+        colunas = set(reader.fieldnames)
+        if "cpf" not in colunas or "telefone" not in colunas or not colunas & {"nome_completo", "nome"}:
+            raise HTTPException(status_code=400, detail="O CSV precisa das colunas nome_completo, cpf e telefone")
+        parceiros = await get_lookup_table("partners")
+    except BaseException:
+        await descartar_arquivo()
+        raise
+    
+    async def progresso():
+        vistos = set()
+        totais = {"linhas_processadas": 0, "importados": 0, "duplicados": 0, "invalidos": 0}
+        try:
+            while True:
+                batch = await run_in_threadpool(read_csv_batch, reader, CLIENT_IMPORT_BATCH_SIZE)
+                if not batch:
+                    break
+                
+                now = datetime.now(timezone.utc).isoformat()
+                erros = []
+                novos = []
+                for linha, row in batch:
+                    nome = row.get("nome_completo") or row.get("nome")
+                    cpf_clean = clean_cpf(row.get("cpf"))
+                    if not nome or not row.get("telefone"):
+                        erros.append({"linha": linha, "erro": "Informe nome e telefone"})
+                    elif not cpf_clean:
+                        erros.append({"linha": linha, "erro": "CPF inválido"})
+                    elif cpf_clean in vistos:
+                        erros.append({"linha": linha, "erro": "CPF repetido no arquivo"})
+                    else:
+                        vistos.add(cpf_clean)
+                        parceiro = parceiros.get(row.get("parceiro") or "") or parceiros.get(normalize_nome(row.get("parceiro") or ""))
+                        novos.append((linha, {
+                            "id": str(uuid.uuid4()),
+                            "nome_completo": nome.upper(),
+                            "cpf": cpf_clean,
+                            "endereco": row.get("endereco", ""),
+                            "telefone": row["telefone"],
+                            "data_nascimento": row.get("data_nascimento", ""),
+                            "parceiro_id": parceiro["id"] if parceiro else None,
+                            "parceiro_nome": parceiro["nome"] if parceiro else None,
+                            "estado": (row.get("estado") or "").upper() or None,
+                            "cidade": row.get("cidade") or None,
+                            "created_at": now,
+                            "ultimo_alerta": None,
+                            "qtd_alertas": 0
+                        }))
+                totais["invalidos"] += len(erros)
+                
+                # One $in per batch to skip CPFs that are already registered
+                if novos:
+                    existentes = await db.clients.find(
+                        {"cpf": {"$in": [doc["cpf"] for _, doc in novos]}}, {"_id": 0, "cpf": 1}
+                    ).to_list(len(novos))
+                    cpfs_existentes = {c["cpf"] for c in existentes}
+                    duplicados = [(linha, doc) for linha, doc in novos if doc["cpf"] in cpfs_existentes]
+                    novos = [(linha, doc) for linha, doc in novos if doc["cpf"] not in cpfs_existentes]
+                    erros.extend({"linha": linha, "erro": "CPF já cadastrado"} for linha, _ in duplicados)
+                    totais["duplicados"] += len(duplicados)
+                
+                inseridos = []
+                if novos:
+                    falhas = set()
+                    try:
+                        await db.clients.insert_many([doc for _, doc in novos], ordered=False)
+                    except BulkWriteError as e:
+                        # Duplicates here were created concurrently after the $in check
+                        for err in e.details.get("writeErrors", []):
+                            falhas.add(err["index"])
+                            linha = novos[err["index"]][0]
+                            if err.get("code") == 11000:
+                                totais["duplicados"] += 1
+                                erros.append({"linha": linha, "erro": "CPF já cadastrado"})
+                            else:
+                                totais["invalidos"] += 1
+                                erros.append({"linha": linha, "erro": err.get("errmsg", "Erro ao gravar")})
+                    inseridos = [doc["id"] for i, (_, doc) in enumerate(novos) if i not in falhas]
+                    await storage.prepare_clients(inseridos)
+                
+                totais["linhas_processadas"] += len(batch)
+                totais["importados"] += len(inseridos)
+                yield json.dumps({"tipo": "progresso", **totais, "erros": sorted(erros, key=lambda e: e["linha"])}) + "\n"
+            
+            yield json.dumps({"tipo": "resumo", **totais}) + "\n"
+        finally:
+            await descartar_arquivo()
+    
+    return StreamingResponse(progresso(), media_type="application/x-ndjson")
+
 @api_router.get("/clients", response_model=List[ClientResponse])
 async def list_clients(
     search: Optional[str] = None,
@@ -687,12 +2445,7 @@ async def list_clients(
 ):
     pass  # user auth verified
     
-    query = {}
-    if search:
-        query["$or"] = [
-            {"nome_completo": {"$regex": search, "$options": "i"}},
-            {"cpf": {"$regex": search}}
-        ]
+    query = build_clients_query(search)
     
     clients = await db.clients.find(query, {"_id": 0}).to_list(1000)
     
@@ -704,11 +2457,9 @@ async def list_clients(
             "status": "em_andamento"
         })
         c["tem_projeto_ativo"] = active_project is not None
-        c["ultimo_alerta"] = c.get("ultimo_alerta")
-        c["qtd_alertas"] = c.get("qtd_alertas", 0)
-        result.append(ClientResponse(**c))
+        result.append(c)
     
-    return result
+    return trusted_list_response(ClientResponse, result)
 
 @api_router.get("/clients/{client_id}", response_model=ClientResponse)
 async def get_client(client_id: str, current_user = Depends(get_auth_user)):
@@ -764,10 +2515,10 @@ async def delete_client(client_id: str, current_user = Depends(get_auth_user)):
     if project:
         raise HTTPException(status_code=400, detail="Cliente possui projeto em andamento")
     
-    # Delete client folder
-    client_folder = UPLOAD_DIR / client_id
-    if client_folder.exists():
-        shutil.rmtree(client_folder)
+    # Delete client folder, then the blobs only this client used
+    hashes = await forget_client_documents(client_id)
+    await storage.remove_client(client_id)
+    await storage.release_blobs(hashes)
     
     await db.clients.delete_one({"id": client_id})
     return {"message": "Cliente excluído com sucesso"}
@@ -831,37 +2582,35 @@ async def delete_etapa(etapa_id: str, current_user = Depends(get_auth_user)):
 async def create_project(project_data: ProjetoCreate, current_user = Depends(get_auth_user)):
     pass  # user auth verified
     
+    # Independent lookups run concurrently; nothing is written until all are validated
+    client, existing_project, first_etapa, instituicao, tipo = await asyncio.gather(
+        db.clients.find_one({"id": project_data.cliente_id}, {"_id": 0}),
+        db.projects.find_one({
+            "cliente_id": project_data.cliente_id,
+            "status": "em_andamento"
+        }, {"_id": 1}),
+        db.etapas.find_one({"ativo": True}, {"_id": 0}, sort=[("ordem", 1)]),
+        find_one_by_id(db.instituicoes_financeiras, project_data.instituicao_financeira_id),
+        find_one_by_id(db.tipos_projeto, project_data.tipo_projeto_id),
+    )
+    
     # Check if client exists
-    client = await db.clients.find_one({"id": project_data.cliente_id}, {"_id": 0})
     if not client:
         raise HTTPException(status_code=404, detail="Cliente não encontrado")
     
     # Check if client already has active project
-    existing_project = await db.projects.find_one({
-        "cliente_id": project_data.cliente_id,
-        "status": "em_andamento"
-    })
     if existing_project:
         raise HTTPException(status_code=400, detail="Cliente já possui projeto em andamento")
     
     # Get first stage
-    first_etapa = await db.etapas.find_one({"ativo": True}, {"_id": 0}, sort=[("ordem", 1)])
     if not first_etapa:
         raise HTTPException(status_code=400, detail="Nenhuma etapa configurada")
     
     # Get instituicao financeira name if provided
-    instituicao_nome = None
-    if project_data.instituicao_financeira_id:
-        instituicao = await db.instituicoes_financeiras.find_one({"id": project_data.instituicao_financeira_id}, {"_id": 0})
-        if instituicao:
-            instituicao_nome = instituicao["nome"]
+    instituicao_nome = instituicao["nome"] if instituicao else None
     
     # Get tipo projeto name if ID provided
-    tipo_projeto_nome = project_data.tipo_projeto
-    if project_data.tipo_projeto_id:
-        tipo = await db.tipos_projeto.find_one({"id": project_data.tipo_projeto_id}, {"_id": 0})
-        if tipo:
-            tipo_projeto_nome = tipo["nome"]
+    tipo_projeto_nome = tipo["nome"] if tipo else project_data.tipo_projeto
     
     now = datetime.now(timezone.utc).isoformat()
     
@@ -929,17 +2678,7 @@ async def list_projects(
 ):
     pass  # user auth verified
     
-    query = {}
-    if status:
-        query["status"] = status
-    
-    if mes and ano:
-        start_date = datetime(ano, mes, 1, tzinfo=timezone.utc).isoformat()
-        if mes == 12:
-            end_date = datetime(ano + 1, 1, 1, tzinfo=timezone.utc).isoformat()
-        else:
-            end_date = datetime(ano, mes + 1, 1, tzinfo=timezone.utc).isoformat()
-        query["data_inicio"] = {"$gte": start_date, "$lt": end_date}
+    query = build_projects_query(status, mes, ano)
     
     projects = await db.projects.find(query, {"_id": 0}).to_list(1000)
     
@@ -953,54 +2692,22 @@ async def list_projects(
         if nome and nome.lower() not in client["nome_completo"].lower():
             continue
         
-        # Check for pending issues
-        tem_pendencia = False
-        for etapa in proj.get("historico_etapas", []):
-            for pend in etapa.get("pendencias", []):
-                if not pend.get("resolvida", False):
-                    tem_pendencia = True
-                    break
-        
-        # Check documents and stage requirements
-        docs = proj.get("documentos_check", {})
-        etapa_nome = proj.get("etapa_atual_nome", "")
-        
-        # Check stage-specific requirements
-        if "Coleta de Documentos" in etapa_nome:
-            if not all([docs.get("rg_cnh"), docs.get("conta_banco_brasil"), docs.get("ccu_titulo"), docs.get("saldo_iagro"), docs.get("car")]):
-                tem_pendencia = True
-        elif "Desenvolvimento do Projeto" in etapa_nome:
-            if not docs.get("projeto_implementado"):
-                tem_pendencia = True
-        elif "Coletar Assinaturas" in etapa_nome:
-            if not docs.get("projeto_assinado"):
-                tem_pendencia = True
-        elif "Protocolo CENOP" in etapa_nome:
-            if not docs.get("projeto_protocolado"):
-                tem_pendencia = True
-        elif "Instrumento de Crédito" in etapa_nome:
-            if not all([docs.get("assinatura_agencia"), docs.get("upload_contrato")]):
-                tem_pendencia = True
-        elif "GTA e Nota Fiscal" in etapa_nome:
-            if not all([docs.get("gta_emitido"), docs.get("nota_fiscal_emitida")]):
-                tem_pendencia = True
-        elif "Projeto Creditado" in etapa_nome:
-            if not docs.get("comprovante_servico_pago"):
-                tem_pendencia = True
+        # Check for pending issues and stage requirements
+        tem_pendencia = projeto_tem_pendencia(proj)
         
         # Apply pendencia filter
         if pendencia is not None and tem_pendencia != pendencia:
             continue
         
-        result.append(ProjetoResponse(
+        result.append({
             **proj,
-            cliente_nome=client["nome_completo"],
-            cliente_cpf=client["cpf"],
-            cliente_telefone=client.get("telefone"),
-            tem_pendencia=tem_pendencia
-        ))
+            "cliente_nome": client["nome_completo"],
+            "cliente_cpf": client["cpf"],
+            "cliente_telefone": client.get("telefone"),
+            "tem_pendencia": tem_pendencia,
+        })
     
-    return result
+    return trusted_list_response(ProjetoResponse, result)
 
 @api_router.get("/projects/{project_id}", response_model=ProjetoResponse)
 async def get_project(project_id: str, current_user = Depends(get_auth_user)):
@@ -1014,38 +2721,7 @@ async def get_project(project_id: str, current_user = Depends(get_auth_user)):
     if not client:
         raise HTTPException(status_code=404, detail="Cliente não encontrado")
     
-    tem_pendencia = False
-    for etapa in project.get("historico_etapas", []):
-        for pend in etapa.get("pendencias", []):
-            if not pend.get("resolvida", False):
-                tem_pendencia = True
-                break
-    
-    # Check stage-specific requirements
-    docs = project.get("documentos_check", {})
-    etapa_nome = project.get("etapa_atual_nome", "")
-    
-    if "Coleta de Documentos" in etapa_nome:
-        if not all([docs.get("rg_cnh"), docs.get("conta_banco_brasil"), docs.get("ccu_titulo"), docs.get("saldo_iagro"), docs.get("car")]):
-            tem_pendencia = True
-    elif "Desenvolvimento do Projeto" in etapa_nome:
-        if not docs.get("projeto_implementado"):
-            tem_pendencia = True
-    elif "Coletar Assinaturas" in etapa_nome:
-        if not docs.get("projeto_assinado"):
-            tem_pendencia = True
-    elif "Protocolo CENOP" in etapa_nome:
-        if not docs.get("projeto_protocolado"):
-            tem_pendencia = True
-    elif "Instrumento de Crédito" in etapa_nome:
-        if not all([docs.get("assinatura_agencia"), docs.get("upload_contrato")]):
-            tem_pendencia = True
-    elif "GTA e Nota Fiscal" in etapa_nome:
-        if not all([docs.get("gta_emitido"), docs.get("nota_fiscal_emitida")]):
-            tem_pendencia = True
-    elif "Projeto Creditado" in etapa_nome:
-        if not docs.get("comprovante_servico_pago"):
-            tem_pendencia = True
+    tem_pendencia = projeto_tem_pendencia(project)
     
     return ProjetoResponse(
         **project,
@@ -1216,11 +2892,10 @@ async def cancel_project(project_id: str, data: dict, current_user = Depends(get
     if not motivo:
         raise HTTPException(status_code=400, detail="Motivo da desistência é obrigatório")
     
-    # Delete client documents
-    client_folder = UPLOAD_DIR / project["cliente_id"]
-    if client_folder.exists():
-        shutil.rmtree(client_folder)
-        client_folder.mkdir(exist_ok=True)
+    # Delete client documents; shared blobs stay while other clients link to them
+    hashes = await forget_client_documents(project["cliente_id"])
+    await storage.reset_client(project["cliente_id"])
+    await storage.release_blobs(hashes)
     
     await db.projects.update_one(
         {"id": project_id},
@@ -1341,103 +3016,1041 @@ async def update_documents_check(project_id: str, data: dict, current_user = Dep
         "comprovante_servico_pago"  # Projeto Creditado
     ]
     
-    for field in check_fields:
-        if field in data:
-            docs_check[field] = data[field]
+    for field in check_fields:
+        if field in data:
+            docs_check[field] = data[field]
+    
+    update_data = {"documentos_check": docs_check}
+    
+    # Campos extras do projeto
+    if "numero_contrato" in data:
+        update_data["numero_contrato"] = data["numero_contrato"]
+    if "valor_servico" in data:
+        update_data["valor_servico"] = float(data["valor_servico"]) if data["valor_servico"] else None
+    
+    await db.projects.update_one(
+        {"id": project_id},
+        {"$set": update_data}
+    )
+    
+    return {"message": "Dados atualizados"}
+
+# ==================== FILE UPLOAD ROUTES ====================
+
+class UploadTooLarge(Exception):
+    pass
+
+# Documents can be tagged with the checklist item (documentos_check field) they satisfy
+DOCUMENTO_CATEGORIAS = set(DocumentoCheck.model_fields)
+
+def validate_categoria(categoria: Optional[str]) -> Optional[str]:
+    if categoria and categoria not in DOCUMENTO_CATEGORIAS:
+        raise HTTPException(status_code=400, detail="Categoria de documento inválida")
+    return categoria or None
+
+def normalize_upload_name(original_name: str) -> str:
+    """Client documents are stored with upper-case names; directory parts are dropped"""
+    original_name = os.path.basename(original_name.replace("\\", "/"))
+    if original_name.strip() in ("", ".", ".."):
+        raise HTTPException(status_code=400, detail="Nome de arquivo inválido")
+    name_parts = original_name.rsplit('.', 1)
+    if len(name_parts) == 2:
+        return f"{name_parts[0].upper()}.{name_parts[1].upper()}"
+    return original_name.upper()
+
+async def stream_upload_to_temp(request: Request, folder: Path, max_size: int, field_name: str = "file", discard: bool = False):
+    """
+    Stream the `field_name` part of a multipart request into a temp file inside
+    `folder`, chunk by chunk as it arrives, computing its SHA-256 on the way.
+    Nothing is buffered beyond the chunk being written, and the upload is aborted
+    (temp file removed, UploadTooLarge raised) as soon as the running size passes
+    `max_size`. With `discard` the data is only hashed and no file is written.
+    Returns (original filename, temp path or None, size, sha256, part content type);
+    the caller moves the temp file.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(status_code=400, detail="Envie o arquivo como multipart/form-data")
+    
+    # Reject before reading the body when the client announces the size
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_size + MULTIPART_OVERHEAD:
+        raise UploadTooLarge()
+    
+    state = {"header_field": b"", "header_value": b"", "headers": {}, "in_file": False, "filename": None, "content_type": ""}
+    pending = []
+    
+    def on_part_begin():
+        state["headers"] = {}
+        state["in_file"] = False
+    
+    def on_header_field(data, start, end):
+        state["header_field"] += data[start:end]
+    
+    def on_header_value(data, start, end):
+        state["header_value"] += data[start:end]
+    
+    def on_header_end():
+        state["headers"][state["header_field"].lower()] = state["header_value"]
+        state["header_field"] = b""
+        state["header_value"] = b""
+    
+    def on_headers_finished():
+        _, disposition = parse_options_header(state["headers"].get(b"content-disposition", b""))
+        if disposition.get(b"name", b"").decode() == field_name and b"filename" in disposition:
+            state["in_file"] = True
+            state["filename"] = disposition[b"filename"].decode("utf-8", errors="replace")
+            state["content_type"] = state["headers"].get(b"content-type", b"").decode("latin-1").strip()
+    
+    def on_part_data(data, start, end):
+        if state["in_file"]:
+            pending.append(data[start:end])
+    
+    def on_part_end():
+        state["in_file"] = False
+    
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+    
+    temp_path = None if discard else folder / f".upload-{uuid.uuid4().hex}.part"
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with contextlib.AsyncExitStack() as stack:
+            out = await stack.enter_async_context(aiofiles.open(temp_path, "wb")) if temp_path else None
+            async for chunk in request.stream():
+                parser.write(chunk)
+                for data in pending:
+                    size += len(data)
+                    if size > max_size:
+                        raise UploadTooLarge()
+                    digest.update(data)
+                    if out:
+                        await out.write(data)
+                pending.clear()
+        parser.finalize()
+        if not state["filename"]:
+            raise HTTPException(status_code=400, detail="Nenhum arquivo enviado")
+    except BaseException:
+        if temp_path:
+            with contextlib.suppress(FileNotFoundError):
+                await aiofiles.os.remove(temp_path)
+        raise
+    
+    return state["filename"], temp_path, size, digest.hexdigest(), state["content_type"]
+
+def guess_mime_type(name: str, declared: str = "") -> str:
+    """Trust the browser's part Content-Type unless it is the generic one"""
+    if declared and declared != "application/octet-stream":
+        return declared
+    return mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+def file_entry(doc: dict) -> dict:
+    """Shape returned by GET /files/{client_id}; "modified" kept for the frontend"""
+    return {
+        "name": doc["name"],
+        "size": doc["size"],
+        "modified": doc.get("updated_at"),
+        "hash": doc.get("hash"),
+        "mime_type": doc.get("mime_type"),
+        "uploaded_by_nome": doc.get("uploaded_by_nome"),
+        "categoria": doc.get("categoria"),
+        "created_at": doc.get("created_at"),
+    }
+
+async def store_client_document(
+    client_id: str, name: str, temp_path: Optional[Path], sha256: str, size: int,
+    mime_type: str, uploaded_by: dict, categoria: Optional[str] = None
+):
+    """
+    Link an uploaded file into the client folder through the blob store and record
+    its metadata in `files`. A same-named document that is replaced releases its old blob
+    (and keeps its categoria unless a new one is given). The client's storage usage is
+    reserved first, so a document that does not fit the quota is never written, and
+    corrected once the upsert shows which document was really replaced.
+    """
+    existing = await db.files.find_one({"client_id": client_id, "name": name}, {"_id": 0, "size": 1})
+    delta_bytes = size - (existing["size"] if existing else 0)
+    delta_files = 0 if existing else 1
+    try:
+        await reserve_storage(client_id, delta_bytes, delta_files)
+    except HTTPException:
+        if temp_path is not None:
+            await fs.unlink(temp_path)
+        raise
+    try:
+        await storage.store_document(client_id, name, temp_path, sha256, size)
+    except BaseException:
+        await account_storage(client_id, -delta_bytes, -delta_files)
+        raise
+    try:
+        previous = await index_client_document(client_id, name, sha256, size, mime_type, uploaded_by, categoria)
+    finally:
+        await storage.unpin_blob(sha256)
+    # A concurrent upload of the same name may have been counted as new too:
+    # the document this upsert replaced is the one that really gets freed
+    actual_bytes = size - (previous.get("size", 0) if previous else 0)
+    actual_files = 0 if previous else 1
+    if (actual_bytes, actual_files) != (delta_bytes, delta_files):
+        await account_storage(client_id, actual_bytes - delta_bytes, actual_files - delta_files)
+    if previous and previous.get("hash") != sha256:
+        await storage.release_blobs([previous["hash"]])
+
+async def index_client_document(
+    client_id: str, name: str, sha256: str, size: int,
+    mime_type: str, uploaded_by: dict, categoria: Optional[str]
+) -> Optional[dict]:
+    """Upsert the files row of a stored document; returns the row it replaced"""
+    now = datetime.now(timezone.utc).isoformat()
+    fields = {
+        "hash": sha256,
+        "size": size,
+        "mime_type": mime_type,
+        "uploaded_by_id": uploaded_by["id"],
+        "uploaded_by_nome": uploaded_by["nome"],
+        "updated_at": now,
+    }
+    if categoria:
+        fields["categoria"] = categoria
+    return await db.files.find_one_and_update(
+        {"client_id": client_id, "name": name},
+        {
+            "$set": fields,
+            "$setOnInsert": {"id": str(uuid.uuid4()), "created_at": now},
+        },
+        upsert=True,
+        return_document=ReturnDocument.BEFORE,
+    )
+
+def _scan_legacy_files(root: Path) -> List[dict]:
+    """Files in client folders, hashed; used once to index uploads made before the `files` collection"""
+    found = []
+    for folder in root.iterdir():
+        if not folder.is_dir() or folder.name.startswith(".") or folder.name == "config":
+            continue
+        for entry in os.scandir(folder):
+            if entry.is_file() and not entry.name.startswith("."):
+                st = entry.stat()
+                modified = datetime.fromtimestamp(st.st_mtime, timezone.utc).isoformat()
+                found.append({
+                    "client_id": folder.name,
+                    "name": entry.name,
+                    "hash": _hash_file(Path(entry.path)),
+                    "size": st.st_size,
+                    "mime_type": guess_mime_type(entry.name),
+                    "uploaded_by_id": None,
+                    "uploaded_by_nome": None,
+                    "created_at": modified,
+                    "updated_at": modified,
+                })
+    return found
+
+async def backfill_files_index():
+    """One-time import of documents uploaded before the metadata index existed"""
+    try:
+        if await db.migrations.find_one({"_id": "files_index"}):
+            return
+        legacy = await storage.scan_legacy_documents()
+        for doc in legacy:
+            try:
+                await db.files.update_one(
+                    {"client_id": doc["client_id"], "name": doc["name"]},
+                    {"$setOnInsert": {"id": str(uuid.uuid4()), **doc}},
+                    upsert=True,
+                )
+            except DuplicateKeyError:
+                pass  # another worker indexed it first
+        await db.migrations.update_one(
+            {"_id": "files_index"},
+            {"$set": {"done_at": datetime.now(timezone.utc).isoformat(), "files": len(legacy)}},
+            upsert=True,
+        )
+        await recompute_storage_usage()
+        logger.info(f"Indexed {len(legacy)} existing documents into the files collection")
+    except Exception as e:
+        logger.error(f"Files index backfill failed: {e}")
+
+async def forget_client_documents(client_id: str) -> List[str]:
+    """Drop the document references of a client; returns the hashes to release once its folder is gone"""
+    refs = await db.files.find({"client_id": client_id}, {"_id": 0, "hash": 1, "size": 1}).to_list(None)
+    await db.files.delete_many({"client_id": client_id})
+    # Unfinished uploads: local ones live in the folder too, S3 chunks are removed here
+    sessions = await db.upload_sessions.find({"client_id": client_id}, {"_id": 0}).to_list(None)
+    await db.upload_sessions.delete_many({"client_id": client_id})
+    for session in sessions:
+        with contextlib.suppress(Exception):
+            await storage.discard_upload(session)
+    if refs:
+        await account_storage(client_id, -sum(r.get("size", 0) for r in refs), -len(refs))
+    return [r["hash"] for r in refs if r.get("hash")]
+
+# ==================== STORAGE USAGE ====================
+#
+# Logical bytes and file counts per client (clients.armazenamento_bytes /
+# armazenamento_arquivos) and in total (counters {_id: "armazenamento"}), kept
+# up to date with $inc on every upload and delete. Identical content is stored
+# once, so the disk or bucket holds at most the total. recompute_storage_usage()
+# rebuilds everything from the files index if the counters ever drift.
+
+CLIENT_STORAGE_QUOTA_BYTES = int(float(os.environ.get("CLIENT_STORAGE_QUOTA_MB", "0")) * 1024 * 1024)  # 0: sem limite
+
+def client_quota(client: dict) -> int:
+    return client.get("cota_armazenamento_bytes") or CLIENT_STORAGE_QUOTA_BYTES
+
+def check_storage_quota(client: dict, extra_bytes: int):
+    """Early rejection, before any byte is received; reserve_storage() is the exact check"""
+    quota = client_quota(client)
+    if quota and client.get("armazenamento_bytes", 0) + extra_bytes > quota:
+        raise HTTPException(status_code=413, detail="Cota de armazenamento do cliente excedida")
+
+async def account_storage(client_id: str, delta_bytes: int, delta_files: int):
+    inc = {"armazenamento_bytes": delta_bytes, "armazenamento_arquivos": delta_files}
+    await asyncio.gather(
+        db.clients.update_one({"id": client_id}, {"$inc": inc}),
+        db.counters.update_one({"_id": "armazenamento"}, {"$inc": {"bytes": delta_bytes, "arquivos": delta_files}}, upsert=True),
+    )
+
+async def reserve_storage(client_id: str, delta_bytes: int, delta_files: int):
+    """Add to the client's usage in one update that only matches while the result fits its quota"""
+    client = await db.clients.find_one({"id": client_id}, {"_id": 0, "cota_armazenamento_bytes": 1})
+    if client is None:
+        raise HTTPException(status_code=404, detail="Cliente não encontrado")
+    query = {"id": client_id}
+    quota = client_quota(client)
+    if quota and delta_bytes > 0:
+        query["$expr"] = {"$lte": [{"$add": [{"$ifNull": ["$armazenamento_bytes", 0]}, delta_bytes]}, quota]}
+    result = await db.clients.update_one(
+        query, {"$inc": {"armazenamento_bytes": delta_bytes, "armazenamento_arquivos": delta_files}}
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=413, detail="Cota de armazenamento do cliente excedida")
+    await db.counters.update_one(
+        {"_id": "armazenamento"}, {"$inc": {"bytes": delta_bytes, "arquivos": delta_files}}, upsert=True
+    )
+
+async def recompute_storage_usage() -> dict:
+    """Rebuild every counter from the files index (one aggregation, no directory walk)"""
+    usage = await db.files.aggregate([
+        {"$group": {"_id": "$client_id", "bytes": {"$sum": "$size"}, "arquivos": {"$sum": 1}}}
+    ]).to_list(None)
+    await db.clients.update_many({}, {"$set": {"armazenamento_bytes": 0, "armazenamento_arquivos": 0}})
+    if usage:
+        await db.clients.bulk_write([
+            UpdateOne({"id": u["_id"]}, {"$set": {"armazenamento_bytes": u["bytes"], "armazenamento_arquivos": u["arquivos"]}})
+            for u in usage
+        ], ordered=False)
+    total = {"bytes": sum(u["bytes"] for u in usage), "arquivos": sum(u["arquivos"] for u in usage)}
+    await db.counters.update_one({"_id": "armazenamento"}, {"$set": total}, upsert=True)
+    return total
+
+@api_router.put("/clients/{client_id}/cota")
+async def set_client_quota(client_id: str, data: dict, current_user = Depends(get_auth_user)):
+    """Cota de armazenamento do cliente em MB; null volta ao padrão (CLIENT_STORAGE_QUOTA_MB)"""
+    if current_user["role"] == UserRole.ANALISTA:
+        raise HTTPException(status_code=403, detail="Permissão negada")
+    
+    cota_mb = data.get("cota_mb")
+    if cota_mb is not None and (not isinstance(cota_mb, (int, float)) or cota_mb <= 0):
+        raise HTTPException(status_code=400, detail="Cota inválida")
+    update = (
+        {"$set": {"cota_armazenamento_bytes": int(cota_mb * 1024 * 1024)}} if cota_mb is not None
+        else {"$unset": {"cota_armazenamento_bytes": ""}}
+    )
+    result = await db.clients.update_one({"id": client_id}, update)
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Cliente não encontrado")
+    return {"message": "Cota atualizada"}
+
+@api_router.get("/master/storage")
+async def get_storage_usage(limit: int = Query(20, le=200), current_user = Depends(get_auth_user)):
+    """
+    MASTER ONLY: Total document storage and the clients using the most.
+    """
+    if current_user["role"] != UserRole.MASTER:
+        raise HTTPException(status_code=403, detail="Apenas usuário Master pode acessar")
+    
+    total, top = await asyncio.gather(
+        db.counters.find_one({"_id": "armazenamento"}, {"_id": 0}),
+        db.clients.find(
+            {"armazenamento_bytes": {"$gt": 0}},
+            {"_id": 0, "id": 1, "nome_completo": 1, "cpf": 1, "armazenamento_bytes": 1,
+             "armazenamento_arquivos": 1, "cota_armazenamento_bytes": 1}
+        ).sort("armazenamento_bytes", -1).limit(limit).to_list(limit),
+    )
+    return {
+        "total": total or {"bytes": 0, "arquivos": 0},
+        "cota_padrao_bytes": CLIENT_STORAGE_QUOTA_BYTES or None,
+        "maiores_clientes": top,
+    }
+
+@api_router.post("/master/storage/recalculate")
+async def recalculate_storage_usage(current_user = Depends(get_auth_user)):
+    """
+    MASTER ONLY: Rebuild the usage counters from the files index.
+    """
+    if current_user["role"] != UserRole.MASTER:
+        raise HTTPException(status_code=403, detail="Apenas usuário Master pode executar esta ação")
+    return {"total": await recompute_storage_usage()}
+
+# ==================== CONDITIONAL / RANGE DOWNLOADS ====================
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+def parse_byte_range(header: Optional[str], size: int) -> Optional[tuple]:
+    """
+    Parse a single `bytes=` range into an inclusive (start, end) pair. Returns
+    None when the header is absent or not something we serve partially (other
+    units, multiple ranges), in which case the full file is sent.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_s, sep, end_s = header[6:].strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if start_s:
+            start = int(start_s)
+            end = int(end_s) if end_s else size - 1
+        else:
+            # Suffix range: the last N bytes
+            suffix = int(end_s)
+            if suffix == 0:
+                raise RangeNotSatisfiable()
+            start, end = max(size - suffix, 0), size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    if start > end:
+        return None
+    return start, min(end, size - 1)
+
+def etag_matches(header: str, etag: str) -> bool:
+    """If-None-Match comparison (weak comparison, as RFC 9110 asks for GET)"""
+    if header.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+def not_modified(request: Request, etag: str, st: os.stat_result) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        return int(st.st_mtime) <= since.timestamp()
+    return False
+
+async def iter_file_range(path: Path, start: int, length: int):
+    async with aiofiles.open(path, "rb") as f:
+        await f.seek(start)
+        while length > 0:
+            chunk = await f.read(min(DOWNLOAD_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+def content_disposition(filename: str) -> str:
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+def file_response(
+    request: Request, path: Path, st: os.stat_result, etag: Optional[str] = None,
+    filename: Optional[str] = None, media_type: Optional[str] = None,
+    cache_control: str = "private, no-cache"
+):
+    """
+    FileResponse with conditional GET (If-None-Match / If-Modified-Since -> 304)
+    and single-range requests (Range / If-Range -> 206), so a PDF that is
+    reopened is revalidated instead of downloaded again and an interrupted
+    download can resume where it stopped. `etag` should be the content hash when
+    one is known; otherwise it is derived from mtime and size.
+    """
+    if etag is None:
+        etag = f'"{int(st.st_mtime_ns):x}-{st.st_size:x}"'
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(st.st_mtime, usegmt=True),
+        "Cache-Control": cache_control,
+        "Accept-Ranges": "bytes",
+    }
+    
+    if not_modified(request, etag, st):
+        return Response(status_code=304, headers=headers)
+    
+    if filename is not None:
+        headers["Content-Disposition"] = content_disposition(filename)
+    media_type = media_type or mimetypes.guess_type(filename or path.name)[0] or "application/octet-stream"
+    
+    if_range = request.headers.get("if-range")
+    range_header = request.headers.get("range")
+    if range_header and (if_range is None or if_range.strip() == etag):
+        try:
+            byte_range = parse_byte_range(range_header, st.st_size)
+        except RangeNotSatisfiable:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{st.st_size}"})
+        if byte_range:
+            start, end = byte_range
+            length = end - start + 1
+            headers["Content-Range"] = f"bytes {start}-{end}/{st.st_size}"
+            headers["Content-Length"] = str(length)
+            return StreamingResponse(
+                iter_file_range(path, start, length), status_code=206,
+                headers=headers, media_type=media_type
+            )
+    
+    return FileResponse(path, stat_result=st, headers=headers, media_type=media_type)
+
+UPLOAD_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "properties": {"file": {"type": "string", "format": "binary"}},
+            "required": ["file"],
+        }}},
+    }
+}
+
+@api_router.post("/upload/{client_id}", openapi_extra=UPLOAD_OPENAPI)
+async def upload_file(
+    client_id: str,
+    request: Request,
+    categoria: Optional[str] = None,
+    current_user = Depends(get_auth_user)
+):
+    pass  # user auth verified
+    categoria = validate_categoria(categoria)
+    
+    # Check client exists
+    client = await db.clients.find_one({"id": client_id})
+    if not client:
+        raise HTTPException(status_code=404, detail="Cliente não encontrado")
+    
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit():
+        check_storage_quota(client, int(content_length) - MULTIPART_OVERHEAD)
+    
+    # A client that sends the hash of a document we already store only needs it verified, not written
+    expected_hash = request.headers.get("x-content-sha256", "").lower()
+    if expected_hash and not re.fullmatch(r"[0-9a-f]{64}", expected_hash):
+        raise HTTPException(status_code=400, detail="X-Content-SHA256 inválido")
+    known_blob = bool(expected_hash) and await storage.has_blob(expected_hash)
+    
+    # Stream to a temp file, hashing and checking the size as it arrives
+    try:
+        original_name, temp_path, size, sha256, content_type = await stream_upload_to_temp(
+            request, BLOB_TMP_DIR, MAX_FILE_SIZE, discard=known_blob
+        )
+    except UploadTooLarge:
+        raise HTTPException(status_code=400, detail="Arquivo excede o limite de 10MB")
+    
+    if expected_hash and sha256 != expected_hash:
+        if temp_path:
+            await fs.unlink(temp_path)
+        raise HTTPException(status_code=400, detail="O conteúdo não confere com X-Content-SHA256")
+    
+    # Rename file to uppercase; identical content is stored once and hardlinked
+    try:
+        new_name = normalize_upload_name(original_name)
+    except HTTPException:
+        if temp_path:
+            await fs.unlink(temp_path)
+        raise
+    try:
+        await store_client_document(
+            client_id, new_name, temp_path, sha256, size, guess_mime_type(new_name, content_type), current_user,
+            categoria
+        )
+    except FileNotFoundError:
+        # The known blob was garbage-collected while the body was being verified
+        raise HTTPException(status_code=409, detail="Reenvie o arquivo")
+    
+    return {"message": "Arquivo enviado com sucesso", "filename": new_name, "sha256": sha256}
+
+@api_router.get("/files/{client_id}")
+async def list_files(client_id: str, current_user = Depends(get_auth_user)):
+    pass  # user auth verified
+    
+    # Served from the metadata index; the client folder is not touched
+    docs = await db.files.find({"client_id": client_id}, {"_id": 0}).sort("name", 1).to_list(None)
+    
+    return {"files": [file_entry(d) for d in docs]}
+
+# Scans, PDFs, photos and office files are already compressed; storing them
+# costs no CPU and lets the bundle be streamed as fast as the disk reads it
+class _ZipSink(io.RawIOBase):
+    """Write-only, unseekable target for ZipFile; the response generator drains it"""
+    def __init__(self):
+        self._chunks = []
+    
+    def writable(self):
+        return True
+    
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+    
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def zip_date_time(iso_timestamp: Optional[str]) -> tuple:
+    try:
+        moment = datetime.fromisoformat(iso_timestamp)
+    except (TypeError, ValueError):
+        moment = datetime.now(timezone.utc)
+    return max(moment.timetuple()[:6], (1980, 1, 1, 0, 0, 0))
+
+async def iter_zip_bundle(client_id: str, docs: List[dict]):
+    """
+    Build the ZIP while it is being sent: each file is read in DOWNLOAD_CHUNK_SIZE
+    pieces and every piece is yielded as soon as zipfile has framed it, so memory
+    stays at one chunk whatever the size of the dossier. The unseekable sink makes
+    zipfile write sizes in data descriptors instead of seeking back.
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED) as zf:
+        for doc in docs:
+            chunks = await storage.open_document(client_id, doc)
+            if chunks is None:
+                continue  # Removed after the listing was read
+            info = zipfile.ZipInfo(doc["name"], date_time=zip_date_time(doc.get("updated_at")))
+            async with contextlib.aclosing(chunks):
+                with zf.open(info, "w", force_zip64=doc["size"] > zipfile.ZIP64_LIMIT) as entry:
+                    async for chunk in chunks:
+                        entry.write(chunk)
+                        yield sink.drain()
+            yield sink.drain()
+    # Central directory, written on close
+    yield sink.drain()
+
+@api_router.get("/files/{client_id}/bundle.zip")
+async def download_bundle(
+    client_id: str,
+    categoria: Optional[str] = Query(None, description="Categorias do checklist separadas por vírgula"),
+    current_user = Depends(get_auth_user)
+):
+    """Todos os documentos do cliente (ou só os das categorias pedidas) em um único ZIP"""
+    client = await db.clients.find_one({"id": client_id}, {"_id": 0, "nome_completo": 1})
+    if not client:
+        raise HTTPException(status_code=404, detail="Cliente não encontrado")
+    
+    query = {"client_id": client_id}
+    if categoria:
+        categorias = [validate_categoria(c.strip()) for c in categoria.split(",") if c.strip()]
+        query["categoria"] = {"$in": categorias}
+    docs = await db.files.find(query, {"_id": 0, "name": 1, "size": 1, "hash": 1, "updated_at": 1}).sort("name", 1).to_list(None)
+    if not docs:
+        raise HTTPException(status_code=404, detail="Nenhum documento encontrado")
+    
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", unicodedata.normalize("NFKD", client["nome_completo"]).encode("ascii", "ignore").decode()).strip("_")
+    return StreamingResponse(
+        iter_zip_bundle(client_id, docs),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{slug or "cliente"}_documentos.zip"'},
+    )
+
+@api_router.put("/files/{client_id}/{filename}/categoria")
+async def set_file_categoria(client_id: str, filename: str, data: dict, current_user = Depends(get_auth_user)):
+    pass  # user auth verified
     
-    update_data = {"documentos_check": docs_check}
+    categoria = validate_categoria(data.get("categoria"))
+    update = {"$set": {"categoria": categoria}} if categoria else {"$unset": {"categoria": ""}}
+    result = await db.files.update_one({"client_id": client_id, "name": filename}, update)
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Arquivo não encontrado")
+    return {"message": "Categoria atualizada", "categoria": categoria}
+
+def sign_file_link(client_id: str, filename: str, expires: int) -> str:
+    message = f"{client_id}/{filename}:{expires}".encode()
+    return hmac.new(SIGNED_URL_SECRET, message, hashlib.sha256).hexdigest()
+
+@api_router.get("/files/{client_id}/{filename}/link")
+async def get_file_link(client_id: str, filename: str, current_user = Depends(get_auth_user)):
+    """Link temporário (SIGNED_URL_TTL segundos) que abre o documento sem o token, ex. em <a href> ou <iframe>"""
+    if not await db.files.find_one({"client_id": client_id, "name": filename}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Arquivo não encontrado")
     
-    # Campos extras do projeto
-    if "numero_contrato" in data:
-        update_data["numero_contrato"] = data["numero_contrato"]
-    if "valor_servico" in data:
-        update_data["valor_servico"] = float(data["valor_servico"]) if data["valor_servico"] else None
+    expires = int(time.time()) + SIGNED_URL_TTL
+    signature = sign_file_link(client_id, filename, expires)
+    return {
+        "url": f"/api/download/{client_id}/{quote(filename)}?expires={expires}&sig={signature}",
+        "expires_at": datetime.fromtimestamp(expires, timezone.utc).isoformat(),
+    }
+
+@api_router.get("/download/{client_id}/{filename}")
+async def download_signed_file(client_id: str, filename: str, expires: int, sig: str, request: Request):
+    # The signature is the authorization: no token, no user lookup
+    if expires < time.time() or not hmac.compare_digest(sig, sign_file_link(client_id, filename, expires)):
+        raise HTTPException(status_code=403, detail="Link inválido ou expirado")
+    return await storage.document_response(request, client_id, filename)
+
+@api_router.get("/files/{client_id}/{filename}")
+async def download_file(client_id: str, filename: str, request: Request, current_user = Depends(get_auth_user)):
+    pass  # user auth verified
+    return await storage.document_response(request, client_id, filename)
+
+@api_router.delete("/files/{client_id}/{filename}")
+async def delete_file(client_id: str, filename: str, current_user = Depends(get_auth_user)):
+    pass  # user auth verified
     
-    await db.projects.update_one(
-        {"id": project_id},
-        {"$set": update_data}
-    )
+    ref = await db.files.find_one_and_delete({"client_id": client_id, "name": filename})
+    await storage.delete_document(client_id, filename)
+    if ref:
+        await account_storage(client_id, -ref.get("size", 0), -1)
+        await storage.release_blobs([ref["hash"]])
     
-    return {"message": "Dados atualizados"}
+    return {"message": "Arquivo excluído"}
 
-# ==================== FILE UPLOAD ROUTES ====================
+@api_router.get("/documents")
+async def search_documents(
+    nome: Optional[str] = None,
+    mime_type: Optional[str] = None,
+    hash: Optional[str] = None,
+    client_id: Optional[str] = None,
+    limit: int = Query(200, le=1000),
+    current_user = Depends(get_auth_user)
+):
+    """Busca documentos em todos os clientes pelo índice de arquivos (sem acessar o disco)"""
+    query = {}
+    if nome:
+        query["name"] = {"$regex": re.escape(nome.upper())}
+    if mime_type:
+        query["mime_type"] = mime_type
+    if hash:
+        query["hash"] = hash.lower()
+    if client_id:
+        query["client_id"] = client_id
+    
+    pipeline = [
+        {"$match": query},
+        {"$sort": {"updated_at": -1}},
+        {"$limit": limit},
+        {"$lookup": {
+            "from": "clients",
+            "localField": "client_id",
+            "foreignField": "id",
+            "pipeline": [{"$project": {"_id": 0, "nome_completo": 1}}],
+            "as": "cliente"
+        }},
+    ]
+    docs = await db.files.aggregate(pipeline).to_list(limit)
+    return {"documents": [
+        {
+            **file_entry(d),
+            "client_id": d["client_id"],
+            "cliente_nome": d["cliente"][0]["nome_completo"] if d["cliente"] else None,
+        }
+        for d in docs
+    ]}
 
-@api_router.post("/upload/{client_id}")
-async def upload_file(
-    client_id: str,
-    file: UploadFile = File(...),
+@api_router.get("/documents/missing")
+async def projects_missing_document(
+    nome: str,
+    status: Optional[str] = "em_andamento",
     current_user = Depends(get_auth_user)
 ):
+    """
+    Projetos cujo cliente não tem nenhum documento com `nome` no nome do arquivo,
+    ex.: /documents/missing?nome=CONTRATO
+    """
+    query = {"status": status} if status else {}
+    pipeline = [
+        {"$match": query},
+        {"$lookup": {
+            "from": "files",
+            "localField": "cliente_id",
+            "foreignField": "client_id",
+            "pipeline": [{"$match": {"name": {"$regex": re.escape(nome.upper())}}}, {"$limit": 1}, {"$project": {"_id": 1}}],
+            "as": "documentos"
+        }},
+        {"$match": {"documentos": {"$size": 0}}},
+    ] + cliente_lookup_stages() + [
+        {"$project": {"id": 1, "cliente_id": 1, "cliente": 1, "etapa_atual_nome": 1, "status": 1, "data_inicio": 1}},
+    ]
+    projects = await db.projects.aggregate(pipeline).to_list(None)
+    return {
+        "projetos": [
+            {
+                "id": p["id"],
+                "cliente_id": p["cliente_id"],
+                "cliente_nome": p["cliente"]["nome_completo"],
+                "cliente_cpf": p["cliente"]["cpf"],
+                "etapa_atual_nome": p.get("etapa_atual_nome"),
+                "status": p.get("status"),
+                "data_inicio": p.get("data_inicio"),
+            }
+            for p in projects
+        ],
+        "total": len(projects)
+    }
+
+# ==================== RESUMABLE UPLOADS ====================
+#
+# For documents sent over unreliable links: the client opens a session with the
+# file size, PUTs fixed-size chunks (in any order, in parallel if it wants) with
+# their offset, asks which chunks are still missing after a dropped connection,
+# and finalizes. Chunks are staged by the storage driver: with local storage in a
+# preallocated file under the client's folder (UPLOAD_DIR/<client_id>/.partial/
+# <session_id>), with S3 as one object per chunk, so the chunks of a session can
+# reach different backend hosts. A chunk write holds a lease in the session's
+# `escritas` list, and finalizing only starts when no lease is live, so the data
+# never changes while it is hashed or stored; the lease of a writer that died
+# expires after UPLOAD_WRITE_LEASE. Sessions idle for UPLOAD_SESSION_TTL_HOURS
+# are removed by purge_upload_sessions().
+
+UPLOAD_SESSION_TTL = timedelta(hours=float(os.environ.get("UPLOAD_SESSION_TTL_HOURS", "24")))
+UPLOAD_SESSION_PURGE_INTERVAL = 3600
+UPLOAD_WRITE_LEASE = timedelta(minutes=5)
+UPLOAD_CHUNK_MIN = 64 * 1024
+UPLOAD_CHUNK_MAX = 8 * 1024 * 1024
+
+def upload_session_path(session: dict) -> Path:
+    return UPLOAD_DIR / session["client_id"] / ".partial" / session["id"]
+
+def upload_session_status(session: dict) -> dict:
+    received = set(session.get("received", []))
+    missing = [i for i in range(session["total_chunks"]) if i not in received]
+    return {
+        "id": session["id"],
+        "client_id": session["client_id"],
+        "filename": session["filename"],
+        "size": session["size"],
+        "chunk_size": session["chunk_size"],
+        "total_chunks": session["total_chunks"],
+        "received_chunks": len(received),
+        "missing_chunks": missing,
+        # First byte not yet received, for clients that upload sequentially
+        "offset": min(missing[0] * session["chunk_size"], session["size"]) if missing else session["size"],
+        "status": session["status"],
+        "expires_at": (datetime.fromisoformat(session["updated_at"]) + UPLOAD_SESSION_TTL).isoformat(),
+    }
+
+async def get_open_upload_session(session_id: str) -> dict:
+    session = await db.upload_sessions.find_one({"id": session_id}, {"_id": 0})
+    if not session:
+        raise HTTPException(status_code=404, detail="Sessão de upload não encontrada ou expirada")
+    if session["status"] != "aberta":
+        raise HTTPException(status_code=409, detail="Sessão de upload já está sendo finalizada")
+    return session
+
+async def purge_upload_sessions():
+    """Remove sessions (and their partial files) that were abandoned"""
+    while True:
+        try:
+            cutoff = (datetime.now(timezone.utc) - UPLOAD_SESSION_TTL).isoformat()
+            async for session in db.upload_sessions.find({"updated_at": {"$lt": cutoff}}, {"_id": 0}):
+                await storage.discard_upload(session)
+                await db.upload_sessions.delete_one({"id": session["id"]})
+        except Exception:
+            logger.exception("Failed to purge upload sessions")
+        await asyncio.sleep(UPLOAD_SESSION_PURGE_INTERVAL)
+
+@api_router.post("/upload/{client_id}/sessions")
+async def create_upload_session(client_id: str, data: UploadSessionCreate, current_user = Depends(get_auth_user)):
     pass  # user auth verified
     
-    # Check client exists
-    client = await db.clients.find_one({"id": client_id})
+    client = await db.clients.find_one(
+        {"id": client_id}, {"_id": 0, "id": 1, "armazenamento_bytes": 1, "cota_armazenamento_bytes": 1}
+    )
     if not client:
         raise HTTPException(status_code=404, detail="Cliente não encontrado")
-    
-    # Check file size
-    contents = await file.read()
-    if len(contents) > MAX_FILE_SIZE:
+    if data.size <= 0:
+        raise HTTPException(status_code=400, detail="Tamanho do arquivo inválido")
+    if data.size > MAX_FILE_SIZE:
         raise HTTPException(status_code=400, detail="Arquivo excede o limite de 10MB")
+    if not UPLOAD_CHUNK_MIN <= data.chunk_size <= UPLOAD_CHUNK_MAX:
+        raise HTTPException(status_code=400, detail="chunk_size deve estar entre 64KB e 8MB")
+    check_storage_quota(client, data.size)
+    expected_hash = (data.sha256 or "").lower() or None
+    if expected_hash and not re.fullmatch(r"[0-9a-f]{64}", expected_hash):
+        raise HTTPException(status_code=400, detail="sha256 inválido")
     
-    # Create client folder
-    client_folder = UPLOAD_DIR / client_id
-    client_folder.mkdir(exist_ok=True)
-    
-    # Rename file to uppercase
-    original_name = file.filename
-    name_parts = original_name.rsplit('.', 1)
-    if len(name_parts) == 2:
-        new_name = f"{name_parts[0].upper()}.{name_parts[1].upper()}"
-    else:
-        new_name = original_name.upper()
-    
-    file_path = client_folder / new_name
-    
-    with open(file_path, "wb") as f:
-        f.write(contents)
+    now = datetime.now(timezone.utc).isoformat()
+    filename = normalize_upload_name(data.filename)
+    session = {
+        "id": str(uuid.uuid4()),
+        "client_id": client_id,
+        "filename": filename,
+        "size": data.size,
+        "sha256": expected_hash,
+        "mime_type": guess_mime_type(filename, data.mime_type),
+        "categoria": validate_categoria(data.categoria),
+        "chunk_size": data.chunk_size,
+        "total_chunks": -(-data.size // data.chunk_size),
+        "received": [],
+        "status": "aberta",
+        "escritas": [],
+        "created_by_id": current_user["id"],
+        "created_at": now,
+        "updated_at": now,
+    }
+    await storage.open_upload(session)
+    await db.upload_sessions.insert_one(session)
     
-    return {"message": "Arquivo enviado com sucesso", "filename": new_name}
+    return upload_session_status(session)
 
-@api_router.get("/files/{client_id}")
-async def list_files(client_id: str, current_user = Depends(get_auth_user)):
+@api_router.get("/upload-sessions/{session_id}")
+async def get_upload_session(session_id: str, current_user = Depends(get_auth_user)):
     pass  # user auth verified
     
-    client_folder = UPLOAD_DIR / client_id
-    if not client_folder.exists():
-        return {"files": []}
-    
-    files = []
-    for f in client_folder.iterdir():
-        if f.is_file():
-            stat = f.stat()
-            files.append({
-                "name": f.name,
-                "size": stat.st_size,
-                "modified": datetime.fromtimestamp(stat.st_mtime, timezone.utc).isoformat()
-            })
-    
-    return {"files": files}
+    session = await db.upload_sessions.find_one({"id": session_id}, {"_id": 0})
+    if not session:
+        raise HTTPException(status_code=404, detail="Sessão de upload não encontrada ou expirada")
+    return upload_session_status(session)
 
-@api_router.get("/files/{client_id}/{filename}")
-async def download_file(client_id: str, filename: str, current_user = Depends(get_auth_user)):
+@api_router.put("/upload-sessions/{session_id}")
+async def upload_session_chunk(
+    session_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0),
+    current_user = Depends(get_auth_user)
+):
+    """Corpo da requisição: bytes do trecho que começa em `offset` (múltiplo de chunk_size)"""
+    session = await get_open_upload_session(session_id)
+    chunk_size, size = session["chunk_size"], session["size"]
+    if offset % chunk_size or offset >= size:
+        raise HTTPException(status_code=400, detail="offset inválido para esta sessão")
+    index = offset // chunk_size
+    expected_length = min(chunk_size, size - offset)
+    
+    # A chunk is at most 8MB, so it is collected in memory and written with one call
+    data = bytearray()
+    async for piece in request.stream():
+        data += piece
+        if len(data) > expected_length:
+            raise HTTPException(status_code=400, detail=f"O trecho deve ter {expected_length} bytes")
+    if len(data) != expected_length:
+        raise HTTPException(status_code=400, detail=f"O trecho deve ter {expected_length} bytes")
+    
+    chunk_hash = request.headers.get("x-chunk-sha256", "").lower()
+    if chunk_hash and hashlib.sha256(data).hexdigest() != chunk_hash:
+        raise HTTPException(status_code=400, detail="O trecho não confere com X-Chunk-SHA256")
+    
+    # Conditional on the session still being open: complete may have claimed it
+    # while the body was arriving, and then the data must not change anymore
+    lease = {"id": uuid.uuid4().hex, "ate": (datetime.now(timezone.utc) + UPLOAD_WRITE_LEASE).isoformat()}
+    writing = await db.upload_sessions.find_one_and_update(
+        {"id": session_id, "status": "aberta"}, {"$push": {"escritas": lease}}, projection={"_id": 1}
+    )
+    if not writing:
+        await get_open_upload_session(session_id)
+        raise HTTPException(status_code=409, detail="Sessão de upload já está sendo finalizada")
+    try:
+        await storage.write_upload_chunk(session, index, bytes(data))
+    except BaseException as e:
+        await db.upload_sessions.update_one({"id": session_id}, {"$pull": {"escritas": {"id": lease["id"]}}})
+        if isinstance(e, FileNotFoundError):
+            await db.upload_sessions.delete_one({"id": session_id})
+            raise HTTPException(status_code=404, detail="Sessão de upload não encontrada ou expirada")
+        raise
+    
+    session = await db.upload_sessions.find_one_and_update(
+        {"id": session_id},
+        {
+            "$pull": {"escritas": {"id": lease["id"]}},
+            "$addToSet": {"received": index},
+            "$set": {"updated_at": datetime.now(timezone.utc).isoformat()},
+        },
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER,
+    )
+    if not session:
+        raise HTTPException(status_code=404, detail="Sessão de upload não encontrada ou expirada")
+    return upload_session_status(session)
+
+@api_router.post("/upload-sessions/{session_id}/complete")
+async def complete_upload_session(session_id: str, current_user = Depends(get_auth_user)):
     pass  # user auth verified
     
-    file_path = UPLOAD_DIR / client_id / filename
-    if not file_path.exists():
-        raise HTTPException(status_code=404, detail="Arquivo não encontrado")
+    session = await get_open_upload_session(session_id)
+    if len(session["received"]) < session["total_chunks"]:
+        missing = session["total_chunks"] - len(session["received"])
+        raise HTTPException(status_code=409, detail=f"Upload incompleto: faltam {missing} trechos")
+    
+    # Only one finalize per session, even if the client retries concurrently, and
+    # only once no chunk write holds a live lease (expired ones are dropped)
+    claimed = await db.upload_sessions.find_one_and_update(
+        {
+            "id": session_id,
+            "status": "aberta",
+            "escritas": {"$not": {"$elemMatch": {"ate": {"$gt": datetime.now(timezone.utc).isoformat()}}}},
+        },
+        {"$set": {"status": "finalizando", "escritas": []}},
+    )
+    if not claimed:
+        await get_open_upload_session(session_id)
+        raise HTTPException(status_code=409, detail="Ainda há trechos sendo gravados; tente novamente")
+    
+    finished = False
+    data_path = None
+    try:
+        data_path = await storage.assemble_upload(session)
+        sha256 = await fs.hash_file(data_path)
+        if session["sha256"] and sha256 != session["sha256"]:
+            # Some chunk was corrupted on the way; the client has to send them again
+            await storage.drop_assembled_upload(data_path)
+            data_path = None
+            await db.upload_sessions.update_one(
+                {"id": session_id},
+                {"$set": {"status": "aberta", "received": [], "updated_at": datetime.now(timezone.utc).isoformat()}},
+            )
+            raise HTTPException(status_code=400, detail="O conteúdo não confere com o sha256 informado")
+        
+        try:
+            await store_client_document(
+                session["client_id"], session["filename"], data_path, sha256, session["size"],
+                session["mime_type"], current_user, session.get("categoria")
+            )
+        except HTTPException:
+            # Over quota: the staged data is discarded with the session
+            data_path = None
+            await db.upload_sessions.delete_one({"id": session_id})
+            await storage.discard_upload(session)
+            raise
+        # store_client_document moved the data into the document store
+        data_path = None
+        await db.upload_sessions.delete_one({"id": session_id})
+        await storage.discard_upload(session)
+        finished = True
+    finally:
+        if not finished:
+            # Unexpected failure: reopen the session instead of leaving it stuck until the TTL
+            if data_path is not None:
+                await storage.drop_assembled_upload(data_path)
+            await db.upload_sessions.update_one(
+                {"id": session_id, "status": "finalizando"}, {"$set": {"status": "aberta"}}
+            )
     
-    return FileResponse(file_path, filename=filename)
+    return {"message": "Arquivo enviado com sucesso", "filename": session["filename"], "sha256": sha256}
 
-@api_router.delete("/files/{client_id}/{filename}")
-async def delete_file(client_id: str, filename: str, current_user = Depends(get_auth_user)):
+@api_router.delete("/upload-sessions/{session_id}")
+async def cancel_upload_session(session_id: str, current_user = Depends(get_auth_user)):
     pass  # user auth verified
     
-    file_path = UPLOAD_DIR / client_id / filename
-    if file_path.exists():
-        file_path.unlink()
-    
-    return {"message": "Arquivo excluído"}
+    session = await db.upload_sessions.find_one_and_delete({"id": session_id, "status": "aberta"}, {"_id": 0})
+    if not session:
+        raise HTTPException(status_code=404, detail="Sessão de upload não encontrada ou expirada")
+    await storage.discard_upload(session)
+    return {"message": "Upload cancelado"}
 
 # ==================== CONFIG ROUTES ====================
 
@@ -1457,36 +4070,23 @@ async def upload_logo(
     if current_user["role"] == UserRole.ANALISTA:
         raise HTTPException(status_code=403, detail="Permissão negada")
     
-    # Save logo
-    logo_folder = UPLOAD_DIR / "config"
-    logo_folder.mkdir(exist_ok=True)
-    
-    # Remove old logo
-    for old_file in logo_folder.glob("logo.*"):
-        old_file.unlink()
-    
+    # Save logo, replacing the old one (any extension)
     ext = file.filename.rsplit('.', 1)[-1].lower()
-    logo_path = logo_folder / f"logo.{ext}"
-    
     contents = await file.read()
-    with open(logo_path, "wb") as f:
-        f.write(contents)
+    await storage.save_logo(ext, contents)
     
-    relative_path = f"/api/config/logo-image"
+    # Versioned URL so the image can be cached for a long time by browsers
+    relative_path = f"/api/config/logo-image?v={hashlib.sha256(contents).hexdigest()[:12]}"
     
     await db.config.update_one({}, {"$set": {"logo_path": relative_path}}, upsert=True)
     
     return {"message": "Logo atualizado", "path": relative_path}
 
 @api_router.get("/config/logo-image")
-async def get_logo_image():
-    logo_folder = UPLOAD_DIR / "config"
-    for ext in ["png", "jpg", "jpeg", "svg", "webp"]:
-        logo_path = logo_folder / f"logo.{ext}"
-        if logo_path.exists():
-            return FileResponse(logo_path)
-    
-    raise HTTPException(status_code=404, detail="Logo não encontrado")
+async def get_logo_image(request: Request, v: Optional[str] = None):
+    # ?v= comes from config.logo_path and changes whenever the logo does
+    cache_control = "public, max-age=31536000, immutable" if v else "public, no-cache"
+    return await storage.logo_response(request, cache_control)
 
 @api_router.put("/config/campos-extras")
 async def update_campos_extras(data: dict, current_user = Depends(get_auth_user)):
@@ -1801,6 +4401,7 @@ async def create_instituicao_financeira(data: InstituicaoFinanceiraCreate, curre
         "ativo": data.ativo
     }
     await db.instituicoes_financeiras.insert_one(new_instituicao)
+    invalidate_lookup_table("instituicoes_financeiras")
     return InstituicaoFinanceiraResponse(**new_instituicao)
 
 @api_router.put("/instituicoes-financeiras/{instituicao_id}")
@@ -1811,6 +4412,7 @@ async def update_instituicao_financeira(instituicao_id: str, data: dict, current
     update_data = {k: v for k, v in data.items() if k in ["nome", "ativo"]}
     if update_data:
         await db.instituicoes_financeiras.update_one({"id": instituicao_id}, {"$set": update_data})
+    invalidate_lookup_table("instituicoes_financeiras")
     return {"message": "Instituição atualizada"}
 
 @api_router.delete("/instituicoes-financeiras/{instituicao_id}")
@@ -1819,6 +4421,7 @@ async def delete_instituicao_financeira(instituicao_id: str, current_user = Depe
         raise HTTPException(status_code=403, detail="Permissão negada")
     
     await db.instituicoes_financeiras.update_one({"id": instituicao_id}, {"$set": {"ativo": False}})
+    invalidate_lookup_table("instituicoes_financeiras")
     return {"message": "Instituição desativada"}
 
 # ==================== TIPO PROJETO ROUTES ====================
@@ -1846,6 +4449,7 @@ async def create_tipo_projeto(data: TipoProjetoCreate, current_user = Depends(ge
         "ativo": data.ativo
     }
     await db.tipos_projeto.insert_one(new_tipo)
+    invalidate_lookup_table("tipos_projeto")
     return TipoProjetoResponse(**new_tipo)
 
 @api_router.put("/tipos-projeto/{tipo_id}")
@@ -1856,6 +4460,7 @@ async def update_tipo_projeto(tipo_id: str, data: dict, current_user = Depends(g
     update_data = {k: v for k, v in data.items() if k in ["nome", "ativo"]}
     if update_data:
         await db.tipos_projeto.update_one({"id": tipo_id}, {"$set": update_data})
+    invalidate_lookup_table("tipos_projeto")
     return {"message": "Tipo de projeto atualizado"}
 
 @api_router.delete("/tipos-projeto/{tipo_id}")
@@ -1864,6 +4469,7 @@ async def delete_tipo_projeto(tipo_id: str, current_user = Depends(get_auth_user
         raise HTTPException(status_code=403, detail="Permissão negada")
     
     await db.tipos_projeto.update_one({"id": tipo_id}, {"$set": {"ativo": False}})
+    invalidate_lookup_table("tipos_projeto")
     return {"message": "Tipo de projeto desativado"}
 
 # ==================== REQUISITOS ETAPA ROUTES ====================
@@ -1915,76 +4521,50 @@ async def delete_requisito_etapa(requisito_id: str, current_user = Depends(get_a
 async def create_proposta(data: PropostaCreate, current_user = Depends(get_auth_user)):
     now = datetime.now(timezone.utc).isoformat()
     
-    # Determinar o cliente (existente ou novo)
-    if data.client_id:
-        # Usar cliente existente
-        existing_client = await db.clients.find_one({"id": data.client_id}, {"_id": 0})
-        if not existing_client:
-            raise HTTPException(status_code=404, detail="Cliente não encontrado")
-        client_id = data.client_id
-        client_nome = existing_client["nome_completo"]
-        client_cpf = existing_client["cpf"]
-        client_telefone = existing_client.get("telefone", "")
-    else:
-        # Criar novo cliente ou atualizar existente pelo CPF
+    # Validar os dados do novo cliente antes de qualquer consulta
+    if not data.client_id:
         if not data.nome_completo or not data.cpf or not data.telefone:
             raise HTTPException(status_code=400, detail="Para criar um novo cliente, informe nome, CPF e telefone")
         
         # Validate CPF
-        cpf_clean = re.sub(r'\D', '', data.cpf)
-        if len(cpf_clean) != 11:
+        cpf_clean = clean_cpf(data.cpf)
+        if not cpf_clean:
             raise HTTPException(status_code=400, detail="CPF inválido")
-        
-        # Check if client already exists
-        existing_client = await db.clients.find_one({"cpf": cpf_clean}, {"_id": 0})
-        
-        if existing_client:
-            client_id = existing_client["id"]
-            # Update client info if needed
-            await db.clients.update_one(
-                {"id": client_id},
-                {"$set": {
-                    "nome_completo": data.nome_completo.upper(),
-                    "telefone": data.telefone
-                }}
-            )
-        else:
-            # Create new client
-            client_id = str(uuid.uuid4())
-            new_client = {
-                "id": client_id,
-                "nome_completo": data.nome_completo.upper(),
-                "cpf": cpf_clean,
-                "telefone": data.telefone,
-                "endereco": "",
-                "data_nascimento": "",
-                "parceiro_id": None,
-                "parceiro_nome": None,
-                "estado": None,
-                "cidade": None,
-                "created_at": now,
-                "ultimo_alerta": None,
-                "qtd_alertas": 0
-            }
-            await db.clients.insert_one(new_client)
-            
-            # Create client folder
-            client_folder = UPLOAD_DIR / client_id
-            client_folder.mkdir(exist_ok=True)
-        
-        client_nome = data.nome_completo.upper()
-        client_cpf = cpf_clean
-        client_telefone = data.telefone
     
-    # Get tipo projeto and instituicao names
-    tipo_projeto = await db.tipos_projeto.find_one({"id": data.tipo_projeto_id}, {"_id": 0})
-    instituicao = await db.instituicoes_financeiras.find_one({"id": data.instituicao_financeira_id}, {"_id": 0})
+    # Cliente, tipo de projeto e instituição são independentes: buscar em paralelo
+    existing_client, tipo_projeto, instituicao = await asyncio.gather(
+        find_one_by_id(db.clients, data.client_id),
+        db.tipos_projeto.find_one({"id": data.tipo_projeto_id}, {"_id": 0}),
+        db.instituicoes_financeiras.find_one({"id": data.instituicao_financeira_id}, {"_id": 0}),
+    )
     
+    if data.client_id and not existing_client:
+        raise HTTPException(status_code=404, detail="Cliente não encontrado")
     if not tipo_projeto:
         raise HTTPException(status_code=400, detail="Tipo de projeto não encontrado")
     if not instituicao:
         raise HTTPException(status_code=400, detail="Instituição financeira não encontrada")
     
+    # Determinar o cliente (existente ou novo); só escreve após validar tudo
+    if data.client_id:
+        # Usar cliente existente
+        client_id = data.client_id
+        client_nome = existing_client["nome_completo"]
+        client_cpf = existing_client["cpf"]
+        client_telefone = existing_client.get("telefone", "")
+    else:
+        # Criar novo cliente ou atualizar existente pelo CPF, numa única operação atômica
+        client_doc, created = await upsert_client_by_cpf(cpf_clean, data.nome_completo, data.telefone, now)
+        client_id = client_doc["id"]
+        
+        if created:
+            # Create client folder
+            await storage.prepare_clients([client_id])
+        
+        client_nome = client_doc["nome_completo"]
+        client_cpf = cpf_clean
+        client_telefone = client_doc["telefone"]
+    
     # Create proposta
     new_proposta = {
         "id": str(uuid.uuid4()),
@@ -2012,6 +4592,198 @@ async def create_proposta(data: PropostaCreate, current_user = Depends(get_auth_
         dias_aberta=0
     )
 
+BULK_PROPOSTAS_MAX_ROWS = 1000
+
+def parse_valor(valor) -> Optional[float]:
+    """Accepts numbers and spreadsheet strings such as "150000", "150.000,00" or "R$ 1.500,50" """
+    if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+        return float(valor)
+    texto = re.sub(r'[^\d,.\-]', '', str(valor or ""))
+    if "," in texto:
+        texto = texto.replace(".", "").replace(",", ".")
+    try:
+        return float(texto)
+    except ValueError:
+        return None
+
+def read_csv_rows(contents: bytes) -> List[dict]:
+    """Parse a spreadsheet export; Excel in pt-BR writes ';' separated, latin-1 files"""
+    try:
+        text = contents.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        text = contents.decode("latin-1")
+    sample = text[:4096]
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.DictReader(io.StringIO(text), dialect=dialect)
+    return [{(k or "").strip().lower(): (v or "").strip() for k, v in row.items()} for row in reader]
+
+@api_router.post("/propostas/bulk")
+async def create_propostas_bulk(request: Request, current_user = Depends(get_auth_user)):
+    """
+    Cadastro em lote de propostas (planilhas de parceiros).
+    Aceita um JSON (lista de linhas ou {"propostas": [...]}) ou um upload CSV no campo "file".
+    Cada linha: nome_completo, cpf, telefone, tipo_projeto, instituicao_financeira, valor_credito
+    (tipo e instituição por id ou nome). Retorna o resultado de cada linha.
+    """
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        # Streamed with the size checked as it arrives, like document uploads
+        try:
+            _, temp_path, _, _, _ = await stream_upload_to_temp(request, BLOB_TMP_DIR, MAX_FILE_SIZE)
+        except UploadTooLarge:
+            raise HTTPException(status_code=400, detail="Arquivo excede o limite de 10MB")
+        try:
+            contents = await run_in_threadpool(temp_path.read_bytes)
+        finally:
+            await fs.unlink(temp_path)
+        rows = read_csv_rows(contents)
+    else:
+        try:
+            payload = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="JSON inválido")
+        rows = payload.get("propostas") if isinstance(payload, dict) else payload
+        if not isinstance(rows, list) or not all(isinstance(r, dict) for r in rows):
+            raise HTTPException(status_code=400, detail="Envie uma lista de propostas")
+    
+    if not rows:
+        raise HTTPException(status_code=400, detail="Nenhuma proposta informada")
+    if len(rows) > BULK_PROPOSTAS_MAX_ROWS:
+        raise HTTPException(status_code=400, detail=f"Máximo de {BULK_PROPOSTAS_MAX_ROWS} propostas por lote")
+    
+    tipos, instituicoes = await asyncio.gather(
+        get_lookup_table("tipos_projeto"),
+        get_lookup_table("instituicoes_financeiras"),
+    )
+    
+    now = datetime.now(timezone.utc).isoformat()
+    resultados = []
+    validas = []  # (resultado, linha normalizada)
+    
+    # 1. Validar todas as linhas sem tocar no banco
+    for numero, row in enumerate(rows, start=1):
+        resultado = {"linha": numero, "status": "erro"}
+        resultados.append(resultado)
+        
+        nome = str(row.get("nome_completo") or row.get("nome") or "").strip()
+        telefone = str(row.get("telefone") or "").strip()
+        cpf_clean = clean_cpf(str(row.get("cpf") or ""))
+        valor = parse_valor(row.get("valor_credito"))
+        tipo_ref = str(row.get("tipo_projeto_id") or row.get("tipo_projeto") or "")
+        instituicao_ref = str(row.get("instituicao_financeira_id") or row.get("instituicao_financeira") or "")
+        tipo = tipos.get(tipo_ref) or tipos.get(normalize_nome(tipo_ref))
+        instituicao = instituicoes.get(instituicao_ref) or instituicoes.get(normalize_nome(instituicao_ref))
+        
+        if not nome or not telefone:
+            resultado["erro"] = "Informe nome e telefone"
+        elif not cpf_clean:
+            resultado["erro"] = "CPF inválido"
+        elif valor is None:
+            resultado["erro"] = "Valor de crédito inválido"
+        elif not tipo:
+            resultado["erro"] = "Tipo de projeto não encontrado"
+        elif not instituicao:
+            resultado["erro"] = "Instituição financeira não encontrada"
+        else:
+            resultado["cpf"] = cpf_clean
+            validas.append((resultado, {
+                "nome_completo": nome.upper(),
+                "cpf": cpf_clean,
+                "telefone": telefone,
+                "valor_credito": valor,
+                "tipo": tipo,
+                "instituicao": instituicao,
+            }))
+    
+    if validas:
+        # 2. Upsert de todos os clientes por CPF numa única bulk_write (a última linha de cada CPF vence)
+        clientes_por_cpf = {linha["cpf"]: linha for _, linha in validas}
+        novos_ids = {cpf: str(uuid.uuid4()) for cpf in clientes_por_cpf}
+        operacoes = [
+            UpdateOne(
+                {"cpf": cpf},
+                {
+                    "$set": {"nome_completo": linha["nome_completo"], "telefone": linha["telefone"]},
+                    "$setOnInsert": {"cpf": cpf, **new_client_defaults(novos_ids[cpf], now)},
+                },
+                upsert=True,
+            )
+            for cpf, linha in clientes_por_cpf.items()
+        ]
+        try:
+            await db.clients.bulk_write(operacoes, ordered=False)
+        except BulkWriteError as e:
+            # Duplicate keys mean a concurrent request created the client first; it exists either way
+            outros = [err for err in e.details.get("writeErrors", []) if err.get("code") != 11000]
+            if outros:
+                logger.error(f"Bulk client upsert failed: {outros}")
+                raise HTTPException(status_code=500, detail="Erro ao gravar clientes")
+        
+        clientes = await db.clients.find(
+            {"cpf": {"$in": list(clientes_por_cpf)}}, {"_id": 0, "id": 1, "cpf": 1}
+        ).to_list(len(clientes_por_cpf))
+        id_por_cpf = {c["cpf"]: c["id"] for c in clientes}
+        
+        # Create folders for the clients created by this batch
+        await storage.prepare_clients([
+            client_id for cpf, client_id in id_por_cpf.items() if novos_ids[cpf] == client_id
+        ])
+        
+        # 3. Inserir todas as propostas de uma vez
+        novas_propostas = []
+        resultados_propostas = []  # resultado of each entry in novas_propostas
+        for resultado, linha in validas:
+            cliente_id = id_por_cpf.get(linha["cpf"])
+            if cliente_id is None:
+                # The client was deleted between the upsert and the lookup
+                resultado["erro"] = "Cliente não encontrado"
+                continue
+            new_proposta = {
+                "id": str(uuid.uuid4()),
+                "cliente_id": cliente_id,
+                "tipo_projeto_id": linha["tipo"]["id"],
+                "tipo_projeto_nome": linha["tipo"]["nome"],
+                "instituicao_financeira_id": linha["instituicao"]["id"],
+                "instituicao_financeira_nome": linha["instituicao"]["nome"],
+                "valor_credito": linha["valor_credito"],
+                "status": "aberta",
+                "motivo_desistencia": None,
+                "created_at": now,
+                "updated_at": now,
+                "qtd_alertas": 0,
+                "ultimo_alerta": None
+            }
+            novas_propostas.append(new_proposta)
+            resultados_propostas.append(resultado)
+            resultado.update({
+                "status": "criada",
+                "proposta_id": new_proposta["id"],
+                "cliente_id": new_proposta["cliente_id"],
+                "cliente_novo": novos_ids[linha["cpf"]] == new_proposta["cliente_id"],
+            })
+        
+        falhas = {}
+        try:
+            if novas_propostas:
+                await db.propostas.insert_many(novas_propostas, ordered=False)
+        except BulkWriteError as e:
+            falhas = {err["index"]: err.get("errmsg", "Erro ao gravar") for err in e.details.get("writeErrors", [])}
+        for indice, erro in falhas.items():
+            resultado = resultados_propostas[indice]
+            resultado.update({"status": "erro", "erro": erro})
+            resultado.pop("proposta_id", None)
+    
+    criadas = sum(1 for r in resultados if r["status"] == "criada")
+    return {
+        "total": len(resultados),
+        "criadas": criadas,
+        "erros": len(resultados) - criadas,
+        "resultados": resultados
+    }
+
 @api_router.get("/propostas", response_model=List[PropostaResponse])
 async def list_propostas(
     status: Optional[str] = None,
@@ -2034,15 +4806,15 @@ async def list_propostas(
         created_at = datetime.fromisoformat(proposta.get('created_at', now.isoformat()).replace('Z', '+00:00'))
         dias_aberta = (now - created_at).days
         
-        result.append(PropostaResponse(
+        result.append({
             **proposta,
-            cliente_nome=client["nome_completo"],
-            cliente_cpf=client["cpf"],
-            cliente_telefone=client.get("telefone"),
-            dias_aberta=dias_aberta
-        ))
+            "cliente_nome": client["nome_completo"],
+            "cliente_cpf": client["cpf"],
+            "cliente_telefone": client.get("telefone"),
+            "dias_aberta": dias_aberta,
+        })
     
-    return result
+    return trusted_list_response(PropostaResponse, result)
 
 @api_router.get("/propostas/{proposta_id}", response_model=PropostaResponse)
 async def get_proposta(proposta_id: str, current_user = Depends(get_auth_user)):
@@ -2282,6 +5054,132 @@ async def get_client_history(client_id: str, current_user = Depends(get_auth_use
         "total_propostas": len(propostas)
     }
 
+# ==================== EXPORT ROUTES ====================
+
+EXPORT_BATCH_SIZE = 1000
+
+EXPORT_COLUMNS = {
+    "clients": [
+        "id", "nome_completo", "cpf", "telefone", "endereco", "data_nascimento", "estado", "cidade",
+        "parceiro_id", "parceiro_nome", "created_at", "qtd_alertas", "ultimo_alerta"
+    ],
+    "projects": [
+        "id", "cliente_id", "cliente_nome", "cliente_cpf", "cliente_telefone", "status", "etapa_atual_id",
+        "etapa_atual_nome", "tem_pendencia", "tipo_projeto", "tipo_projeto_id", "instituicao_financeira_id",
+        "instituicao_financeira_nome", "valor_credito", "valor_servico", "numero_contrato", "data_inicio",
+        "data_arquivamento", "motivo_desistencia", "proposta_id", "documentos_check", "historico_etapas"
+    ],
+    "propostas": [
+        "id", "cliente_id", "cliente_nome", "cliente_cpf", "cliente_telefone", "status", "tipo_projeto_id",
+        "tipo_projeto_nome", "instituicao_financeira_id", "instituicao_financeira_nome", "valor_credito",
+        "motivo_desistencia", "dias_aberta", "created_at", "updated_at", "qtd_alertas", "ultimo_alerta"
+    ],
+}
+
+def cliente_lookup_stages(nome: Optional[str] = None) -> List[dict]:
+    """$lookup of the owning client, replacing the per-row find_one done by the list endpoints"""
+    stages = [
+        {"$lookup": {
+            "from": "clients",
+            "localField": "cliente_id",
+            "foreignField": "id",
+            "pipeline": [{"$project": {"_id": 0, "nome_completo": 1, "cpf": 1, "telefone": 1}}],
+            "as": "cliente"
+        }},
+        {"$unwind": "$cliente"},
+    ]
+    if nome:
+        stages.append({"$match": {"cliente.nome_completo": {"$regex": re.escape(nome), "$options": "i"}}})
+    stages.append({"$project": {"_id": 0}})
+    return stages
+
+def export_row(collection: str, doc: dict, now: datetime) -> dict:
+    cliente = doc.pop("cliente", None)
+    if cliente:
+        doc["cliente_nome"] = cliente["nome_completo"]
+        doc["cliente_cpf"] = cliente["cpf"]
+        doc["cliente_telefone"] = cliente.get("telefone")
+    if collection == "projects":
+        doc["tem_pendencia"] = projeto_tem_pendencia(doc)
+    elif collection == "propostas":
+        created_at = datetime.fromisoformat(doc.get('created_at', now.isoformat()).replace('Z', '+00:00'))
+        doc["dias_aberta"] = (now - created_at).days
+    return doc
+
+def csv_cell(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return "" if value is None else value
+
+@api_router.get("/export/{collection}")
+async def export_collection(
+    collection: str,
+    formato: str = "ndjson",
+    search: Optional[str] = None,
+    status: Optional[str] = None,
+    mes: Optional[int] = None,
+    ano: Optional[int] = None,
+    nome: Optional[str] = None,
+    pendencia: Optional[bool] = None,
+    current_user = Depends(get_auth_user)
+):
+    """
+    Exporta clients, projects ou propostas em NDJSON ou CSV, lendo direto do cursor
+    do Mongo (memória constante, sem o limite das listagens). Aceita os mesmos
+    filtros dos endpoints de listagem: search (clients); status, mes, ano, nome,
+    pendencia (projects); status (propostas).
+    """
+    if collection not in EXPORT_COLUMNS:
+        raise HTTPException(status_code=404, detail="Coleção não encontrada")
+    if formato not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="Formato deve ser ndjson ou csv")
+    
+    if collection == "clients":
+        cursor = db.clients.find(build_clients_query(search), {"_id": 0})
+    elif collection == "projects":
+        pipeline = [{"$match": build_projects_query(status, mes, ano)}] + cliente_lookup_stages(nome)
+        cursor = db.projects.aggregate(pipeline)
+    else:
+        query = {"status": status} if status else {}
+        cursor = db.propostas.aggregate([{"$match": query}] + cliente_lookup_stages())
+    cursor = cursor.batch_size(EXPORT_BATCH_SIZE)
+    columns = EXPORT_COLUMNS[collection]
+    
+    async def linhas():
+        now = datetime.now(timezone.utc)
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction="ignore", delimiter=";")
+        if formato == "csv":
+            # BOM so Excel opens the accents correctly
+            buffer.write("\ufeff")
+            writer.writeheader()
+        pendentes = 0
+        async for doc in cursor:
+            doc = export_row(collection, doc, now)
+            if pendencia is not None and collection == "projects" and doc["tem_pendencia"] != pendencia:
+                continue
+            if formato == "csv":
+                writer.writerow({c: csv_cell(doc.get(c)) for c in columns})
+            else:
+                buffer.write(json.dumps(doc, ensure_ascii=False))
+                buffer.write("\n")
+            pendentes += 1
+            # Flush once per batch: only EXPORT_BATCH_SIZE rows are ever held in memory
+            if pendentes >= EXPORT_BATCH_SIZE:
+                yield buffer.getvalue().encode("utf-8")
+                buffer.seek(0)
+                buffer.truncate()
+                pendentes = 0
+        yield buffer.getvalue().encode("utf-8")
+    
+    media_type = "text/csv; charset=utf-8" if formato == "csv" else "application/x-ndjson"
+    filename = f"{collection}-{datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')}.{formato}"
+    return StreamingResponse(
+        linhas(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
 # ==================== ESTADOS E CIDADES ====================
 
 ESTADOS_BRASIL = [
@@ -2319,22 +5217,220 @@ async def list_estados():
     """List all Brazilian states"""
     return ESTADOS_BRASIL
 
-@api_router.get("/cidades/{estado_sigla}")
-async def list_cidades(estado_sigla: str):
-    """List cities for a given state (using IBGE API)"""
-    import httpx
+# Municipalities are served from memory. The list comes from the newest of:
+# the dataset shipped with the code (data/municipios.json.gz, generated by
+# data/update_municipios.py), the on-disk cache and the Mongo cache (both written
+# by the last successful refresh). Requests never wait on IBGE: it is only
+# contacted by the background task, right at startup when there is no copy or
+# it is older than IBGE_CACHE_TTL_DAYS, and then every few hours.
+IBGE_MUNICIPIOS_URL = "https://servicodados.ibge.gov.br/api/v1/localidades/municipios?view=nivelado"
+MUNICIPIOS_DATASET = ROOT_DIR / "data" / "municipios.json.gz"
+MUNICIPIOS_CACHE_FILE = UPLOAD_DIR / ".cache" / "municipios.json.gz"
+MUNICIPIOS_TTL = timedelta(days=float(os.environ.get("IBGE_CACHE_TTL_DAYS", "30")))
+MUNICIPIOS_REFRESH_INTERVAL = 6 * 3600
+MUNICIPIOS_MIN_COUNT = 5000  # Sanity check on what IBGE returns
+MUNICIPIOS_RETRY_AFTER = 300  # With no copy at all, how often to look for one / try IBGE again
+
+def _read_municipios_file(path: Path) -> Optional[dict]:
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"https://servicodados.ibge.gov.br/api/v1/localidades/estados/{estado_sigla}/municipios"
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable municipality dataset {path}: {e}")
+        return None
+
+def _write_municipios_file(path: Path, dataset: dict):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp = path.with_name(f".{path.name}.tmp")
+    with gzip.open(temp, "wt", encoding="utf-8") as f:
+        json.dump(dataset, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(temp, path)
+
+def parse_ibge_municipios(payload: List[dict]) -> List[dict]:
+    """Flatten IBGE's `view=nivelado` response to id / nome / uf"""
+    return [{"id": m["municipio-id"], "nome": m["municipio-nome"], "uf": m["UF-sigla"]} for m in payload]
+
+def search_key(text: str) -> str:
+    """normalize_nome with punctuation folded to spaces ("Pingo-d'Água" -> "pingo d agua")"""
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", normalize_nome(text)).split())
+
+class CidadePrefixIndex:
+    """
+    Sorted array of search keys for prefix lookups with bisect: one binary search
+    finds the first match and the scan stops at the first key that no longer
+    starts with the query. Besides the full name, every later word of a name is
+    indexed too ("grande" finds "Campo Grande"), ranked after full-name matches.
+    """
+    def __init__(self, municipios: List[dict]):
+        entries = []
+        for m in municipios:
+            key = search_key(m["nome"])
+            entries.append((key, 0, m))
+            words = key.split(" ")
+            for i in range(1, len(words)):
+                entries.append((" ".join(words[i:]), 1, m))
+        entries.sort(key=lambda e: (e[0], e[1]))
+        self.keys = [e[0] for e in entries]
+        self.entries = entries
+    
+    def search(self, query: str, limit: int) -> List[dict]:
+        prefix = search_key(query)
+        if not prefix:
+            return []
+        ranked = ([], [])
+        seen = set()
+        i = bisect.bisect_left(self.keys, prefix)
+        while i < len(self.keys) and self.keys[i].startswith(prefix) and len(ranked[0]) < limit:
+            _, rank, m = self.entries[i]
+            if m["id"] not in seen:
+                seen.add(m["id"])
+                ranked[rank].append(m)
+            i += 1
+        return (ranked[0] + ranked[1])[:limit]
+
+class MunicipiosCache:
+    def __init__(self):
+        self.dataset: Optional[dict] = None
+        self._json_por_uf: dict = {}
+        self._indice: Optional[CidadePrefixIndex] = None
+        self._indice_por_uf: dict = {}
+        self._lock = asyncio.Lock()
+        self._http: Optional[httpx.AsyncClient] = None
+        self._last_load = float("-inf")
+    
+    @property
+    def http(self) -> httpx.AsyncClient:
+        # One pooled client for IBGE, so refreshes reuse the TLS connection
+        if self._http is None:
+            self._http = httpx.AsyncClient(timeout=httpx.Timeout(30.0, connect=5.0))
+        return self._http
+    
+    async def close(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+    
+    def _install(self, dataset: dict):
+        por_uf = {}
+        for m in dataset["municipios"]:
+            por_uf.setdefault(m["uf"], []).append({"id": m["id"], "nome": m["nome"]})
+        # Encoded once per refresh; a request only picks the bytes for its state
+        self._json_por_uf = {
+            uf: json.dumps(sorted(cidades, key=lambda c: normalize_nome(c["nome"])), ensure_ascii=False).encode()
+            for uf, cidades in por_uf.items()
+        }
+        self._indice = CidadePrefixIndex(dataset["municipios"])
+        self._indice_por_uf = {
+            uf: CidadePrefixIndex([m for m in dataset["municipios"] if m["uf"] == uf]) for uf in por_uf
+        }
+        self.dataset = dataset
+    
+    def search(self, query: str, uf: Optional[str], limit: int) -> List[dict]:
+        indice = self._indice_por_uf.get(uf) if uf else self._indice
+        return indice.search(query, limit) if indice else []
+    
+    def cidades_json(self, uf: str) -> bytes:
+        return self._json_por_uf.get(uf, b"[]")
+    
+    def is_stale(self) -> bool:
+        if self.dataset is None:
+            return True
+        updated = datetime.fromisoformat(self.dataset["atualizado_em"])
+        return datetime.now(timezone.utc) - updated > MUNICIPIOS_TTL
+    
+    async def ensure_loaded(self):
+        """Load the newest local copy (shipped dataset, disk cache, Mongo); never calls IBGE"""
+        if self.dataset is not None or time.monotonic() - self._last_load < MUNICIPIOS_RETRY_AFTER:
+            return
+        async with self._lock:
+            if self.dataset is not None or time.monotonic() - self._last_load < MUNICIPIOS_RETRY_AFTER:
+                return
+            self._last_load = time.monotonic()
+            copies = await asyncio.gather(
+                run_in_threadpool(_read_municipios_file, MUNICIPIOS_DATASET),
+                run_in_threadpool(_read_municipios_file, MUNICIPIOS_CACHE_FILE),
+                db.ibge_cache.find_one({"_id": "municipios"}, {"_id": 0}),
             )
-            if response.status_code == 200:
-                cidades = response.json()
-                return [{"id": c["id"], "nome": c["nome"]} for c in cidades]
-    except Exception as e:
-        logger.error(f"Error fetching cities: {e}")
-    
-    return []
+            if copies[0] is None:
+                logger.warning(
+                    f"{MUNICIPIOS_DATASET} is missing: lookups depend on IBGE until "
+                    "data/update_municipios.py is run and its output committed"
+                )
+            newest = max(
+                (c for c in copies if c and c.get("municipios")),
+                key=lambda c: c["atualizado_em"], default=None
+            )
+            if newest:
+                self._install(newest)
+    
+    async def refresh(self) -> bool:
+        """Fetch the full list from IBGE and update memory, disk and Mongo"""
+        try:
+            with trace_span("http GET ibge municipios", url=IBGE_MUNICIPIOS_URL):
+                response = await self.http.get(IBGE_MUNICIPIOS_URL)
+            response.raise_for_status()
+            municipios = parse_ibge_municipios(response.json())
+        except Exception as e:
+            logger.warning(f"Could not refresh municipalities from IBGE: {e}")
+            return False
+        if len(municipios) < MUNICIPIOS_MIN_COUNT:
+            logger.warning(f"IBGE returned only {len(municipios)} municipalities; keeping the current list")
+            return False
+        
+        now = datetime.now(timezone.utc)
+        dataset = {
+            "versao": now.strftime("%Y-%m-%d"),
+            "atualizado_em": now.isoformat(),
+            "fonte": IBGE_MUNICIPIOS_URL,
+            "municipios": municipios,
+        }
+        self._install(dataset)
+        await asyncio.gather(
+            run_in_threadpool(_write_municipios_file, MUNICIPIOS_CACHE_FILE, dataset),
+            db.ibge_cache.replace_one({"_id": "municipios"}, dataset, upsert=True),
+        )
+        logger.info(f"Municipality list refreshed from IBGE ({len(municipios)} entries)")
+        return True
+
+municipios_cache = MunicipiosCache()
+
+async def refresh_municipios_periodically():
+    while True:
+        try:
+            await municipios_cache.ensure_loaded()
+            if municipios_cache.is_stale():
+                await municipios_cache.refresh()
+        except Exception:
+            logger.exception("Municipality refresh failed")
+        # Without any list yet, keep trying every few minutes instead of hours
+        await asyncio.sleep(MUNICIPIOS_RETRY_AFTER if municipios_cache.dataset is None else MUNICIPIOS_REFRESH_INTERVAL)
+
+@api_router.get("/cidades/search")
+async def search_cidades(
+    q: str = Query(..., min_length=1, max_length=60),
+    uf: Optional[str] = Query(None, min_length=2, max_length=2),
+    limit: int = Query(10, ge=1, le=50)
+):
+    """Autocomplete de municípios: prefixo do nome ou de uma palavra do nome, sem acentos"""
+    await municipios_cache.ensure_loaded()
+    cidades = municipios_cache.search(q, uf.upper() if uf else None, limit)
+    return Response(
+        content=json.dumps(cidades, ensure_ascii=False).encode(),
+        media_type="application/json",
+        headers={"Cache-Control": "public, max-age=3600"},
+    )
+
+@api_router.get("/cidades/{estado_sigla}")
+async def list_cidades(estado_sigla: str):
+    """List cities for a given state (IBGE list kept in memory)"""
+    await municipios_cache.ensure_loaded()
+    return Response(
+        content=municipios_cache.cidades_json(estado_sigla.upper()),
+        media_type="application/json",
+        headers={"Cache-Control": "public, max-age=86400"},
+    )
 
 # ==================== MASTER ONLY: RESET DATA ====================
 
@@ -2361,12 +5457,12 @@ async def reset_all_data(current_user = Depends(get_auth_user)):
     # Delete all clients
     await db.clients.delete_many({})
     
-    # Clean up upload folder
-    import shutil
-    if UPLOAD_DIR.exists():
-        for folder in UPLOAD_DIR.iterdir():
-            if folder.is_dir():
-                shutil.rmtree(folder)
+    # Clean up upload folder (blob store included)
+    await db.files.delete_many({})
+    await db.upload_sessions.delete_many({})
+    await db.blob_guards.delete_many({})
+    await db.counters.delete_one({"_id": "armazenamento"})
+    await storage.reset_all()
     
     return {
         "message": "Todos os dados foram eliminados com sucesso",
@@ -2396,9 +5492,464 @@ async def get_data_stats(current_user = Depends(get_auth_user)):
         "total": projects_count + propostas_count + clients_count
     }
 
+# ==================== PROFILING ====================
+# A master user adds "X-Profile: speedscope" (or "collapsed") to a request, or
+# ?_profile=speedscope to a URL opened in the browser, and that single request runs
+# under a sampling profiler. The response is unchanged apart from X-Profile-Id; the
+# profile is stored under uploads/.profiles and fetched from /api/master/profiles.
+#
+# Samples follow the request's task rather than the thread: the coroutine chain
+# (cr_await) gives the logical stack even while the request is suspended, so time
+# spent waiting on Mongo shows up as "await ..." leaves next to the CPU frames.
+# Requests without the flag pay one header scan.
+
+PROFILE_DIR = UPLOAD_DIR / ".profiles"
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL_MS", "2")) / 1000
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", "50"))
+PROFILE_FORMATS = {"speedscope": ".speedscope.json", "collapsed": ".collapsed.txt"}
+
+def _frame_name(frame) -> tuple:
+    code = frame.f_code
+    # co_qualname is Python 3.11+; older interpreters only have the bare name
+    return (getattr(code, "co_qualname", code.co_name), code.co_filename, code.co_firstlineno)
+
+def task_stack(task: asyncio.Task, loop_thread_id: int, root_code) -> List[tuple]:
+    """Logical stack of a task, outermost first, below the frame running root_code"""
+    frames = []
+    awaiting = None
+    coro = task.get_coro()
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            awaiting = coro
+            break
+        frames.append(frame)
+        # Only suspended coroutines have cr_await; a running chain stops at its outermost frame
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    
+    if awaiting is None and frames:
+        # Running: take the rest of the stack from the loop thread
+        running = []
+        frame = sys._current_frames().get(loop_thread_id)
+        while frame is not None and frame is not frames[-1]:
+            running.append(frame)
+            frame = frame.f_back
+        if frame is not None:
+            frames.extend(reversed(running))
+    
+    for i, frame in enumerate(frames):
+        if frame.f_code is root_code:
+            frames = frames[i + 1:]
+            break
+    stack = [_frame_name(f) for f in frames]
+    if awaiting is not None:
+        stack.append((f"await {type(awaiting).__name__}", "", 0))
+    return stack
+
+class RequestSampler:
+    def __init__(self, task: asyncio.Task, root_code):
+        self.task = task
+        self.root_code = root_code
+        self.loop_thread_id = threading.get_ident()
+        self.samples: List[tuple] = []
+        self.weights: List[float] = []
+        self.failed_samples = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+    
+    def _run(self):
+        last = time.perf_counter()
+        while not self.stop_event.wait(PROFILE_INTERVAL):
+            now = time.perf_counter()
+            try:
+                stack = task_stack(self.task, self.loop_thread_id, self.root_code)
+            except Exception:
+                # Usually the chain changed under us and the next sample is fine; a
+                # bug here would fail every sample, so the first failure is logged
+                if not self.failed_samples:
+                    logger.warning("Profiler sample failed", exc_info=True)
+                self.failed_samples += 1
+                continue
+            # Weight by the real gap: while the loop holds the GIL samples arrive late
+            self.samples.append(tuple(stack))
+            self.weights.append((now - last) * 1000)
+            last = now
+    
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self.thread.start()
+        return self
+    
+    def __exit__(self, *exc):
+        self.stop_event.set()
+        self.thread.join()
+        self.elapsed = time.perf_counter() - self.started
+    
+    def collapsed(self) -> bytes:
+        totals: dict = {}
+        for stack, weight in zip(self.samples, self.weights):
+            key = ";".join(name for name, _, _ in stack) or "(idle)"
+            totals[key] = totals.get(key, 0.0) + weight
+        # Brendan Gregg's format; counts are microseconds so short waits are not rounded away
+        return "".join(f"{key} {round(total * 1000)}\n" for key, total in totals.items()).encode()
+    
+    def speedscope(self, name: str) -> bytes:
+        frames, index = [], {}
+        samples = []
+        for stack in self.samples:
+            sample = []
+            for frame in stack:
+                if frame not in index:
+                    index[frame] = len(frames)
+                    frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+                sample.append(index[frame])
+            samples.append(sample)
+        return json.dumps({
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "exporter": "agrolink",
+            "name": name,
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": sum(self.weights),
+                "samples": samples,
+                "weights": self.weights,
+            }],
+        }).encode()
+
+def _write_profile(path: Path, data: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    profiles = sorted(path.parent.iterdir(), key=lambda p: p.stat().st_mtime)
+    for old in profiles[:-PROFILE_KEEP]:
+        old.unlink(missing_ok=True)
+
+def _list_profiles(folder: Path) -> List[dict]:
+    if not folder.is_dir():
+        return []
+    profiles = []
+    for path in folder.iterdir():
+        profile_id, _, extensao = path.name.partition(".")
+        st = path.stat()
+        profiles.append({
+            "id": profile_id,
+            "formato": "speedscope" if extensao == "speedscope.json" else "collapsed",
+            "tamanho": st.st_size,
+            "created_at": datetime.fromtimestamp(st.st_mtime, timezone.utc).isoformat(),
+        })
+    return sorted(profiles, key=lambda p: p["created_at"], reverse=True)
+
+def profile_format(scope) -> Optional[str]:
+    for name, value in scope["headers"]:
+        if name == b"x-profile":
+            return value.decode("latin-1")
+    if b"_profile=" in scope.get("query_string", b""):
+        return parse_qs(scope["query_string"].decode("latin-1")).get("_profile", [None])[0]
+    return None
+
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        formato = profile_format(scope) if scope["type"] == "http" else None
+        if formato is None:
+            await self.app(scope, receive, send)
+            return
+        formato = formato if formato in PROFILE_FORMATS else "speedscope"
+        try:
+            authorization = dict(scope["headers"]).get(b"authorization", b"").decode("latin-1")
+            user = await get_current_user(authorization or None)
+        except HTTPException:
+            user = None
+        if not user or user["role"] != UserRole.MASTER:
+            await self.app(scope, receive, send)
+            return
+        
+        profile_id = uuid.uuid4().hex[:12]
+        
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), (b"x-profile-id", profile_id.encode())]
+            await send(message)
+        
+        with RequestSampler(asyncio.current_task(), ProfilingMiddleware.__call__.__code__) as sampler:
+            await self.app(scope, receive, send_wrapper)
+        
+        name = f"{scope['method']} {scope['path']} ({sampler.elapsed * 1000:.0f} ms)"
+        data = sampler.speedscope(name) if formato == "speedscope" else sampler.collapsed()
+        await run_in_threadpool(_write_profile, PROFILE_DIR / f"{profile_id}{PROFILE_FORMATS[formato]}", data)
+        logger.info(f"Profile {profile_id}: {name}, {len(sampler.samples)} samples, {sampler.failed_samples} failed")
+
+@api_router.get("/master/profiles")
+async def list_profiles(current_user = Depends(get_auth_user)):
+    """
+    MASTER ONLY: Profiles recorded with X-Profile / ?_profile, newest first.
+    """
+    if current_user["role"] != UserRole.MASTER:
+        raise HTTPException(status_code=403, detail="Apenas usuário Master pode acessar")
+    return {"profiles": await run_in_threadpool(_list_profiles, PROFILE_DIR)}
+
+@api_router.get("/master/profiles/{profile_id}")
+async def get_profile(profile_id: str, request: Request, current_user = Depends(get_auth_user)):
+    """
+    MASTER ONLY: Download a profile (open .speedscope.json at https://www.speedscope.app,
+    feed .collapsed.txt to flamegraph.pl).
+    """
+    if current_user["role"] != UserRole.MASTER:
+        raise HTTPException(status_code=403, detail="Apenas usuário Master pode acessar")
+    if not re.fullmatch(r"[0-9a-f]{12}", profile_id):
+        raise HTTPException(status_code=404, detail="Perfil não encontrado")
+    
+    for extensao in PROFILE_FORMATS.values():
+        path = PROFILE_DIR / f"{profile_id}{extensao}"
+        st = await fs.stat_file(path)
+        if st:
+            return file_response(request, path, st, filename=path.name)
+    raise HTTPException(status_code=404, detail="Perfil não encontrado")
+
+# ==================== COMPRESSION ====================
+# JSON/text responses above COMPRESS_MIN_BYTES are compressed with brotli (when the
+# package is installed) or gzip, whichever the client accepts. Levels are tuned for CPU
+# cost: brotli 4 / gzip 5 compress repetitive JSON ~8-15x at a fraction of the CPU of
+# the maximum levels. Streaming responses (NDJSON progress, exports) are compressed
+# chunk by chunk with a sync flush, so every chunk still reaches the client right away.
+
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_GZIP_LEVEL = int(os.environ.get("COMPRESS_GZIP_LEVEL", "5"))
+COMPRESS_BROTLI_QUALITY = int(os.environ.get("COMPRESS_BROTLI_QUALITY", "4"))
+COMPRESSIBLE_TYPES = (
+    b"application/json", b"application/x-ndjson", b"text/", b"application/javascript",
+    b"application/xml", b"image/svg+xml",
+)
+
+def accepted_encoding(scope) -> Optional[str]:
+    """Best encoding we support among those the client accepts (q=0 excludes)"""
+    header = b""
+    for name, value in scope["headers"]:
+        if name == b"accept-encoding":
+            header = value
+            break
+    if not header:
+        return None
+    accepted = {}
+    for item in header.decode("latin-1").lower().split(","):
+        coding, _, params = item.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip()] = q
+    wildcard = accepted.get("*", 0.0)
+    for encoding in (("br", "gzip") if brotli else ("gzip",)):
+        if accepted.get(encoding, wildcard) > 0:
+            return encoding
+    return None
+
+class StreamCompressor:
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=COMPRESS_BROTLI_QUALITY)
+        else:
+            self._compressor = zlib.compressobj(COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 31)  # 31: gzip container
+    
+    def compress(self, data: bytes, final: bool) -> bytes:
+        start = time.perf_counter()
+        if self.encoding == "br":
+            out = self._compressor.process(data) + (self._compressor.finish() if final else self._compressor.flush())
+        else:
+            out = self._compressor.compress(data) + self._compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+        metrics.observe_compression(self.encoding, time.perf_counter() - start, len(data), len(out))
+        return out
+
+# A response with any of these headers is already encoded or is a stored document
+# (documents are always served with Accept-Ranges). Content-Disposition alone does
+# not count: exports are generated attachments and compress like any other body
+UNCOMPRESSED_MARKERS = (b"content-encoding", b"accept-ranges", b"content-range", b"x-accel-redirect")
+
+class CompressionMiddleware:
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = accepted_encoding(scope) if scope["method"] != "HEAD" else None
+        start_message = None
+        compressor: Optional[StreamCompressor] = None
+        
+        async def send_wrapper(message):
+            nonlocal start_message, compressor
+            if message["type"] == "http.response.start":
+                headers = message.get("headers", [])
+                content_type = next((v for k, v in headers if k == b"content-type"), b"")
+                # Downloads keep their bytes as stored: byte ranges and the strong
+                # ETag (file_response) refer to the identity body
+                compressible = (
+                    message["status"] in (200, 201) and content_type.startswith(COMPRESSIBLE_TYPES)
+                    and not any(k in UNCOMPRESSED_MARKERS for k, _ in headers)
+                )
+                if compressible and encoding is None:
+                    # Caches must not hand this identity body to clients that asked for gzip
+                    message["headers"] = [*headers, (b"vary", b"Accept-Encoding")]
+                elif compressible:
+                    # Hold the headers until the first body chunk shows whether compressing pays off
+                    start_message = message
+                    return
+                await send(message)
+                return
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+            
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None:
+                headers = [(k, v) for k, v in start_message["headers"] if k != b"content-length"]
+                headers.append((b"vary", b"Accept-Encoding"))
+                if not more_body and len(body) < COMPRESS_MIN_BYTES:
+                    headers.append((b"content-length", str(len(body)).encode()))
+                    start_message["headers"] = headers
+                    await send(start_message)
+                    start_message = None
+                    await send(message)
+                    return
+                compressor = StreamCompressor(encoding)
+                headers.append((b"content-encoding", encoding.encode()))
+                data = compressor.compress(body, final=not more_body)
+                if not more_body:
+                    headers.append((b"content-length", str(len(data)).encode()))
+                start_message["headers"] = headers
+                await send(start_message)
+            else:
+                data = compressor.compress(body, final=not more_body)
+            await send({"type": "http.response.body", "body": data, "more_body": more_body})
+        
+        await self.app(scope, receive, send_wrapper)
+
+# ==================== MASTER ONLY: TRACES ====================
+
+def trace_waterfall(trace: dict, width: int = 60) -> str:
+    """Plain-text waterfall: offset, duration and a bar on the request's timeline"""
+    total = trace["duracao_ms"] or 1
+    lines = [f"{trace['nome']}  {trace['duracao_ms']:.1f} ms  {trace['inicio']}  trace {trace['trace_id']}"]
+    for span in trace["spans"]:
+        start = int(span["inicio_ms"] / total * width)
+        length = max(1, int(span["duracao_ms"] / total * width))
+        bar = " " * start + "█" * min(length, width - start)
+        label = "  " * span["profundidade"] + span["nome"]
+        detalhe = span["atributos"].get("collection") or span["atributos"].get("path") or ""
+        lines.append(f"{span['inicio_ms']:9.1f} {span['duracao_ms']:9.1f} ms |{bar:<{width}}| {label} {detalhe}")
+    if trace["descartados"]:
+        lines.append(f"... {trace['descartados']} spans descartados (TRACE_MAX_SPANS)")
+    return "\n".join(lines) + "\n"
+
+@api_router.get("/master/traces")
+async def list_traces(
+    rota: Optional[str] = None,
+    min_ms: float = 0,
+    limit: int = Query(50, ge=1, le=500),
+    current_user = Depends(get_auth_user)
+):
+    """
+    MASTER ONLY: Recent request traces kept in memory, slowest first.
+    """
+    if current_user["role"] != UserRole.MASTER:
+        raise HTTPException(status_code=403, detail="Apenas usuário Master pode acessar")
+    
+    resumo = []
+    for trace in list(finished_traces):
+        duracao_ms = (trace.root.end - trace.root.start) * 1000
+        if duracao_ms < min_ms or (rota and rota not in trace.root.name):
+            continue
+        resumo.append({
+            "trace_id": trace.trace_id,
+            "nome": trace.root.name,
+            "status": trace.root.attrs.get("status"),
+            "inicio": trace.started_at,
+            "duracao_ms": round(duracao_ms, 3),
+            "spans": len(trace.spans) + trace.dropped,
+            "mongo": sum(1 for span in trace.spans if span.name.startswith("mongo ")),
+        })
+    resumo.sort(key=lambda t: t["duracao_ms"], reverse=True)
+    return {"traces": resumo[:limit]}
+
+@api_router.get("/master/traces/{trace_id}")
+async def get_trace(trace_id: str, formato: str = "json", current_user = Depends(get_auth_user)):
+    """
+    MASTER ONLY: Spans of one trace; formato=texto renders a waterfall.
+    """
+    if current_user["role"] != UserRole.MASTER:
+        raise HTTPException(status_code=403, detail="Apenas usuário Master pode acessar")
+    
+    trace = next((t for t in list(finished_traces) if t.trace_id == trace_id), None)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace não encontrado")
+    data = trace.to_dict()
+    if formato == "texto":
+        return Response(content=trace_waterfall(data), media_type="text/plain; charset=utf-8")
+    return data
+
+# ==================== MASTER ONLY: SLOW QUERIES ====================
+
+@api_router.get("/master/slow-queries")
+async def get_slow_queries(
+    horas: int = Query(24, ge=1, le=24 * 30),
+    limit: int = Query(50, ge=1, le=500),
+    current_user = Depends(get_auth_user)
+):
+    """
+    MASTER ONLY: Slow Mongo commands grouped by collection, operation and filter shape,
+    worst total time first. Needs SLOW_QUERY_MS > 0.
+    """
+    if current_user["role"] != UserRole.MASTER:
+        raise HTTPException(status_code=403, detail="Apenas usuário Master pode acessar")
+    
+    desde = (datetime.now(timezone.utc) - timedelta(hours=horas)).isoformat()
+    grupos = await db.slow_queries.aggregate([
+        {"$match": {"at": {"$gte": desde}}},
+        {"$sort": {"at": 1}},
+        {"$group": {
+            "_id": {"collection": "$collection", "operacao": "$operacao", "shape": "$shape", "sort": "$sort"},
+            "ocorrencias": {"$sum": 1},
+            "total_ms": {"$sum": "$duration_ms"},
+            "media_ms": {"$avg": "$duration_ms"},
+            "max_ms": {"$max": "$duration_ms"},
+            "ultima": {"$last": "$at"},
+            "explains": {"$push": "$explain"},
+        }},
+        {"$sort": {"total_ms": -1}},
+        {"$limit": limit},
+    ]).to_list(limit)
+    
+    resultado = []
+    for g in grupos:
+        explains = [e for e in g.pop("explains") if e]
+        resultado.append({
+            **g.pop("_id"),
+            **g,
+            # Most recent plan; a COLLSCAN here usually means a missing index
+            "explain": explains[-1] if explains else None,
+        })
+    return {"ativo": SLOW_QUERY_MS > 0, "limite_ms": SLOW_QUERY_MS, "consultas": resultado}
+
 # Include the router in the main app
 app.include_router(api_router)
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics(authorization: Optional[str] = Header(None)):
+    """Prometheus scrape endpoint"""
+    if METRICS_TOKEN and not hmac.compare_digest(authorization or "", f"Bearer {METRICS_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Token inválido")
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -2406,6 +5957,12 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(TracingMiddleware)
+# Inside the metrics middleware: recorded sizes are the bytes actually sent
+app.add_middleware(CompressionMiddleware)
+# Outermost, so the recorded latency includes CORS handling
+app.add_middleware(MetricsMiddleware)
 
 # Configure logging
 logging.basicConfig(
@@ -2417,3 +5974,5 @@ logger = logging.getLogger(__name__)
 @app.on_event("shutdown")
 async def shutdown_db_client():
     client.close()
+    await storage.close()
+    await municipios_cache.close()
@@ -0,0 +1,9 @@
+import pytest
+
+
+@pytest.fixture(scope="module")
+def auth_headers():
+    """Get headers with auth token"""
+    # Imported here: the in-process suites run without requests installed
+    from live_api import login
+    return login()
@@ -0,0 +1,32 @@
+"""
+Helpers for the tests that run against a live backend (REACT_APP_BACKEND_URL);
+the auth_headers fixture is in conftest.py
+"""
+import os
+import random
+
+import requests
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+TEST_LOGIN = "admin"
+TEST_PASSWORD = "#Sti93qn06301616"
+
+
+def random_cpf():
+    """Generate a CPF with valid check digits"""
+    digits = [random.randint(0, 9) for _ in range(9)]
+    for size in (9, 10):
+        total = sum(d * w for d, w in zip(digits, range(size + 1, 1, -1)))
+        digits.append((total * 10 % 11) % 10)
+    return "".join(str(d) for d in digits)
+
+
+def login(login=TEST_LOGIN, senha=TEST_PASSWORD):
+    """Auth headers for a user"""
+    response = requests.post(f"{BASE_URL}/api/auth/login", json={
+        "login": login,
+        "senha": senha
+    })
+    assert response.status_code == 200, f"Login failed: {response.text}"
+    return {"Authorization": f"Bearer {response.json()['token']}"}
@@ -0,0 +1,25 @@
+"""
+Query budget helpers: read the Mongo command count the backend reports in the
+Server-Timing header (db;dur=...;desc="N mongo commands") and fail when an
+endpoint issues more commands than allowed
+"""
+import re
+
+_DB_TIMING = re.compile(r'db;dur=([\d.]+);desc="(\d+) mongo commands"')
+
+
+def mongo_commands(response):
+    """Number of Mongo commands the backend issued for this response"""
+    match = _DB_TIMING.search(response.headers.get("Server-Timing", ""))
+    assert match, f"Server-Timing header missing from {response.url}"
+    return int(match.group(2))
+
+
+def assert_query_budget(response, budget):
+    """
+    The budget is a fixed number of commands: an endpoint that runs one query
+    per row (N+1) passes on an empty database and fails once rows exist
+    """
+    assert response.status_code == 200, response.text
+    count = mongo_commands(response)
+    assert count <= budget, f"{response.request.method} {response.url}: {count} Mongo commands, budget {budget}"
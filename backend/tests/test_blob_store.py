@@ -0,0 +1,68 @@
+"""
+Test suite for the local content-addressed blob store (_link_blob / _release_blobs)
+Runs in-process against a temporary folder
+"""
+import hashlib
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+# server.py needs these at import time; nothing here talks to Mongo
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "agrolink_test")
+import server  # noqa: E402
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "BLOB_DIR", tmp_path / ".blobs")
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    return tmp_path
+
+
+def staged(folder, content):
+    path = folder / f".upload-{os.urandom(4).hex()}.part"
+    path.write_bytes(content)
+    return path, hashlib.sha256(content).hexdigest()
+
+
+def test_shared_blob_survives_one_release(store):
+    content = b"documento" * 100
+    temp, sha256 = staged(store, content)
+    assert server._link_blob(temp, sha256, store / "a" / "RG.PDF")
+    assert not server._link_blob(None, sha256, store / "b" / "RG.PDF")
+    assert server.blob_path(sha256).stat().st_nlink == 3
+
+    (store / "a" / "RG.PDF").unlink()
+    server._release_blobs([sha256])
+    assert server.blob_path(sha256).exists()
+
+    (store / "b" / "RG.PDF").unlink()
+    server._release_blobs([sha256])
+    assert not server.blob_path(sha256).exists()
+
+
+def test_without_hardlinks_no_blob_is_kept(store, monkeypatch):
+    """Documents become independent files, so releasing one never drops content another uses"""
+    def no_link(src, dst):
+        if not os.path.exists(src):
+            raise FileNotFoundError(2, "No such file or directory")
+        raise PermissionError(1, "Operation not permitted")
+    monkeypatch.setattr(server.os, "link", no_link)
+
+    content = b"escritura" * 100
+    temp, sha256 = staged(store, content)
+    assert not server._link_blob(temp, sha256, store / "a" / "ESCRITURA.PDF")
+    assert not server.blob_path(sha256).exists()
+    assert not temp.exists()
+
+    # Same content again: stored again in full, not linked to a blob
+    temp, _ = staged(store, content)
+    server._link_blob(temp, sha256, store / "b" / "ESCRITURA.PDF")
+    (store / "a" / "ESCRITURA.PDF").unlink()
+    server._release_blobs([sha256])
+    assert (store / "b" / "ESCRITURA.PDF").read_bytes() == content
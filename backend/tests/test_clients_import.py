@@ -0,0 +1,90 @@
+"""
+Test suite for streaming client import - POST /api/clients/import
+Covers CPF check-digit validation, deduplication and NDJSON progress reporting
+"""
+import pytest
+import requests
+import json
+
+from live_api import BASE_URL, random_cpf
+
+
+def read_ndjson(response):
+    return [json.loads(line) for line in response.text.splitlines() if line.strip()]
+
+
+class TestCPFValidation:
+    """CPF check digits are validated on every create path"""
+
+    def test_create_client_rejects_bad_check_digit(self, auth_headers):
+        response = requests.post(f"{BASE_URL}/api/clients", json={
+            "nome_completo": "TEST_CPF_INVALIDO",
+            "cpf": "123.456.789-01",
+            "telefone": "11999990000"
+        }, headers=auth_headers)
+        assert response.status_code == 400
+        assert response.json()["detail"] == "CPF inválido"
+
+    def test_create_client_rejects_repeated_digits(self, auth_headers):
+        response = requests.post(f"{BASE_URL}/api/clients", json={
+            "nome_completo": "TEST_CPF_REPETIDO",
+            "cpf": "111.111.111-11",
+            "telefone": "11999990000"
+        }, headers=auth_headers)
+        assert response.status_code == 400
+
+
+class TestClientsImport:
+    """Streaming CSV import"""
+
+    def test_import_csv(self, auth_headers):
+        cpf_a, cpf_b = random_cpf(), random_cpf()
+        csv_content = (
+            "nome_completo;cpf;telefone;estado;cidade\n"
+            f"TEST_IMPORT_A;{cpf_a};67999990001;ms;Campo Grande\n"
+            f"TEST_IMPORT_B;{cpf_b};67999990002;MS;Dourados\n"
+            f"TEST_IMPORT_DUP;{cpf_a};67999990003;MS;Dourados\n"
+            "TEST_IMPORT_BAD;12345678901;67999990004;MS;Dourados\n"
+        )
+        files = {"file": ("clientes.csv", csv_content.encode("utf-8"), "text/csv")}
+        response = requests.post(f"{BASE_URL}/api/clients/import", files=files, headers=auth_headers)
+        assert response.status_code == 200, response.text
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+
+        events = read_ndjson(response)
+        resumo = events[-1]
+        assert resumo["tipo"] == "resumo"
+        assert resumo["linhas_processadas"] == 4
+        assert resumo["importados"] == 2
+        assert resumo["invalidos"] == 2
+        erros = [e for ev in events if ev["tipo"] == "progresso" for e in ev["erros"]]
+        assert {e["linha"] for e in erros} == {4, 5}
+
+        clients = requests.get(f"{BASE_URL}/api/clients?search=TEST_IMPORT_", headers=auth_headers).json()
+        imported = {c["cpf"]: c for c in clients if c["cpf"] in (cpf_a, cpf_b)}
+        assert imported[cpf_a]["estado"] == "MS"
+        for c in imported.values():
+            requests.delete(f"{BASE_URL}/api/clients/{c['id']}", headers=auth_headers)
+
+    def test_import_existing_cpf_is_skipped(self, auth_headers):
+        cpf = random_cpf()
+        created = requests.post(f"{BASE_URL}/api/clients", json={
+            "nome_completo": "TEST_IMPORT_EXISTENTE",
+            "cpf": cpf,
+            "telefone": "67999990005"
+        }, headers=auth_headers)
+        assert created.status_code == 200
+        try:
+            csv_content = f"nome_completo,cpf,telefone\nTEST_IMPORT_EXISTENTE,{cpf},67999990005\n"
+            files = {"file": ("clientes.csv", csv_content.encode("utf-8"), "text/csv")}
+            response = requests.post(f"{BASE_URL}/api/clients/import", files=files, headers=auth_headers)
+            resumo = read_ndjson(response)[-1]
+            assert resumo["importados"] == 0
+            assert resumo["duplicados"] == 1
+        finally:
+            requests.delete(f"{BASE_URL}/api/clients/{created.json()['id']}", headers=auth_headers)
+
+    def test_import_missing_columns(self, auth_headers):
+        files = {"file": ("clientes.csv", b"nome;telefone\nX;1\n", "text/csv")}
+        response = requests.post(f"{BASE_URL}/api/clients/import", files=files, headers=auth_headers)
+        assert response.status_code == 400
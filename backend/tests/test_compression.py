@@ -0,0 +1,113 @@
+"""
+Test suite for response compression (CompressionMiddleware)
+Runs the app in-process (httpx ASGITransport) against /metrics, which needs no Mongo
+"""
+import asyncio
+import os
+import sys
+import zlib
+from pathlib import Path
+
+import httpx
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+# server.py needs these at import time; nothing here talks to Mongo
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "agrolink_test")
+import server  # noqa: E402
+
+
+async def get_metrics(accept_encoding):
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+        return await http.get("/metrics", headers={"Accept-Encoding": accept_encoding})
+
+
+@pytest.mark.parametrize("accept_encoding,expected", [
+    ("gzip, deflate", "gzip"),
+    ("br;q=0, gzip", "gzip"),
+    ("identity", None),
+    ("", None),
+])
+def test_negotiation(accept_encoding, expected):
+    response = asyncio.run(get_metrics(accept_encoding))
+    assert response.status_code == 200
+    assert response.headers.get("content-encoding") == expected
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert "agrolink_http_requests_total" in response.text
+
+
+@pytest.mark.skipif(server.brotli is None, reason="brotli not installed")
+def test_brotli_preferred():
+    response = asyncio.run(get_metrics("gzip, br"))
+    assert response.headers["content-encoding"] == "br"
+    assert "agrolink_compression_bytes_total" in response.text
+
+
+def test_stream_chunks_decode_as_they_arrive():
+    """Each compressed chunk is flushed, so NDJSON progress is not held back"""
+    compressor = server.StreamCompressor("gzip")
+    decompressor = zlib.decompressobj(31)
+    assert decompressor.decompress(compressor.compress(b'{"linha": 1}\n', final=False)) == b'{"linha": 1}\n'
+    assert decompressor.decompress(compressor.compress(b'{"linha": 2}\n', final=True)) == b'{"linha": 2}\n'
+
+
+def test_downloads_are_not_compressed(tmp_path):
+    """file_response serves byte ranges of the stored bytes, so its body is never re-encoded"""
+    from starlette.applications import Starlette
+    from starlette.routing import Route
+
+    document = tmp_path / "NOTA.XML"
+    document.write_bytes(b"<nota>" + b"<item>1</item>" * 500 + b"</nota>")
+
+    def download(request):
+        return server.file_response(request, document, document.stat(), etag='"abc"', filename="NOTA.XML")
+
+    app = server.CompressionMiddleware(Starlette(routes=[Route("/nota", download)]))
+
+    async def get(headers):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            return await http.get("/nota", headers={"Accept-Encoding": "gzip", **headers})
+
+    full = asyncio.run(get({}))
+    assert full.status_code == 200
+    assert "content-encoding" not in full.headers
+    assert full.headers["etag"] == '"abc"'
+    assert full.content == document.read_bytes()
+
+    resumed = asyncio.run(get({"Range": "bytes=100-", "If-Range": '"abc"'}))
+    assert resumed.status_code == 206
+    assert full.content[:100] + resumed.content == full.content
+
+
+@pytest.mark.parametrize("accept_encoding,expected", [("gzip", "gzip"), ("br, gzip", "br" if server.brotli else "gzip")])
+def test_csv_export_is_compressed(accept_encoding, expected):
+    """Exports are attachments (Content-Disposition) but generated text, not stored documents"""
+    from starlette.applications import Starlette
+    from starlette.routing import Route
+
+    linhas = [b"id,nome\n"] + [f"{i},CLIENTE {i}\n".encode() for i in range(2000)]
+
+    def export(request):
+        async def stream():
+            for linha in linhas:
+                yield linha
+        return server.StreamingResponse(
+            stream(), media_type="text/csv; charset=utf-8",
+            headers={"Content-Disposition": 'attachment; filename="clients.csv"'}
+        )
+
+    app = server.CompressionMiddleware(Starlette(routes=[Route("/export/clients", export)]))
+
+    async def get():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            return await http.get("/export/clients", headers={"Accept-Encoding": accept_encoding})
+
+    response = asyncio.run(get())
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == expected
+    assert "attachment" in response.headers["content-disposition"]
+    assert response.content == b"".join(linhas)
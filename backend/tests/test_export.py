@@ -0,0 +1,58 @@
+"""
+Test suite for streaming exports - GET /api/export/{collection}
+"""
+import pytest
+import requests
+import csv
+import io
+import json
+
+from live_api import BASE_URL
+
+
+class TestExport:
+    """NDJSON and CSV exports match the list endpoints"""
+
+    @pytest.mark.parametrize("collection", ["clients", "projects", "propostas"])
+    def test_export_ndjson(self, auth_headers, collection):
+        response = requests.get(f"{BASE_URL}/api/export/{collection}", headers=auth_headers, stream=True)
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        assert "attachment" in response.headers["content-disposition"]
+        rows = [json.loads(line) for line in response.iter_lines() if line]
+        for row in rows:
+            assert "id" in row
+            assert "_id" not in row
+
+    def test_export_clients_matches_list(self, auth_headers):
+        listed = requests.get(f"{BASE_URL}/api/clients", headers=auth_headers).json()
+        response = requests.get(f"{BASE_URL}/api/export/clients", headers=auth_headers)
+        exported = [json.loads(line) for line in response.text.splitlines() if line]
+        if len(listed) < 1000:
+            assert {c["id"] for c in exported} == {c["id"] for c in listed}
+
+    def test_export_projects_same_filters(self, auth_headers):
+        params = {"status": "em_andamento", "pendencia": "true"}
+        listed = requests.get(f"{BASE_URL}/api/projects", params=params, headers=auth_headers).json()
+        response = requests.get(f"{BASE_URL}/api/export/projects", params=params, headers=auth_headers)
+        exported = [json.loads(line) for line in response.text.splitlines() if line]
+        assert {p["id"] for p in exported} == {p["id"] for p in listed}
+        for p in exported:
+            assert p["tem_pendencia"] is True
+            assert "cliente_nome" in p
+
+    def test_export_csv(self, auth_headers):
+        response = requests.get(f"{BASE_URL}/api/export/propostas", params={"formato": "csv"}, headers=auth_headers)
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/csv")
+        reader = csv.DictReader(io.StringIO(response.content.decode("utf-8-sig")), delimiter=";")
+        assert "cliente_nome" in reader.fieldnames
+        assert "dias_aberta" in reader.fieldnames
+
+    def test_export_unknown_collection(self, auth_headers):
+        response = requests.get(f"{BASE_URL}/api/export/users", headers=auth_headers)
+        assert response.status_code == 404
+
+    def test_export_invalid_format(self, auth_headers):
+        response = requests.get(f"{BASE_URL}/api/export/clients", params={"formato": "xml"}, headers=auth_headers)
+        assert response.status_code == 400
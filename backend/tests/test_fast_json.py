@@ -0,0 +1,55 @@
+"""
+Test suite for trusted list responses (trusted_list_response)
+The fast path must produce what response_model would have produced for the same rows
+"""
+import json
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+# server.py needs these at import time; nothing here talks to Mongo
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "agrolink_test")
+import server  # noqa: E402
+
+
+def assert_same_as_model(model, rows):
+    body = json.loads(server.trusted_list_response(model, rows).body)
+    assert body == [model(**row).model_dump() for row in rows]
+
+
+def test_projeto_defaults_and_nested_models():
+    """Missing nested fields get the model defaults; unknown keys are dropped"""
+    assert_same_as_model(server.ProjetoResponse, [{
+        "id": "p1",
+        "cliente_id": "c1",
+        "etapa_atual_id": "e1",
+        "etapa_atual_nome": "Coleta de Documentos",
+        "documentos_check": {"car": True},
+        "historico_etapas": [{
+            "etapa_id": "e1",
+            "etapa_nome": "Coleta de Documentos",
+            "data_inicio": "2025-01-01T00:00:00+00:00",
+            "pendencias": [{"descricao": "Falta CCU"}],
+        }],
+        "data_inicio": "2025-01-01T00:00:00+00:00",
+        "valor_credito": 1000.0,
+        "cliente_nome": "Fulano",
+        "cliente_cpf": "52998224725",
+        "created_at": "2025-01-01T00:00:00+00:00",
+        "campo_interno": "não vai para a resposta",
+    }])
+
+
+def test_client_and_proposta():
+    assert_same_as_model(server.ClientResponse, [{
+        "id": "c1", "nome_completo": "Fulano", "cpf": "52998224725", "telefone": "67999990000",
+        "created_at": "2025-01-01T00:00:00+00:00", "tem_projeto_ativo": True, "qtd_alertas": None,
+    }])
+    assert_same_as_model(server.PropostaResponse, [{
+        "id": "p1", "cliente_id": "c1", "tipo_projeto_id": "t1", "instituicao_financeira_id": "i1",
+        "valor_credito": 2500.5, "cliente_nome": "Fulano", "cliente_cpf": "52998224725",
+        "tipo_projeto_nome": "PRONAF A", "instituicao_financeira_nome": "Banco do Brasil",
+        "created_at": "2025-01-01T00:00:00+00:00", "dias_aberta": 3,
+    }])
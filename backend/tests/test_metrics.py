@@ -0,0 +1,140 @@
+"""
+Test suite for the request metrics middleware and GET /metrics
+Runs the app in-process (httpx ASGITransport); only routes that do not touch Mongo are called
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+# server.py needs these at import time; nothing here talks to Mongo
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "agrolink_test")
+import server  # noqa: E402
+
+
+async def get(*paths):
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+        return [await http.get(path) for path in paths]
+
+
+def test_histogram_buckets():
+    histogram = server.Histogram((0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value)
+    lines = histogram.render("x", 'route="/a"')
+    assert 'x_bucket{route="/a",le="0.1"} 2' in lines
+    assert 'x_bucket{route="/a",le="1.0"} 3' in lines
+    assert 'x_bucket{route="/a",le="+Inf"} 4' in lines
+    assert 'x_count{route="/a"} 4' in lines
+
+
+def test_metrics_endpoint_records_routes():
+    responses = asyncio.run(get("/api/nao-existe", "/api/nao-existe", "/metrics"))
+    assert responses[0].status_code == 404
+    body = responses[2].text
+    assert responses[2].headers["content-type"].startswith("text/plain")
+    assert 'agrolink_http_requests_total{method="GET",route="unmatched",status="404"}' in body
+    assert "agrolink_http_requests_in_flight 1" in body
+    assert "agrolink_mongo_pool_max_size 100" in body
+
+    def count(body, series):
+        line = next(line for line in body.splitlines() if line.startswith(series))
+        return int(line.rsplit(" ", 1)[1])
+
+    series = 'agrolink_http_requests_total{method="GET",route="/metrics",status="200"}'
+    before = count(body, series) if series in body else 0
+    body = asyncio.run(get("/metrics"))[0].text
+    # Labelled by the route template, not the raw path
+    assert count(body, series) == before + 1
+    assert count(body, 'agrolink_http_response_size_bytes_count{method="GET",route="/metrics"}') == before + 1
+
+
+def test_query_shape_drops_values():
+    shape = server.query_shape({"cliente_id": "abc", "status": {"$in": ["a", "b"]}, "$or": [{"cpf": "1"}]})
+    assert shape == {"cliente_id": "?", "status": {"$in": "?"}, "$or": [{"cpf": "?"}]}
+    pipeline = server.query_shape([
+        {"$match": {"id": "x"}},
+        {"$lookup": {"from": "clients", "localField": "cliente_id", "foreignField": "id", "as": "cliente"}},
+        {"$group": {"_id": "$status", "total": {"$sum": 1}}},
+    ])
+    assert pipeline[1]["$lookup"]["from"] == "clients"
+    assert pipeline[2]["$group"] == {"_id": "$status", "total": {"$sum": "?"}}
+
+
+def test_summarize_explain_find_and_aggregate():
+    find = {
+        "queryPlanner": {
+            "winningPlan": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": "cpf_1"}},
+            "rejectedPlans": [{"stage": "COLLSCAN"}],
+        },
+        "executionStats": {"nReturned": 1, "totalDocsExamined": 1, "totalKeysExamined": 1},
+    }
+    summary = server.summarize_explain(find)
+    assert summary["indexes"] == ["cpf_1"]
+    assert summary["collscan"] is False
+
+    aggregate = {"stages": [{"$cursor": {
+        "queryPlanner": {"winningPlan": {"stage": "COLLSCAN"}},
+        "executionStats": {"nReturned": 5, "totalDocsExamined": 900, "totalKeysExamined": 0},
+    }}]}
+    summary = server.summarize_explain(aggregate)
+    assert summary["collscan"] is True
+    assert summary["docs_examined"] == 900
+
+
+def test_request_sampler_sees_awaits_and_cpu():
+    """Suspended time is attributed to the awaiting frame, CPU time to the running one"""
+    def busy(seconds):
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            pass
+
+    async def handler():
+        await asyncio.sleep(0.05)
+        busy(0.05)
+
+    async def root():
+        with server.RequestSampler(asyncio.current_task(), root.__code__) as sampler:
+            await handler()
+        return sampler
+
+    sampler = asyncio.run(root())
+    assert len(sampler.samples) > sampler.failed_samples
+    collapsed = dict(line.rsplit(" ", 1) for line in sampler.collapsed().decode().splitlines())
+    assert any(stack.startswith("test_request_sampler_sees_awaits_and_cpu.<locals>.handler;sleep;await") for stack in collapsed)
+    assert any(stack.endswith("handler;test_request_sampler_sees_awaits_and_cpu.<locals>.busy") for stack in collapsed)
+    profile = json.loads(sampler.speedscope("test"))
+    assert profile["profiles"][0]["type"] == "sampled"
+    assert len(profile["profiles"][0]["samples"]) == len(profile["profiles"][0]["weights"])
+
+
+def test_trace_spans_follow_awaits():
+    """Spans opened in gathered tasks hang off the span that was current when they started"""
+    async def step(name):
+        with server.trace_span(name):
+            await asyncio.sleep(0.01)
+
+    async def root():
+        trace = server.Trace()
+        trace.root = server.Span(trace, None, "GET /teste", {})
+        token = server.current_span.set(trace.root)
+        with server.trace_span("handler") as handler:
+            await asyncio.gather(step("a"), step("b"))
+        server.current_span.reset(token)
+        trace.root.finish()
+        return trace, handler
+
+    trace, handler = asyncio.run(root())
+    data = trace.to_dict()
+    spans = {span["nome"]: span for span in data["spans"]}
+    assert spans["a"]["parent_id"] == handler.span_id
+    assert spans["b"]["profundidade"] == 2
+    assert "GET /teste" in server.trace_waterfall(data)
+    assert server.current_span.get() is None
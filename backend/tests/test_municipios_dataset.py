@@ -0,0 +1,42 @@
+"""
+Test suite for the municipality dataset shipped with the backend (data/municipios.json.gz)
+Regenerate it with data/update_municipios.py
+"""
+import os
+import sys
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+# server.py needs these at import time; nothing here talks to Mongo
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "agrolink_test")
+import server  # noqa: E402
+
+pytestmark = pytest.mark.skipif(
+    not server.MUNICIPIOS_DATASET.exists(),
+    reason="data/municipios.json.gz not generated: run data/update_municipios.py and commit it",
+)
+
+
+@pytest.fixture(scope="module")
+def dataset():
+    return server._read_municipios_file(server.MUNICIPIOS_DATASET)
+
+
+def test_dataset_is_complete(dataset):
+    municipios = dataset["municipios"]
+    assert len(municipios) >= server.MUNICIPIOS_MIN_COUNT
+    assert len({m["id"] for m in municipios}) == len(municipios)
+    assert {m["uf"] for m in municipios} == {e["sigla"] for e in server.ESTADOS_BRASIL}
+    assert datetime.fromisoformat(dataset["atualizado_em"]).tzinfo is not None
+
+
+def test_search_index_from_dataset(dataset):
+    """The 042 autocomplete index builds from the shipped copy alone"""
+    cache = server.MunicipiosCache()
+    cache._install(dataset)
+    nomes = [m["nome"] for m in cache.search("campo grande", "MS", 5)]
+    assert "Campo Grande" in nomes
@@ -0,0 +1,144 @@
+"""
+Test suite for bulk proposta intake - POST /api/propostas/bulk
+Covers JSON and CSV payloads, tipo/instituição resolution by name and per-row errors
+"""
+import pytest
+import requests
+
+from live_api import BASE_URL, random_cpf
+
+
+@pytest.fixture(scope="module")
+def tipo(auth_headers):
+    response = requests.get(f"{BASE_URL}/api/tipos-projeto", headers=auth_headers)
+    assert response.status_code == 200
+    return response.json()[0]
+
+
+@pytest.fixture(scope="module")
+def instituicao(auth_headers):
+    response = requests.get(f"{BASE_URL}/api/instituicoes-financeiras", headers=auth_headers)
+    assert response.status_code == 200
+    return response.json()[0]
+
+
+def cleanup(auth_headers, data):
+    for row in data["resultados"]:
+        if row["status"] == "criada":
+            requests.delete(f"{BASE_URL}/api/propostas/{row['proposta_id']}", headers=auth_headers)
+            requests.delete(f"{BASE_URL}/api/clients/{row['cliente_id']}", headers=auth_headers)
+
+
+class TestPropostasBulkJSON:
+    """Bulk intake with a JSON array"""
+
+    def test_bulk_json_mixed_rows(self, auth_headers, tipo, instituicao):
+        """Valid rows are created, invalid rows are reported with their line number"""
+        payload = [
+            {
+                "nome_completo": "TEST_BULK_A",
+                "cpf": random_cpf(),
+                "telefone": "11999990001",
+                "tipo_projeto": tipo["nome"].lower(),
+                "instituicao_financeira": instituicao["nome"],
+                "valor_credito": "150.000,00"
+            },
+            {
+                "nome_completo": "TEST_BULK_B",
+                "cpf": random_cpf(),
+                "telefone": "11999990002",
+                "tipo_projeto_id": tipo["id"],
+                "instituicao_financeira_id": instituicao["id"],
+                "valor_credito": 50000
+            },
+            {
+                "nome_completo": "TEST_BULK_INVALID",
+                "cpf": "123",
+                "telefone": "11999990003",
+                "tipo_projeto": tipo["nome"],
+                "instituicao_financeira": instituicao["nome"],
+                "valor_credito": 1000
+            },
+            {
+                "nome_completo": "TEST_BULK_NO_TIPO",
+                "cpf": random_cpf(),
+                "telefone": "11999990004",
+                "tipo_projeto": "TIPO_INEXISTENTE",
+                "instituicao_financeira": instituicao["nome"],
+                "valor_credito": 1000
+            },
+        ]
+        response = requests.post(f"{BASE_URL}/api/propostas/bulk", json=payload, headers=auth_headers)
+        assert response.status_code == 200, response.text
+        data = response.json()
+        try:
+            assert data["total"] == 4
+            assert data["criadas"] == 2
+            assert data["erros"] == 2
+            resultados = data["resultados"]
+            assert [r["linha"] for r in resultados] == [1, 2, 3, 4]
+            assert resultados[0]["status"] == "criada"
+            assert resultados[2]["erro"] == "CPF inválido"
+            assert resultados[3]["erro"] == "Tipo de projeto não encontrado"
+
+            proposta = requests.get(
+                f"{BASE_URL}/api/propostas/{resultados[0]['proposta_id']}", headers=auth_headers
+            ).json()
+            assert proposta["valor_credito"] == 150000.0
+            assert proposta["tipo_projeto_id"] == tipo["id"]
+            assert proposta["cliente_nome"] == "TEST_BULK_A"
+        finally:
+            cleanup(auth_headers, data)
+
+    def test_bulk_same_cpf_reuses_client(self, auth_headers, tipo, instituicao):
+        """Two rows with the same CPF create one client and two propostas"""
+        cpf = random_cpf()
+        row = {
+            "nome_completo": "TEST_BULK_SAME",
+            "cpf": cpf,
+            "telefone": "11999990005",
+            "tipo_projeto": tipo["nome"],
+            "instituicao_financeira": instituicao["nome"],
+            "valor_credito": 1000
+        }
+        response = requests.post(f"{BASE_URL}/api/propostas/bulk", json={"propostas": [row, row]}, headers=auth_headers)
+        assert response.status_code == 200, response.text
+        data = response.json()
+        try:
+            assert data["criadas"] == 2
+            ids = {r["cliente_id"] for r in data["resultados"]}
+            assert len(ids) == 1
+        finally:
+            cleanup(auth_headers, data)
+
+    def test_bulk_empty_payload(self, auth_headers):
+        response = requests.post(f"{BASE_URL}/api/propostas/bulk", json=[], headers=auth_headers)
+        assert response.status_code == 400
+
+
+class TestPropostasBulkCSV:
+    """Bulk intake with a CSV upload"""
+
+    def test_bulk_csv_semicolon(self, auth_headers, tipo, instituicao):
+        """pt-BR spreadsheet export: ';' separator and decimal comma"""
+        csv_content = (
+            "nome_completo;cpf;telefone;tipo_projeto;instituicao_financeira;valor_credito\n"
+            f"TEST_BULK_CSV;{random_cpf()};11999990006;{tipo['nome']};{instituicao['nome']};2.500,50\n"
+        )
+        files = {"file": ("leads.csv", csv_content.encode("utf-8"), "text/csv")}
+        response = requests.post(f"{BASE_URL}/api/propostas/bulk", files=files, headers=auth_headers)
+        assert response.status_code == 200, response.text
+        data = response.json()
+        try:
+            assert data["criadas"] == 1
+            assert data["resultados"][0]["status"] == "criada"
+        finally:
+            cleanup(auth_headers, data)
+
+    def test_bulk_csv_too_large(self, auth_headers):
+        """The upload is refused while streaming, before the whole file is read"""
+        csv_content = b"nome_completo;cpf;telefone\n" + b"X;1;2\n" * (2 * 1024 * 1024)
+        files = {"file": ("leads.csv", csv_content, "text/csv")}
+        response = requests.post(f"{BASE_URL}/api/propostas/bulk", files=files, headers=auth_headers)
+        assert response.status_code == 400
+        assert response.json()["detail"] == "Arquivo excede o limite de 10MB"
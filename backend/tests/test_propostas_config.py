@@ -200,6 +200,36 @@ class TestEstadosCidades:
         assert isinstance(data, list)
         assert len(data) > 50, "MS should have many cities"
         print(f"Found {len(data)} cities in MS")
+    
+    def test_list_cidades_cached(self, auth_headers):
+        """Cities are served from memory, case-insensitive UF, cacheable by the browser"""
+        response = requests.get(f"{BASE_URL}/api/cidades/ms", headers=auth_headers)
+        assert response.status_code == 200
+        assert "max-age" in response.headers.get("Cache-Control", "")
+        nomes = [c["nome"] for c in response.json()]
+        assert "Campo Grande" in nomes
+        
+        response = requests.get(f"{BASE_URL}/api/cidades/XX", headers=auth_headers)
+        assert response.status_code == 200
+        assert response.json() == []
+    
+    def test_search_cidades(self, auth_headers):
+        """Autocomplete by prefix of the name or of a later word, accent-insensitive"""
+        response = requests.get(f"{BASE_URL}/api/cidades/search", params={"q": "campo gr", "uf": "ms"}, headers=auth_headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert data[0]["nome"] == "Campo Grande"
+        assert data[0]["uf"] == "MS"
+        
+        response = requests.get(f"{BASE_URL}/api/cidades/search", params={"q": "sao paulo", "limit": 5}, headers=auth_headers)
+        assert "São Paulo" in [c["nome"] for c in response.json()]
+        assert len(response.json()) <= 5
+        
+        response = requests.get(f"{BASE_URL}/api/cidades/search", params={"q": "grande", "uf": "MS"}, headers=auth_headers)
+        assert "Campo Grande" in [c["nome"] for c in response.json()]
+        
+        response = requests.get(f"{BASE_URL}/api/cidades/search", params={"q": ""}, headers=auth_headers)
+        assert response.status_code == 422
 
 
 class TestPropostas:
@@ -263,7 +293,7 @@ class TestPropostas:
         
         proposta_data = {
             "nome_completo": "TEST_CLIENTE PROPOSTA",
-            "cpf": "12345678901",
+            "cpf": "12345678909",
             "telefone": "67999999999",
             "tipo_projeto_id": tipo_projeto_id,
             "instituicao_financeira_id": instituicao_id,
@@ -66,7 +66,7 @@ def existing_client_id(auth_headers):
     # Create a test client if none exists
     new_client = {
         "nome_completo": "TEST_EXISTING_CLIENT",
-        "cpf": "99988877766",
+        "cpf": "52998224725",
         "telefone": "11999887766"
     }
     response = requests.post(f"{BASE_URL}/api/clients", json=new_client, headers=auth_headers)
@@ -153,9 +153,13 @@ class TestFlow2NewClient:
     
     def test_create_proposta_with_new_client(self, auth_headers, tipo_projeto_id, instituicao_id):
         """Test POST /api/propostas with new client data (nome, cpf, telefone)"""
-        # Generate a valid 11-digit CPF
+        # Generate a CPF with valid check digits
         import random
-        unique_cpf = ''.join([str(random.randint(0, 9)) for _ in range(11)])
+        digits = [random.randint(0, 9) for _ in range(9)]
+        for size in (9, 10):
+            total = sum(d * w for d, w in zip(digits, range(size + 1, 1, -1)))
+            digits.append((total * 10 % 11) % 10)
+        unique_cpf = ''.join(str(d) for d in digits)
         
         payload = {
             "nome_completo": "TEST_NEW_CLIENT_API",
@@ -0,0 +1,66 @@
+"""
+Query budgets per endpoint - each request may issue at most a fixed number of
+Mongo commands regardless of how many rows exist (see query_budget.py).
+Authentication costs one command (users.find_one). Endpoints that still look
+up the client once per row are marked xfail until they are rewritten.
+"""
+import pytest
+import requests
+
+from live_api import BASE_URL, random_cpf
+from query_budget import assert_query_budget, mongo_commands
+
+N_PLUS_ONE = pytest.mark.xfail(reason="one clients/projects lookup per row (N+1)", strict=False)
+
+
+@pytest.fixture(scope="module")
+def seeded_clients(auth_headers):
+    """A few clients so per-row lookups show up in the command count"""
+    ids = []
+    for i in range(5):
+        response = requests.post(f"{BASE_URL}/api/clients", json={
+            "nome_completo": f"TEST_BUDGET_{i}",
+            "cpf": random_cpf(),
+            "telefone": "11999990000"
+        }, headers=auth_headers)
+        assert response.status_code == 200, response.text
+        ids.append(response.json()["id"])
+    yield ids
+    for client_id in ids:
+        requests.delete(f"{BASE_URL}/api/clients/{client_id}", headers=auth_headers)
+
+
+class TestServerTiming:
+    def test_header_reports_commands(self, auth_headers):
+        response = requests.get(f"{BASE_URL}/api/auth/me", headers=auth_headers)
+        assert response.status_code == 200
+        assert mongo_commands(response) == 1
+
+
+class TestQueryBudgets:
+    @pytest.mark.parametrize("path,budget", [
+        ("/api/etapas", 2),
+        ("/api/instituicoes-financeiras", 2),
+        ("/api/tipos-projeto", 2),
+    ])
+    def test_constant_endpoints(self, auth_headers, seeded_clients, path, budget):
+        response = requests.get(f"{BASE_URL}{path}", headers=auth_headers)
+        assert_query_budget(response, budget)
+
+    def test_get_client(self, auth_headers, seeded_clients):
+        response = requests.get(f"{BASE_URL}/api/clients/{seeded_clients[0]}", headers=auth_headers)
+        assert_query_budget(response, 3)
+
+    @N_PLUS_ONE
+    @pytest.mark.parametrize("path", [
+        "/api/clients",
+        "/api/projects",
+        "/api/propostas",
+        "/api/reports/summary",
+        "/api/dashboard/stats",
+        "/api/alerts/all",
+        "/api/alerts/propostas",
+    ])
+    def test_list_endpoints(self, auth_headers, seeded_clients, path):
+        response = requests.get(f"{BASE_URL}{path}", headers=auth_headers)
+        assert_query_budget(response, 5)
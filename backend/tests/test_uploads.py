@@ -0,0 +1,341 @@
+"""
+Test suite for client document uploads and downloads - /api/upload, /api/files
+"""
+import pytest
+import requests
+import os
+
+from live_api import BASE_URL, random_cpf
+
+MAX_FILE_SIZE = 10 * 1024 * 1024
+
+
+@pytest.fixture(scope="module")
+def client_id(auth_headers):
+    """Create a throwaway client for the upload tests"""
+    response = requests.post(f"{BASE_URL}/api/clients", json={
+        "nome_completo": "TEST_UPLOADS",
+        "cpf": random_cpf(),
+        "telefone": "67999990000"
+    }, headers=auth_headers)
+    assert response.status_code == 200, response.text
+    yield response.json()["id"]
+    requests.delete(f"{BASE_URL}/api/clients/{response.json()['id']}", headers=auth_headers)
+
+
+class TestUpload:
+    """Streaming uploads"""
+
+    def test_upload_and_download(self, auth_headers, client_id):
+        content = os.urandom(256 * 1024)
+        files = {"file": ("rg_frente.pdf", content, "application/pdf")}
+        response = requests.post(f"{BASE_URL}/api/upload/{client_id}", files=files, headers=auth_headers)
+        assert response.status_code == 200, response.text
+        assert response.json()["filename"] == "RG_FRENTE.PDF"
+
+        listed = requests.get(f"{BASE_URL}/api/files/{client_id}", headers=auth_headers).json()["files"]
+        entry = next(f for f in listed if f["name"] == "RG_FRENTE.PDF")
+        assert entry["size"] == len(content)
+        assert not any(f["name"].startswith(".") for f in listed)
+
+        download = requests.get(f"{BASE_URL}/api/files/{client_id}/RG_FRENTE.PDF", headers=auth_headers)
+        assert download.status_code == 200
+        assert download.content == content
+
+    def test_upload_too_large_is_rejected(self, auth_headers, client_id):
+        files = {"file": ("grande.pdf", b"0" * (MAX_FILE_SIZE + 1), "application/pdf")}
+        response = requests.post(f"{BASE_URL}/api/upload/{client_id}", files=files, headers=auth_headers)
+        assert response.status_code == 400
+        assert response.json()["detail"] == "Arquivo excede o limite de 10MB"
+
+        listed = requests.get(f"{BASE_URL}/api/files/{client_id}", headers=auth_headers).json()["files"]
+        assert "GRANDE.PDF" not in [f["name"] for f in listed]
+
+    def test_upload_without_file(self, auth_headers, client_id):
+        response = requests.post(f"{BASE_URL}/api/upload/{client_id}", files={"outro": ("x.txt", b"x")}, headers=auth_headers)
+        assert response.status_code == 400
+
+    def test_upload_unknown_client(self, auth_headers):
+        files = {"file": ("x.pdf", b"x", "application/pdf")}
+        response = requests.post(f"{BASE_URL}/api/upload/cliente-inexistente", files=files, headers=auth_headers)
+        assert response.status_code == 404
+
+    @pytest.mark.parametrize("path", [".cache/municipios.json.gz", ".profiles/indice.json"])
+    def test_unindexed_files_are_not_served(self, auth_headers, path):
+        """Only documents in the files index are downloadable, not server files under UPLOAD_DIR"""
+        response = requests.get(f"{BASE_URL}/api/files/{path}", headers=auth_headers)
+        assert response.status_code == 404
+
+    @pytest.mark.parametrize("filename", ["..", ".", "pasta/..", "pasta/"])
+    def test_upload_invalid_name(self, auth_headers, client_id, filename):
+        files = {"file": (filename, b"x", "application/pdf")}
+        response = requests.post(f"{BASE_URL}/api/upload/{client_id}", files=files, headers=auth_headers)
+        assert response.status_code == 400
+        assert response.json()["detail"] == "Nome de arquivo inválido"
+
+
+class TestDeduplicatedStore:
+    """Identical documents are stored once and survive the deletion of other references"""
+
+    def test_same_content_twice(self, auth_headers, client_id):
+        content = os.urandom(64 * 1024)
+        first = requests.post(f"{BASE_URL}/api/upload/{client_id}",
+                              files={"file": ("car.pdf", content)}, headers=auth_headers)
+        second = requests.post(f"{BASE_URL}/api/upload/{client_id}",
+                               files={"file": ("car_copia.pdf", content)}, headers=auth_headers)
+        assert first.status_code == 200 and second.status_code == 200
+        assert first.json()["sha256"] == second.json()["sha256"]
+
+        # Removing one reference must keep the other readable
+        requests.delete(f"{BASE_URL}/api/files/{client_id}/CAR.PDF", headers=auth_headers)
+        download = requests.get(f"{BASE_URL}/api/files/{client_id}/CAR_COPIA.PDF", headers=auth_headers)
+        assert download.status_code == 200
+        assert download.content == content
+
+    def test_known_hash_header(self, auth_headers, client_id):
+        import hashlib
+        content = os.urandom(32 * 1024)
+        digest = hashlib.sha256(content).hexdigest()
+        headers = {**auth_headers, "X-Content-SHA256": digest}
+        for name in ("ccu_1.pdf", "ccu_2.pdf"):
+            response = requests.post(f"{BASE_URL}/api/upload/{client_id}",
+                                     files={"file": (name, content)}, headers=headers)
+            assert response.status_code == 200, response.text
+            assert response.json()["sha256"] == digest
+
+    def test_wrong_hash_header_is_rejected(self, auth_headers, client_id):
+        headers = {**auth_headers, "X-Content-SHA256": "0" * 64}
+        response = requests.post(f"{BASE_URL}/api/upload/{client_id}",
+                                 files={"file": ("x.pdf", b"conteudo")}, headers=headers)
+        assert response.status_code == 400
+
+
+class TestDocumentIndex:
+    """Document metadata served from the files collection"""
+
+    def test_listing_has_metadata(self, auth_headers, client_id):
+        files = {"file": ("car.pdf", b"%PDF-1.4 car", "application/pdf")}
+        response = requests.post(f"{BASE_URL}/api/upload/{client_id}", files=files, headers=auth_headers)
+        assert response.status_code == 200, response.text
+
+        listed = requests.get(f"{BASE_URL}/api/files/{client_id}", headers=auth_headers).json()["files"]
+        entry = next(f for f in listed if f["name"] == "CAR.PDF")
+        assert entry["mime_type"] == "application/pdf"
+        assert entry["uploaded_by_nome"]
+        assert entry["hash"] == response.json()["sha256"]
+
+    def test_search_across_clients(self, auth_headers, client_id):
+        files = {"file": ("matricula.pdf", b"%PDF-1.4 matricula", "application/pdf")}
+        requests.post(f"{BASE_URL}/api/upload/{client_id}", files=files, headers=auth_headers)
+
+        response = requests.get(f"{BASE_URL}/api/documents", params={"nome": "matricula", "client_id": client_id}, headers=auth_headers)
+        assert response.status_code == 200
+        documents = response.json()["documents"]
+        assert [d["name"] for d in documents] == ["MATRICULA.PDF"]
+        assert documents[0]["cliente_nome"] == "TEST_UPLOADS"
+
+    def test_missing_document(self, auth_headers):
+        response = requests.get(f"{BASE_URL}/api/documents/missing", params={"nome": "CONTRATO"}, headers=auth_headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["total"] == len(data["projetos"])
+
+
+class TestConditionalDownload:
+    """ETag / 304 and Range support on document downloads"""
+
+    def test_etag_and_range(self, auth_headers, client_id):
+        content = os.urandom(100 * 1024)
+        files = {"file": ("laudo.pdf", content, "application/pdf")}
+        sha256 = requests.post(f"{BASE_URL}/api/upload/{client_id}", files=files, headers=auth_headers).json()["sha256"]
+        url = f"{BASE_URL}/api/files/{client_id}/LAUDO.PDF"
+
+        response = requests.get(url, headers=auth_headers)
+        assert response.status_code == 200
+        assert response.headers["ETag"] == f'"{sha256}"'
+        assert response.headers["Accept-Ranges"] == "bytes"
+
+        response = requests.get(url, headers={**auth_headers, "If-None-Match": f'"{sha256}"'})
+        assert response.status_code == 304
+
+        response = requests.get(url, headers={**auth_headers, "Range": "bytes=1000-1999"})
+        assert response.status_code == 206
+        assert response.content == content[1000:2000]
+        assert response.headers["Content-Range"] == f"bytes 1000-1999/{len(content)}"
+
+        response = requests.get(url, headers={**auth_headers, "Range": f"bytes={len(content)}-"})
+        assert response.status_code == 416
+
+
+class TestResumableUpload:
+    """Chunked upload sessions - /api/upload/{client_id}/sessions, /api/upload-sessions"""
+
+    CHUNK = 64 * 1024
+
+    def test_out_of_order_chunks_and_resume(self, auth_headers, client_id):
+        import hashlib
+        content = os.urandom(3 * self.CHUNK + 100)
+        response = requests.post(f"{BASE_URL}/api/upload/{client_id}/sessions", json={
+            "filename": "escritura.pdf",
+            "size": len(content),
+            "sha256": hashlib.sha256(content).hexdigest(),
+            "chunk_size": self.CHUNK
+        }, headers=auth_headers)
+        assert response.status_code == 200, response.text
+        session = response.json()
+        assert session["total_chunks"] == 4
+        url = f"{BASE_URL}/api/upload-sessions/{session['id']}"
+
+        for index in (3, 0, 2):
+            offset = index * self.CHUNK
+            response = requests.put(url, params={"offset": offset}, data=content[offset:offset + self.CHUNK], headers=auth_headers)
+            assert response.status_code == 200, response.text
+
+        # The connection "dropped": ask what is missing, finalizing now is refused
+        status = requests.get(url, headers=auth_headers).json()
+        assert status["missing_chunks"] == [1]
+        assert status["offset"] == self.CHUNK
+        assert requests.post(f"{url}/complete", headers=auth_headers).status_code == 409
+
+        response = requests.put(url, params={"offset": self.CHUNK}, data=content[self.CHUNK:2 * self.CHUNK], headers=auth_headers)
+        assert response.status_code == 200
+        response = requests.post(f"{url}/complete", headers=auth_headers)
+        assert response.status_code == 200, response.text
+        assert response.json()["filename"] == "ESCRITURA.PDF"
+
+        download = requests.get(f"{BASE_URL}/api/files/{client_id}/ESCRITURA.PDF", headers=auth_headers)
+        assert download.content == content
+        assert requests.get(url, headers=auth_headers).status_code == 404
+
+    def test_wrong_chunk_length(self, auth_headers, client_id):
+        session = requests.post(f"{BASE_URL}/api/upload/{client_id}/sessions", json={
+            "filename": "x.pdf", "size": 2 * self.CHUNK, "chunk_size": self.CHUNK
+        }, headers=auth_headers).json()
+        url = f"{BASE_URL}/api/upload-sessions/{session['id']}"
+        try:
+            response = requests.put(url, params={"offset": 0}, data=b"short", headers=auth_headers)
+            assert response.status_code == 400
+            response = requests.put(url, params={"offset": 10}, data=b"x" * self.CHUNK, headers=auth_headers)
+            assert response.status_code == 400
+        finally:
+            requests.delete(url, headers=auth_headers)
+
+    def test_session_too_large(self, auth_headers, client_id):
+        response = requests.post(f"{BASE_URL}/api/upload/{client_id}/sessions", json={
+            "filename": "big.pdf", "size": MAX_FILE_SIZE + 1
+        }, headers=auth_headers)
+        assert response.status_code == 400
+
+
+class TestBundle:
+    """Streaming ZIP of a client's documents - /api/files/{client_id}/bundle.zip"""
+
+    def test_bundle_by_categoria(self, auth_headers, client_id):
+        import io
+        import zipfile
+        rg = os.urandom(50 * 1024)
+        car = os.urandom(10 * 1024)
+        requests.post(f"{BASE_URL}/api/upload/{client_id}", params={"categoria": "rg_cnh"},
+                      files={"file": ("rg.jpg", rg, "image/jpeg")}, headers=auth_headers)
+        requests.post(f"{BASE_URL}/api/upload/{client_id}",
+                      files={"file": ("car.dat", car, "application/octet-stream")}, headers=auth_headers)
+        response = requests.put(f"{BASE_URL}/api/files/{client_id}/CAR.DAT/categoria",
+                                json={"categoria": "car"}, headers=auth_headers)
+        assert response.status_code == 200
+
+        response = requests.get(f"{BASE_URL}/api/files/{client_id}/bundle.zip", headers=auth_headers)
+        assert response.status_code == 200
+        assert response.headers["Content-Type"] == "application/zip"
+        names = zipfile.ZipFile(io.BytesIO(response.content)).namelist()
+        assert "RG.JPG" in names and "CAR.DAT" in names
+
+        response = requests.get(f"{BASE_URL}/api/files/{client_id}/bundle.zip", params={"categoria": "rg_cnh"}, headers=auth_headers)
+        bundle = zipfile.ZipFile(io.BytesIO(response.content))
+        assert bundle.namelist() == ["RG.JPG"]
+        assert bundle.read("RG.JPG") == rg
+
+    def test_invalid_categoria(self, auth_headers, client_id):
+        response = requests.get(f"{BASE_URL}/api/files/{client_id}/bundle.zip", params={"categoria": "nope"}, headers=auth_headers)
+        assert response.status_code == 400
+
+
+class TestSignedLink:
+    """Short-lived signed links - /api/files/{client_id}/{filename}/link, /api/download"""
+
+    def test_signed_link(self, auth_headers, client_id):
+        content = b"%PDF-1.4 ccir"
+        requests.post(f"{BASE_URL}/api/upload/{client_id}", files={"file": ("ccir.pdf", content, "application/pdf")}, headers=auth_headers)
+        response = requests.get(f"{BASE_URL}/api/files/{client_id}/CCIR.PDF/link", headers=auth_headers)
+        assert response.status_code == 200
+        url = response.json()["url"]
+
+        # No Authorization header: the signature is enough
+        response = requests.get(f"{BASE_URL}{url}")
+        assert response.status_code == 200
+        assert response.content == content
+
+        response = requests.get(f"{BASE_URL}{url.replace('sig=', 'sig=0')}")
+        assert response.status_code == 403
+
+    def test_link_unknown_file(self, auth_headers, client_id):
+        response = requests.get(f"{BASE_URL}/api/files/{client_id}/NOPE.PDF/link", headers=auth_headers)
+        assert response.status_code == 404
+
+
+class TestStorageUsage:
+    """Per-client usage counters and quotas"""
+
+    def test_usage_and_quota(self, auth_headers):
+        response = requests.post(f"{BASE_URL}/api/clients", json={
+            "nome_completo": "TEST_QUOTA",
+            "cpf": random_cpf(),
+            "telefone": "67999990001"
+        }, headers=auth_headers)
+        cid = response.json()["id"]
+        try:
+            requests.post(f"{BASE_URL}/api/upload/{cid}", files={"file": ("a.pdf", b"x" * 1000, "application/pdf")}, headers=auth_headers)
+            requests.post(f"{BASE_URL}/api/upload/{cid}", files={"file": ("b.pdf", b"y" * 3000, "application/pdf")}, headers=auth_headers)
+            client = requests.get(f"{BASE_URL}/api/clients/{cid}", headers=auth_headers).json()
+            assert client["armazenamento_bytes"] == 4000
+            assert client["armazenamento_arquivos"] == 2
+
+            requests.delete(f"{BASE_URL}/api/files/{cid}/A.PDF", headers=auth_headers)
+            client = requests.get(f"{BASE_URL}/api/clients/{cid}", headers=auth_headers).json()
+            assert client["armazenamento_bytes"] == 3000
+            assert client["armazenamento_arquivos"] == 1
+
+            response = requests.put(f"{BASE_URL}/api/clients/{cid}/cota", json={"cota_mb": 0.01}, headers=auth_headers)
+            assert response.status_code == 200
+            response = requests.post(f"{BASE_URL}/api/upload/{cid}", files={"file": ("c.pdf", os.urandom(20 * 1024), "application/pdf")}, headers=auth_headers)
+            assert response.status_code == 413
+            client = requests.get(f"{BASE_URL}/api/clients/{cid}", headers=auth_headers).json()
+            assert client["armazenamento_bytes"] == 3000
+
+            usage = requests.get(f"{BASE_URL}/api/master/storage", headers=auth_headers).json()
+            assert usage["total"]["bytes"] >= 3000
+        finally:
+            requests.delete(f"{BASE_URL}/api/clients/{cid}", headers=auth_headers)
+
+    def test_concurrent_same_name_counts_once(self, auth_headers):
+        """Parallel uploads replacing each other end up counted as one document"""
+        from concurrent.futures import ThreadPoolExecutor
+        response = requests.post(f"{BASE_URL}/api/clients", json={
+            "nome_completo": "TEST_QUOTA_RACE",
+            "cpf": random_cpf(),
+            "telefone": "67999990002"
+        }, headers=auth_headers)
+        cid = response.json()["id"]
+        try:
+            def upload(n):
+                files = {"file": ("mesmo.pdf", bytes([n]) * (1000 + n), "application/pdf")}
+                return requests.post(f"{BASE_URL}/api/upload/{cid}", files=files, headers=auth_headers)
+            with ThreadPoolExecutor(8) as pool:
+                assert all(r.status_code == 200 for r in pool.map(upload, range(8)))
+
+            listed = requests.get(f"{BASE_URL}/api/files/{cid}", headers=auth_headers).json()["files"]
+            assert len(listed) == 1
+            client = requests.get(f"{BASE_URL}/api/clients/{cid}", headers=auth_headers).json()
+            assert client["armazenamento_arquivos"] == 1
+            assert client["armazenamento_bytes"] == listed[0]["size"]
+        finally:
+            requests.delete(f"{BASE_URL}/api/clients/{cid}", headers=auth_headers)
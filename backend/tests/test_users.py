@@ -0,0 +1,56 @@
+"""
+Test suite for user management - /api/users
+Covers email uniqueness on create and update
+"""
+import pytest
+import requests
+import uuid
+
+from live_api import BASE_URL
+
+
+@pytest.fixture
+def two_users(auth_headers):
+    """Create two throwaway analysts"""
+    created = []
+    for _ in range(2):
+        response = requests.post(f"{BASE_URL}/api/users", json={
+            "nome": "TEST_USER",
+            "email": f"test_{uuid.uuid4().hex[:10]}@example.com",
+            "senha": "teste123",
+            "role": "analista"
+        }, headers=auth_headers)
+        assert response.status_code == 200, response.text
+        created.append(response.json())
+    yield created
+    for user in created:
+        requests.delete(f"{BASE_URL}/api/users/{user['id']}", headers=auth_headers)
+
+
+class TestUserEmailUniqueness:
+    """users.email is unique"""
+
+    def test_create_duplicate_email(self, auth_headers, two_users):
+        response = requests.post(f"{BASE_URL}/api/users", json={
+            "nome": "TEST_USER_DUP",
+            "email": two_users[0]["email"],
+            "senha": "teste123",
+            "role": "analista"
+        }, headers=auth_headers)
+        assert response.status_code == 400
+        assert response.json()["detail"] == "Email já cadastrado"
+
+    def test_update_to_existing_email(self, auth_headers, two_users):
+        """Changing an email to one that is taken is a 400, not a 500"""
+        first, second = two_users
+        response = requests.put(
+            f"{BASE_URL}/api/users/{second['id']}", json={"email": first["email"]}, headers=auth_headers
+        )
+        assert response.status_code == 400
+        assert response.json()["detail"] == "Email já cadastrado"
+
+        # Keeping the same email is not a conflict
+        response = requests.put(
+            f"{BASE_URL}/api/users/{second['id']}", json={"email": second["email"]}, headers=auth_headers
+        )
+        assert response.status_code == 200
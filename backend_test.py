@@ -169,7 +169,7 @@ class AgroLinkAPITester:
         # Create client
         client_data = {
             "nome_completo": "João Silva Teste",
-            "cpf": "12345678901",
+            "cpf": "12345678909",
             "endereco": "Rua Teste, 123, Centro, Cidade - SP",
             "telefone": "11987654321",
             "data_nascimento": "1980-01-01",
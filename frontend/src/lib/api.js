@@ -52,7 +52,15 @@ export const clientsAPI = {
   list: (search) => api.get('/clients', { params: { search } }),
   get: (id) => api.get(`/clients/${id}`),
   create: (data) => api.post('/clients', data),
+  import: (file) => {
+    const formData = new FormData();
+    formData.append('file', file);
+    return api.post('/clients/import', formData, {
+      headers: { 'Content-Type': 'multipart/form-data' },
+    });
+  },
   update: (id, data) => api.put(`/clients/${id}`, data),
+  setQuota: (id, cotaMb) => api.put(`/clients/${id}/cota`, { cota_mb: cotaMb }),
   delete: (id) => api.delete(`/clients/${id}`),
   getHistory: (id) => api.get(`/clients/${id}/history`),
 };
@@ -92,6 +100,22 @@ export const filesAPI = {
   },
   download: (clientId, filename) => api.get(`/files/${clientId}/${filename}`, { responseType: 'blob' }),
   delete: (clientId, filename) => api.delete(`/files/${clientId}/${filename}`),
+  createUploadSession: (clientId, data) => api.post(`/upload/${clientId}/sessions`, data),
+  getUploadSession: (sessionId) => api.get(`/upload-sessions/${sessionId}`),
+  uploadChunk: (sessionId, offset, blob) => api.put(`/upload-sessions/${sessionId}`, blob, {
+    params: { offset },
+    headers: { 'Content-Type': 'application/octet-stream' },
+  }),
+  completeUploadSession: (sessionId) => api.post(`/upload-sessions/${sessionId}/complete`),
+  cancelUploadSession: (sessionId) => api.delete(`/upload-sessions/${sessionId}`),
+  bundle: (clientId, categoria) => api.get(`/files/${clientId}/bundle.zip`, {
+    params: categoria ? { categoria } : {},
+    responseType: 'blob',
+  }),
+  setCategoria: (clientId, filename, categoria) => api.put(`/files/${clientId}/${filename}/categoria`, { categoria }),
+  link: (clientId, filename) => api.get(`/files/${clientId}/${filename}/link`),
+  search: (params) => api.get('/documents', { params }),
+  missing: (nome, status) => api.get('/documents/missing', { params: { nome, status } }),
 };
 
 // Alerts
@@ -108,6 +132,14 @@ export const propostasAPI = {
   list: (params) => api.get('/propostas', { params }),
   get: (id) => api.get(`/propostas/${id}`),
   create: (data) => api.post('/propostas', data),
+  bulkCreate: (propostas) => api.post('/propostas/bulk', propostas),
+  bulkUpload: (file) => {
+    const formData = new FormData();
+    formData.append('file', file);
+    return api.post('/propostas/bulk', formData, {
+      headers: { 'Content-Type': 'multipart/form-data' },
+    });
+  },
   converter: (id) => api.put(`/propostas/${id}/converter`),
   desistir: (id, data) => api.put(`/propostas/${id}/desistir`, data),
   delete: (id) => api.delete(`/propostas/${id}`),
@@ -143,6 +175,7 @@ export const requisitosEtapaAPI = {
 export const localizacaoAPI = {
   getEstados: () => api.get('/estados'),
   getCidades: (estadoSigla) => api.get(`/cidades/${estadoSigla}`),
+  searchCidades: (q, uf, limit) => api.get('/cidades/search', { params: { q, uf, limit } }),
 };
 
 // Config
@@ -163,6 +196,11 @@ export const reportsAPI = {
   summary: (params) => api.get('/reports/summary', { params }),
 };
 
+// Export
+export const exportAPI = {
+  download: (collection, params) => api.get(`/export/${collection}`, { params, responseType: 'blob' }),
+};
+
 // Dashboard
 export const dashboardAPI = {
   stats: () => api.get('/dashboard/stats'),
@@ -171,6 +209,8 @@ export const dashboardAPI = {
 // Master Only
 export const masterAPI = {
   getDataStats: () => api.get('/master/data-stats'),
+  getStorageUsage: (limit) => api.get('/master/storage', { params: { limit } }),
+  recalculateStorage: () => api.post('/master/storage/recalculate'),
   resetAllData: () => api.delete('/master/reset-all-data'),
 };
 
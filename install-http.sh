@@ -174,10 +174,12 @@ server {
         client_max_body_size 50M;
     }
 
-    # Uploads
+    # Documentos dos clientes: acessíveis só via X-Accel-Redirect da API
+    # (FILE_DELIVERY=accel no backend/.env), nunca diretamente pela URL
     location /uploads/ {
+        internal;
         alias ${INSTALL_DIR}/backend/uploads/;
-        expires 30d;
+        add_header Cache-Control "private, no-cache";
     }
 }
 EOF
@@ -167,6 +167,14 @@ server {
         proxy_set_header X-Forwarded-Proto \$scheme;
         client_max_body_size 50M;
     }
+
+    # Documentos dos clientes: acessíveis só via X-Accel-Redirect da API
+    # (FILE_DELIVERY=accel no backend/.env), nunca diretamente pela URL
+    location /uploads/ {
+        internal;
+        alias ${INSTALL_DIR}/backend/uploads/;
+        add_header Cache-Control "private, no-cache";
+    }
 }
 EOF
 